@@ -1,2 +1,3 @@
 import setka.base
 import setka.pipes
+import setka.tools
@@ -15,6 +15,9 @@ class CollectionOperator:
         * Split group of elements from batch using their indices
         * Detach all torch.Tensors from current graph
         * Transfer all torch.Tensors from batch to specific device or dtype
+        * Apply function to all torch.Tensors from batch
+        * Concatenate batches and split batch into chunks of consecutive elements
+        * Select (project) a subset of the collection leaves by their paths
 
     This class support operations with python structures of arbitary nesting depth, performs all operations recursively
     Support is guaranteed for the following structures for data element content:
@@ -69,7 +72,10 @@ class CollectionOperator:
             if item is not None:
                 new_batch.append(item)
         batch=new_batch
-        
+
+        if len(batch) == 0:
+            return None
+
         elem = batch[0]
         elem_type = type(elem)
 
@@ -161,6 +167,9 @@ class CollectionOperator:
                     elements[subkey],
                     [CollectionOperator._get_ik(result, i, key) for i in range(len(result))],
                     subkey, index)
+        elif elements is None:
+            for i in range(len(result)):
+                CollectionOperator._set_ik(result, i, key, None)
         elif isinstance(elements, container_abcs.Sequence):
             for i in range(len(result)):
                 CollectionOperator._set_ik(result, i, key, [None] * len(elements))
@@ -172,6 +181,21 @@ class CollectionOperator:
         else:
             raise ValueError('Cannot split type: ' + str(type(elements)))
 
+    @staticmethod
+    def batch_size(elements):
+        """
+        Returns the batch size of the collection (the length of its first leaf)
+        """
+        cur = elements
+        while not CollectionOperator._is_leaf(cur):
+            if isinstance(cur, container_abcs.Sequence):
+                cur = cur[0]
+            elif isinstance(cur, container_abcs.Mapping):
+                cur = cur[list(cur.keys())[0]]
+            else:
+                raise ValueError('Couldn`t determine batch size from collection')
+        return len(cur)
+
     @staticmethod
     def split(elements, batch_size=None):
         """
@@ -184,16 +208,8 @@ class CollectionOperator:
             seq: sequence of separated batch elements
         """
         if batch_size is None:
-            cur = elements
-            while not CollectionOperator._is_leaf(cur):
-                if isinstance(cur, container_abcs.Sequence):
-                    cur = cur[0]
-                elif isinstance(cur, container_abcs.Mapping):
-                    cur = cur[list(cur.keys())[0]]
-                else:
-                    raise ValueError('Couldn`t determine batch size from collection')
-            batch_size = len(cur)
-            
+            batch_size = CollectionOperator.batch_size(elements)
+
         result = [None] * batch_size
         CollectionOperator._split(elements, result)
         return result
@@ -207,6 +223,47 @@ class CollectionOperator:
         CollectionOperator._split(elements, result, index=index)
         return result
 
+    @staticmethod
+    def select(elements, paths):
+        """
+        Projects collection onto the leaves specified by paths. Path is a tuple of keys (for mappings) and
+        indices (for sequences) leading to the element that should be kept, single key or index is treated
+        as a path of length one, empty tuple selects the whole collection. Sequences keep their length,
+        positions that are not selected are replaced with None. Keys that are not selected are dropped
+        from mappings.
+
+        Arguments:
+            elements: input collection (single element or batch)
+            paths (list): list of paths to keep
+
+        Returns:
+            projected collection
+        """
+        paths = [tuple(path) if isinstance(path, (tuple, list)) else (path,) for path in paths]
+        if len(paths) == 0:
+            return None
+        if any(len(path) == 0 for path in paths):
+            return elements
+
+        heads = {}
+        for path in paths:
+            heads.setdefault(path[0], []).append(path[1:])
+
+        if isinstance(elements, container_abcs.Mapping):
+            output = {}
+            for k in elements:
+                if k in heads:
+                    output[k] = CollectionOperator.select(elements[k], heads[k])
+            return output
+        if isinstance(elements, (tuple, list)):
+            output = [None] * len(elements)
+            for i in range(len(elements)):
+                if i in heads:
+                    output[i] = CollectionOperator.select(elements[i], heads[i])
+            return type(elements)(output)
+
+        raise ValueError('Cannot select paths ' + str(paths) + ' from type: ' + str(type(elements)))
+
     @staticmethod
     def detach(elements):
         """
@@ -246,3 +303,81 @@ class CollectionOperator:
             return elements.to(*args, **kwargs)
 
         return elements
+
+    @staticmethod
+    def apply(elements, f):
+        """
+        Applies function to all tensors from data collection, returns the collection of the results
+        """
+        if isinstance(elements, (tuple, list)):
+            output = []
+            for i in range(len(elements)):
+                output.append(CollectionOperator.apply(elements[i], f))
+            return type(elements)(output)
+        if isinstance(elements, dict):
+            output = {}
+            for k in elements:
+                output[k] = CollectionOperator.apply(elements[k], f)
+            return output
+        if isinstance(elements, torch.Tensor):
+            return f(elements)
+
+        return elements
+
+    @staticmethod
+    def concat(batches):
+        """
+        Concatenates the sequence of batches with the same structure along the batch dimension
+        """
+        elem = batches[0]
+        if isinstance(elem, torch.Tensor):
+            return torch.cat(list(batches), dim=0)
+        if isinstance(elem, np.ndarray):
+            return np.concatenate(batches, axis=0)
+        if CollectionOperator._is_leaf(elem):
+            return [element for batch in batches for element in batch]
+        if isinstance(elem, container_abcs.Mapping):
+            return {k: CollectionOperator.concat([batch[k] for batch in batches]) for k in elem}
+        if isinstance(elem, (tuple, list)):
+            output = []
+            for i in range(len(elem)):
+                output.append(CollectionOperator.concat([batch[i] for batch in batches]))
+            return type(elem)(output)
+        if elem is None:
+            return None
+
+        raise ValueError('Cannot concatenate type: ' + str(type(elem)))
+
+    @staticmethod
+    def _slice(elements, start, end):
+        if CollectionOperator._is_leaf(elements):
+            return elements[start:end]
+        if isinstance(elements, container_abcs.Mapping):
+            return {k: CollectionOperator._slice(elements[k], start, end) for k in elements}
+        if isinstance(elements, (tuple, list)):
+            return type(elements)([CollectionOperator._slice(element, start, end) for element in elements])
+        return elements
+
+    @staticmethod
+    def chunk(elements, chunk_size):
+        """
+        Splits the batch into the sequence of batches of at most ```chunk_size``` consecutive elements
+        """
+        batch_size = CollectionOperator.batch_size(elements)
+        return [CollectionOperator._slice(elements, start, start + chunk_size)
+                for start in range(0, batch_size, chunk_size)]
+
+    @staticmethod
+    def signature(elements):
+        """
+        Returns hashable signature of the data collection: structure, shapes and data types of tensors
+        (types for the other elements).
+        """
+        if isinstance(elements, (tuple, list)):
+            return tuple(CollectionOperator.signature(element) for element in elements)
+        if isinstance(elements, dict):
+            return tuple((k, CollectionOperator.signature(elements[k])) for k in elements)
+        if isinstance(elements, torch.Tensor):
+            return tuple(elements.shape), elements.dtype, elements.device
+
+        return type(elements).__name__
@@ -25,6 +25,11 @@ class Dataset:
             You need to define this function in your class.
 
 
+        * getitem_cached -- optional function with the same arguments as ```getitem```
+            that retrieves the item without the parts that are consumed only by the
+            submodule cached with setka.pipes.FeatureCache (e.g. without the heavy
+            image decoding). It is used when the features of the whole subset are cached.
+
         * getitem -- function that selects
 
         * __len__ -- function that is called when the ```len()```
@@ -1,7 +1,37 @@
+import copy
+import inspect
+import warnings
+import collections
+
+import torch
+import torch.distributed as dist
+
+
 class Optimizer:
     """
     Contains optimizer and the module that this optimizer should optimize together with active state flag.
 
+    With ```flat_buffers``` the parameters of the module that require gradients are coalesced into
+    contiguous flat buffers (one per device and dtype): the parameters and their gradients become views of
+    these buffers and the optimizer works with the flat buffers, so zeroing of the gradients and the
+    optimizer step are performed with a few operations instead of one per parameter tensor. This is
+    only valid for the element-wise optimizers (SGD, Adam, RMSprop, etc.) and for the parameters
+    that require gradients when the Optimizer is created. If the module is moved to another device,
+    the buffers are rebuilt (with the optimizer state moved) on the next ```zero_grad```.
+
+    With ```offload``` the optimizer works with the master copies of the parameters kept in the pinned
+    CPU memory, so the optimizer state is stored on CPU as well. At each step the gradients are copied
+    to the host, the step is made on CPU and the updated parameters are copied back with non-blocking
+    copies. The copies are enqueued on the current streams of the devices of the parameters, so the next
+    forward pass on the device waits for them: only the work of the host (e.g. loading of the next batch)
+    overlaps with the copies, not the computations of the device.
+
+    With ```shard``` the optimizer state is sharded across the ranks of the default process group
+    (ZeRO-1, torch.distributed.optim.ZeroRedundancyOptimizer). The consolidated state is gathered by
+    ```consolidate_state_dict``` (which should be called on all the ranks, setka.pipes.Checkpointer does it)
+    and is saved when the Optimizer is pickled. If the pickled sharded Optimizer is loaded without the
+    initialized process group, it falls back to the regular (not sharded) optimizer with a warning.
+
     Arguments:
         train_module (torch.Module): module to optimize
         optimizer: optimizer class to set up for given module
@@ -10,15 +40,78 @@ class Optimizer:
             iteration. May be useful for Cycling Learning Rate schedulers
         epoch_schedulers (optional, list of schedulers): list of setka.base.Schedulers that will be called after each
             epoch. May be useful for ReduceLROnPlateau schedulers
+        flat_buffers (bool): coalesce parameters and gradients into the flat buffers
+        foreach (bool): if specified, passed to the optimizers that support multi-tensor (foreach) implementation
+        step_policy (callable): function of the trainer that returns True if the optimizer should make a step
+            at the current iteration (see setka.base.EveryN and setka.base.Alternating). It is used only when
+            the optimizer is active.
+        clip_grad_norm (float): if specified, gradients are clipped by the global norm before the step.
+        clip_grad_value (float): if specified, gradients are clipped by value before the step.
+        norm_type (float): type of the norm used for the gradient clipping and statistics.
+        offload (bool): keep the optimizer state and the master parameters in the pinned CPU memory.
+        shard (bool): shard the optimizer state across the ranks of the distributed run.
     """
 
     def __init__(self, train_module, optimizer, iter_schedulers=[], epoch_schedulers=[], is_active=True, recurse=True,
-                 **kwargs):
-        self.optimizer = optimizer(train_module.parameters(recurse=recurse), **kwargs)
+                 flat_buffers=False, foreach=None, step_policy=None, clip_grad_norm=None, clip_grad_value=None,
+                 norm_type=2.0, offload=False, shard=False, **kwargs):
+        if shard and (flat_buffers or offload):
+            raise ValueError('Sharded optimizer can not be used with flat buffers or offload')
+
         self.module = train_module
         self.active = is_active
+        self.step_policy = step_policy
+        self.clip_grad_norm = clip_grad_norm
+        self.clip_grad_value = clip_grad_value
+        self.norm_type = float(norm_type)
         self.epoch_schedulers = epoch_schedulers
         self.iter_schedulers = iter_schedulers
+        self.flat_buffers = flat_buffers
+        self.offload = offload
+        self.shard = shard
+        self.optimizer_c = optimizer
+        self.kwargs = kwargs
+
+        if foreach is not None and 'foreach' in inspect.signature(optimizer).parameters:
+            self.kwargs['foreach'] = foreach
+
+        self.params = list(train_module.parameters(recurse=recurse))
+        self._trainable = [par for par in self.params if par.requires_grad]
+        self._grad_enabled = True
+        self._flat_groups = None
+        self._master = None
+        self._consolidated_state = None
+
+        if self.flat_buffers:
+            groups = collections.OrderedDict()
+            for par in self.params:
+                if par.requires_grad:
+                    groups.setdefault((par.device, par.dtype), []).append(par)
+
+            self._flat_groups = [self._flatten(pars) for pars in groups.values()]
+            self._bind_grads()
+
+        if self.offload:
+            self._master = [self._master_copy(par) for par in self._offloaded_params()]
+
+        self.build()
+
+    def build(self):
+        """
+        Creates the optimizer and the schedulers.
+        """
+        if self.offload:
+            params = self._master
+        elif self.flat_buffers:
+            params = self.device_params()
+        else:
+            params = self.params
+
+        if self.shard:
+            from torch.distributed.optim import ZeroRedundancyOptimizer
+            self.optimizer = ZeroRedundancyOptimizer(params, optimizer_class=self.optimizer_c, **self.kwargs)
+        else:
+            self.optimizer = self.optimizer_c(params, **self.kwargs)
 
         self._epoch_schedulers = []
         for scheduler in self.epoch_schedulers:
@@ -53,8 +146,298 @@ class Optimizer:
         #
         # print(self.schedulers)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.shard:
+            # ZeroRedundancyOptimizer (and the schedulers bound to it) hold the process group, so
+            # the consolidated state is pickled instead and the optimizer is rebuilt on loading.
+            state['optimizer'] = None
+            state['_scheduler_states'] = [None if scheduler.closed_form else scheduler._scheduler.state_dict()
+                                          for scheduler in self._epoch_schedulers + self._iter_schedulers]
+            for key in ['epoch_schedulers', 'iter_schedulers', '_epoch_schedulers', '_iter_schedulers']:
+                state[key] = [self._strip_scheduler(scheduler) for scheduler in state[key]]
+        return state
+
+    def __setstate__(self, state):
+        scheduler_states = state.pop('_scheduler_states', None)
+        self.__dict__.update(state)
+
+        if self.shard:
+            self.epoch_schedulers = self._epoch_schedulers
+            self.iter_schedulers = self._iter_schedulers
+            if not (dist.is_available() and dist.is_initialized()):
+                warnings.warn('The process group is not initialized, the sharded optimizer is loaded '
+                              'as the regular (not sharded) one')
+                self.shard = False
+            self.build()
+
+            if self._consolidated_state is not None:
+                self.optimizer.load_state_dict(self._consolidated_state)
+                self._consolidated_state = None
+            for scheduler, scheduler_state in zip(self._epoch_schedulers + self._iter_schedulers, scheduler_states):
+                if scheduler_state is not None:
+                    scheduler._scheduler.load_state_dict(scheduler_state)
+
+    @staticmethod
+    def _strip_scheduler(scheduler):
+        res = copy.copy(scheduler)
+        if hasattr(res, '_scheduler'):
+            del res._scheduler
+        return res
+
+    @staticmethod
+    def _master_copy(par):
+        master = torch.empty(par.shape, dtype=par.dtype, device='cpu', pin_memory=torch.cuda.is_available())
+        master.copy_(par.detach())
+        return torch.nn.Parameter(master)
+
+    def device_params(self):
+        """
+        Returns the parameters of the module that are used in the forward and backward passes (the flat
+        parameters in case of the flat buffers).
+        """
+        if self._flat_groups is not None:
+            return [flat_param for _, flat_param, _ in self._flat_groups]
+        return self.params
+
+    def sync_master(self):
+        """
+        Copies the values of the parameters to the CPU master copies (in case of the offload).
+        Should be called if the parameters of the module were changed outside of the optimizer.
+        """
+        if self._master is not None:
+            with torch.no_grad():
+                for master, par in zip(self._master, self._offloaded_params()):
+                    master.copy_(par.detach())
+
+    def _offloaded_params(self):
+        if self._flat_groups is not None:
+            return self.device_params()
+        return self._trainable
+
+    def consolidate_state_dict(self):
+        """
+        Gathers the state of the sharded optimizer on the rank 0. Should be called on all the ranks.
+        """
+        if self.shard:
+            self.optimizer.consolidate_state_dict(to=0)
+            if dist.get_rank() == 0:
+                self._consolidated_state = self.optimizer.state_dict()
+            else:
+                self._consolidated_state = None
+
+    def release_state_dict(self):
+        """
+        Releases the consolidated state of the sharded optimizer (after it is saved).
+        """
+        self._consolidated_state = None
+
+    def state_dict(self):
+        """
+        Returns the state of the optimizer (the consolidated one for the sharded optimizer,
+        ```consolidate_state_dict``` should be called first).
+        """
+        if self.shard:
+            return self._consolidated_state
+        return self.optimizer.state_dict()
+
+    def load_state_dict(self, state):
+        """
+        Loads the complete state of the optimizer.
+        """
+        self.optimizer.load_state_dict(state)
+
+    @staticmethod
+    def _flatten(pars):
+        with torch.no_grad():
+            flat = torch.cat([par.detach().reshape(-1) for par in pars])
+
+        flat_param = torch.nn.Parameter(flat)
+        flat_grad = torch.zeros_like(flat)
+
+        offset = 0
+        for par in pars:
+            par.data = flat[offset:offset + par.numel()].view_as(par)
+            offset += par.numel()
+
+        return [pars, flat_param, flat_grad]
+
+    def _bind_grads(self):
+        for pars, flat_param, flat_grad in self._flat_groups:
+            offset = 0
+            for par in pars:
+                par.grad = flat_grad[offset:offset + par.numel()].view_as(par)
+                offset += par.numel()
+            flat_param.grad = flat_grad
+
+    def _replace_param(self, old, new):
+        state = self.optimizer.state.pop(old, None)
+        if state is not None:
+            self.optimizer.state[new] = {
+                key: value.to(new.device) if torch.is_tensor(value) and value.shape == new.shape else value
+                for key, value in state.items()}
+
+        for group in self.optimizer.param_groups:
+            group['params'] = [new if par is old else par for par in group['params']]
+
+    def _check_flat_buffers(self):
+        """
+        Rebuilds the flat buffers if the parameters were moved, rebinds the gradients if they were released.
+        """
+        rebind = False
+        for index, (pars, flat_param, flat_grad) in enumerate(self._flat_groups):
+            if pars[0].data_ptr() != flat_param.data_ptr():
+                new_group = self._flatten(pars)
+                self._replace_param(flat_param, new_group[1])
+                self._flat_groups[index] = new_group
+                rebind = True
+            elif (flat_param.grad is None or pars[0].grad is None or
+                  pars[0].grad.data_ptr() != flat_grad.data_ptr()):
+                rebind = True
+
+        if rebind:
+            self._bind_grads()
+
+    def is_active(self, trainer):
+        """
+        Returns True if the optimizer should make a step at the current iteration of the trainer.
+        """
+        if not self.active:
+            return False
+        if self.step_policy is None:
+            return True
+        return bool(self.step_policy(trainer))
+
+    def set_requires_grad(self, flag):
+        """
+        Enables or disables gradients for the optimized parameters (only for those that required
+        gradients initially). Does nothing if the state is not changed.
+        """
+        if self._grad_enabled != flag:
+            for par in self._trainable:
+                par.requires_grad_(flag)
+            self._grad_enabled = flag
+
+    def zero_grad(self):
+        """
+        Zeros gradients of the optimized parameters.
+        """
+        if self._flat_groups is not None:
+            self._check_flat_buffers()
+            for _, _, flat_grad in self._flat_groups:
+                flat_grad.zero_()
+        elif self.offload:
+            for par in self.params:
+                par.grad = None
+        else:
+            self.optimizer.zero_grad(set_to_none=True)
+
+    def grads(self):
+        """
+        Returns the list of gradients of the optimizer (the flat gradients in case of the flat buffers).
+        """
+        return [par.grad for par in self.device_params() if par.grad is not None]
+
+    @staticmethod
+    def total_norm(tensors, norm_type=2.0):
+        """
+        Computes the norm of the concatenation of the tensors with fused multi-tensor operations
+        (one per device). Returns zero-dimensional tensor, no synchronization with the host is performed.
+        """
+        by_device = collections.OrderedDict()
+        for tensor in tensors:
+            by_device.setdefault(tensor.device, []).append(tensor)
+
+        if len(by_device) == 0:
+            return torch.tensor(0.0)
+
+        device = next(iter(by_device))
+        norms = []
+        for group in by_device.values():
+            norms.extend([norm.to(device) for norm in torch._foreach_norm(group, norm_type)])
+        return torch.linalg.vector_norm(torch.stack(norms), norm_type)
+
+    def grad_norm(self):
+        """
+        Returns the global norm of the gradients as zero-dimensional tensor.
+        """
+        return self.total_norm(self.grads(), self.norm_type)
+
+    def module_grad_norms(self):
+        """
+        Returns the gradient norms of the children of the optimized module.
+        """
+        res = collections.OrderedDict()
+        for name, child in self.module.named_children():
+            grads = [par.grad for par in child.parameters() if par.grad is not None]
+            if len(grads) > 0:
+                res[name] = self.total_norm(grads, self.norm_type)
+        return res
+
+    def clip_grads(self):
+        """
+        Clips the gradients by value and by the global norm (if specified). Returns the global norm of the
+        gradients before clipping by norm or None if the gradients are not clipped by norm.
+        """
+        grads = self.grads()
+        if self.clip_grad_value is not None:
+            torch._foreach_clamp_min_(grads, -self.clip_grad_value)
+            torch._foreach_clamp_max_(grads, self.clip_grad_value)
+
+        if self.clip_grad_norm is None:
+            return None
+
+        norm = self.total_norm(grads, self.norm_type)
+        coef = torch.clamp(self.clip_grad_norm / (norm + 1.0e-6), max=1.0)
+        by_device = collections.OrderedDict()
+        for grad in grads:
+            by_device.setdefault(grad.device, []).append(grad)
+        for device, tensors in by_device.items():
+            torch._foreach_mul_(tensors, coef.to(device))
+        return norm
+
+    def step(self):
+        """
+        Makes the optimizer step. In case of the offload the gradients are copied to the host, the step is made
+        on CPU and the parameters are copied back to the device with non-blocking copies.
+        """
+        if not self.offload:
+            self.optimizer.step()
+            return
+
+        params = self._offloaded_params()
+        with torch.no_grad():
+            for master, par in zip(self._master, params):
+                if par.grad is None:
+                    master.grad = None
+                    continue
+                if master.grad is None:
+                    master.grad = torch.empty(master.shape, dtype=master.dtype, device='cpu',
+                                              pin_memory=master.is_pinned())
+                master.grad.copy_(par.grad, non_blocking=True)
+
+            # the copies of the gradients are enqueued on the current streams of their devices
+            for device in set(par.device for par in params if par.is_cuda):
+                torch.cuda.current_stream(device).synchronize()
+
+            self.optimizer.step()
+
+            for master, par in zip(self._master, params):
+                par.copy_(master, non_blocking=True)
+
+    def set_schedules_step(self, trainer):
+        """
+        Sets the learning rates of the closed-form schedules for the current training iteration
+        (each schedule uses its own horizon, see Scheduler.horizon).
+        """
+        for scheduler in self._iter_schedulers + self._epoch_schedulers:
+            if scheduler.closed_form:
+                scheduler.set_step(self.optimizer, trainer._iteration - 1, scheduler.horizon(trainer))
+
     def step_iter_schedulers(self):
         for scheduler in self._iter_schedulers:
+            if scheduler.closed_form:
+                continue
             if scheduler.monitor is None:
                 scheduler._scheduler.step()
             else:
@@ -63,6 +446,8 @@ class Optimizer:
 
     def step_epoch_schedulers(self):
         for scheduler in self._epoch_schedulers:
+            if scheduler.closed_form:
+                continue
             if scheduler.monitor is None:
                 scheduler._scheduler.step()
             else:
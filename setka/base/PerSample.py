@@ -0,0 +1,26 @@
+from .CollectionOperator import CollectionOperator
+
+
+class PerSample:
+    """
+    Wraps the per-sample function ```f(one_input, one_output)``` into the batch-level callback
+    ```batch_f(inputs, outputs, ids)``` that returns the dict {id: result}. The samples are copied out of the
+    batch with ```CollectionOperator.split_index```, so a vectorized batch-level callback should be preferred
+    for the heavy postprocessing. If ```f``` is None, the outputs of the samples are returned.
+
+    Args:
+        f (callable): per-sample function.
+    """
+    def __init__(self, f=None):
+        self.f = f
+
+    def __call__(self, inputs, outputs, ids):
+        res = {}
+        for index in range(len(ids)):
+            one_output = CollectionOperator.split_index(outputs, index)[0]
+            if self.f is None:
+                res[ids[index]] = one_output
+            else:
+                one_input = CollectionOperator.split_index(inputs, index)[0]
+                res[ids[index]] = self.f(one_input, one_output)
+        return res
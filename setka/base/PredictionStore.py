@@ -0,0 +1,196 @@
+import os
+import json
+import numpy
+import torch
+
+
+class PredictionStore:
+    """
+    Appendable storage of the predictions with the random access by id.
+
+    The outputs of the batches (tensors or nested lists, tuples and dicts of tensors with the batch as the
+    first dimension) are appended to the preallocated memory-mapped numpy arrays split into shards of
+    ```shard_size``` samples (one file per field of the output and per shard). The position of each
+    sample is appended to ```index.jsonl``` after its data is written, so the store may be read
+    (by other processes as well) while it is being written: ```refresh``` loads the new entries
+    of the index.
+
+    Files in the ```path``` directory:
+        meta.json -- structure of the output, data types and shapes of the fields, shard size;
+        index.jsonl -- lines {"id": id, "shard": shard, "row": row};
+        <field>.<shard>.npy -- shards of the fields.
+
+    Args:
+        path (str): directory of the store. If it contains a store, new predictions are appended to it.
+        shard_size (int): number of samples in a shard.
+    """
+    def __init__(self, path, shard_size=65536):
+        self.path = path
+        self.shard_size = shard_size
+
+        self.meta = None
+        self.index = {}
+        self.n_rows = 0
+        self.index_offset = 0
+        self.shards = {}
+        self.writable = {}
+
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        self.refresh()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['shards'] = {}
+        state['writable'] = {}
+        return state
+
+    @staticmethod
+    def _flatten(output, prefix=''):
+        if isinstance(output, (tuple, list)):
+            fields, structure = [], []
+            for index, element in enumerate(output):
+                cur_fields, cur_structure = PredictionStore._flatten(element, f'{prefix}{index}.')
+                fields.extend(cur_fields)
+                structure.append(cur_structure)
+            return fields, structure
+        if isinstance(output, dict):
+            fields, structure = [], {}
+            for key in output:
+                cur_fields, cur_structure = PredictionStore._flatten(output[key], f'{prefix}{key}.')
+                fields.extend(cur_fields)
+                structure[str(key)] = cur_structure
+            return fields, structure
+        if isinstance(output, torch.Tensor):
+            output = output.detach().cpu()
+            if output.dtype == torch.bfloat16:
+                output = output.float()
+            output = output.numpy()
+        if isinstance(output, numpy.ndarray):
+            name = prefix[:-1] if len(prefix) > 0 else 'output'
+            return [(name, output)], name
+
+        raise ValueError('Cannot store element of type: ' + str(type(output)))
+
+    @staticmethod
+    def _unflatten(structure, values):
+        if isinstance(structure, list):
+            return [PredictionStore._unflatten(element, values) for element in structure]
+        if isinstance(structure, dict):
+            return {key: PredictionStore._unflatten(structure[key], values) for key in structure}
+        return values[structure]
+
+    def _shard_path(self, field, shard):
+        return os.path.join(self.path, f'{field}.{shard:05d}.npy')
+
+    def _get_shard(self, field, shard, writable=False):
+        cache = self.writable if writable else self.shards
+        key = (field, shard)
+        if key not in cache:
+            fname = self._shard_path(field, shard)
+            if writable and not os.path.exists(fname):
+                info = self.meta['fields'][field]
+                cache[key] = numpy.lib.format.open_memmap(
+                    fname, mode='w+', dtype=numpy.dtype(info['dtype']), shape=(self.shard_size, *info['shape']))
+            else:
+                cache[key] = numpy.load(fname, mmap_mode='r+' if writable else 'r')
+        return cache[key]
+
+    def refresh(self):
+        """
+        Loads the new entries of the index (written since the last refresh, possibly by another process).
+        """
+        meta_path = os.path.join(self.path, 'meta.json')
+        if self.meta is None and os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+            self.shard_size = self.meta['shard_size']
+
+        index_path = os.path.join(self.path, 'index.jsonl')
+        if not os.path.exists(index_path):
+            return
+
+        with open(index_path, 'rb') as f:
+            f.seek(self.index_offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                entry = json.loads(line.decode())
+                self.index[entry['id']] = (entry['shard'], entry['row'])
+                self.n_rows = max(self.n_rows, entry['shard'] * self.shard_size + entry['row'] + 1)
+                self.index_offset += len(line)
+
+    def write(self, ids, output):
+        """
+        Appends the outputs of the batch with the given ids.
+        """
+        fields, structure = self._flatten(output)
+
+        if self.meta is None:
+            self.meta = {
+                'shard_size': self.shard_size,
+                'structure': structure,
+                'fields': {name: {'dtype': value.dtype.str, 'shape': list(value.shape[1:])} for name, value in fields}
+            }
+            tmp_path = os.path.join(self.path, 'meta.json.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(self.meta, f)
+            os.replace(tmp_path, os.path.join(self.path, 'meta.json'))
+
+        ids = [id.item() if hasattr(id, 'item') else id for id in ids]
+
+        entries = []
+        start = 0
+        while start < len(ids):
+            shard, row = divmod(self.n_rows, self.shard_size)
+            count = min(len(ids) - start, self.shard_size - row)
+
+            for name, value in fields:
+                self._get_shard(name, shard, writable=True)[row:row + count] = value[start:start + count]
+
+            for index in range(count):
+                entries.append({'id': ids[start + index], 'shard': shard, 'row': row + index})
+                self.index[ids[start + index]] = (shard, row + index)
+
+            self.n_rows += count
+            start += count
+
+        with open(os.path.join(self.path, 'index.jsonl'), 'a') as f:
+            lines = ''.join(json.dumps(entry) + '\n' for entry in entries)
+            f.write(lines)
+        self.index_offset += len(lines.encode())
+
+    def flush(self):
+        for shard in self.writable.values():
+            shard.flush()
+
+    def close(self):
+        self.flush()
+        self.writable = {}
+        self.shards = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, id):
+        if id not in self.index:
+            self.refresh()
+        return id in self.index
+
+    def ids(self):
+        self.refresh()
+        return list(self.index.keys())
+
+    def __getitem__(self, id):
+        """
+        Returns the stored output of the sample (with the structure of the batch output) as tensors.
+        """
+        if id not in self.index:
+            self.refresh()
+        shard, row = self.index[id]
+
+        values = {}
+        for name in self.meta['fields']:
+            values[name] = torch.from_numpy(numpy.array(self._get_shard(name, shard)[row]))
+        return self._unflatten(self.meta['structure'], values)
@@ -1,18 +1,116 @@
+import math
+
+
 class Scheduler:
     '''
     Proxy for learning rate scheduling to use with setka.base.Optimizer.
+
+    If ```scheduler_c``` is a string, the closed-form schedule is used: the learning rate is computed directly
+    from the global training step (self.trainer._iteration) as ```base_lr * factor(step, total_steps)```,
+    so it does not depend on the number of the scheduler calls and is exactly reproduced after the resume.
+    The following schedules are supported (all with optional linear warmup):
+        'linear': linear decay to ```min_factor```;
+        'cosine': cosine decay to ```min_factor```;
+        'polynomial': polynomial decay with the ```power``` to ```min_factor```;
+        'one_cycle': cosine growth from ```1 / div_factor``` during ```pct_start``` of the steps,
+            then cosine decay to ```min_factor``` (warmup is not used).
+
     Args:
-        scheduler_c (torch.optim.lr_scheduler.Scheduler): class of the scheduler to use.
+        scheduler_c (torch.optim.lr_scheduler.Scheduler or str): class of the scheduler to use or
+            the name of the closed-form schedule.
         *args: list of arguments supported by scheduler_c (without optimizer instance)
         monitor: callable -- a function that returns the value that the scheduler will monitor.
-        **kwargs: dict of arguments supported by scheduler_c
+        **kwargs: dict of arguments supported by scheduler_c. For the closed-form schedules:
+            warmup_steps (int, default 0), total_steps (int, default is the number of epochs of the first
+            Trainer.run_train multiplied by the number of iterations in the training epoch; it is resolved once
+            and kept in the scheduler, so the schedule does not change when the training is resumed or extended
+            with another run_train, specify total_steps explicitly to span such runs), min_factor (float, default 0.0),
+            power (float, default 1.0), pct_start (float, default 0.3), div_factor (float, default 25.0).
     '''
+    schedules = ['linear', 'cosine', 'polynomial', 'one_cycle']
+
     def __init__(self, scheduler_c, monitor=None, *args, **kwargs):
         self.scheduler_c = scheduler_c
         self.args = args
         self.kwargs = kwargs
         self.monitor = monitor
 
+        self.closed_form = isinstance(scheduler_c, str)
+        if self.closed_form:
+            if scheduler_c not in self.schedules:
+                raise ValueError(f'Unknown schedule {scheduler_c}, supported: {", ".join(self.schedules)}')
+
+            self.warmup_steps = kwargs.pop('warmup_steps', 0)
+            self.total_steps = kwargs.pop('total_steps', None)
+            self.min_factor = kwargs.pop('min_factor', 0.0)
+            self.power = kwargs.pop('power', 1.0)
+            self.pct_start = kwargs.pop('pct_start', 0.3)
+            self.div_factor = kwargs.pop('div_factor', 25.0)
+            self.resolved_steps = None
+
+            if len(kwargs) > 0:
+                raise ValueError(f'Unknown arguments of the closed-form schedule: {", ".join(kwargs)}')
+
     def build(self, optimizer):
+        if self.closed_form:
+            self.base_lrs = []
+            for group in optimizer.param_groups:
+                group.setdefault('initial_lr', group['lr'])
+                self.base_lrs.append(group['initial_lr'])
+            return self
+
         self._scheduler = self.scheduler_c(optimizer, *self.args, **self.kwargs)
         return self
+
+    @staticmethod
+    def anneal(start, end, progress):
+        return end + (start - end) * 0.5 * (1.0 + math.cos(math.pi * progress))
+
+    def factor(self, step, total):
+        '''
+        Returns the multiplier of the base learning rate for the step (counting from zero) of total steps.
+        '''
+        total = max(total, 1)
+
+        if self.scheduler_c == 'one_cycle':
+            up = max(int(self.pct_start * total), 1)
+            if step < up:
+                return self.anneal(1.0 / self.div_factor, 1.0, step / up)
+            return self.anneal(1.0, self.min_factor, min((step - up) / max(total - up, 1), 1.0))
+
+        if step < self.warmup_steps:
+            return (step + 1) / self.warmup_steps
+
+        progress = min((step - self.warmup_steps) / max(total - self.warmup_steps, 1), 1.0)
+
+        if self.scheduler_c == 'linear':
+            return 1.0 - (1.0 - self.min_factor) * progress
+        if self.scheduler_c == 'cosine':
+            return self.anneal(1.0, self.min_factor, progress)
+        return self.min_factor + (1.0 - self.min_factor) * (1.0 - progress) ** self.power
+
+    def horizon(self, trainer):
+        '''
+        Returns the total number of steps of the closed-form schedule for the training run of the trainer.
+        '''
+        if self.total_steps is not None:
+            return self.total_steps
+
+        if self.resolved_steps is None:
+            n_epochs = getattr(trainer, '_n_epochs', None)
+            if n_epochs is None:
+                raise ValueError('The length of the training is unknown (the epoch is run outside of '
+                                 'Trainer.run_train), specify total_steps of the schedule')
+            self.resolved_steps = n_epochs * trainer._n_iterations
+        return self.resolved_steps
+
+    def set_step(self, optimizer, step, total=None):
+        '''
+        Sets the learning rates of the optimizer for the step of the closed-form schedule.
+        '''
+        if total is None:
+            total = self.total_steps
+
+        factor = self.factor(step, total)
+        for group, base_lr in zip(optimizer.param_groups, self.base_lrs):
+            group['lr'] = base_lr * factor
@@ -0,0 +1,33 @@
+class EveryN:
+    """
+    Step policy for setka.base.Optimizer: the optimizer makes a step every n training iterations.
+
+    Args:
+        n (int): interval between the steps.
+        offset (int): iteration (counting from zero) of the first step.
+    """
+    def __init__(self, n, offset=0):
+        self.n = n
+        self.offset = offset
+
+    def __call__(self, trainer):
+        return (trainer._iteration - 1 - self.offset) % self.n == 0
+
+
+class Alternating:
+    """
+    Step policy for setka.base.Optimizer: the optimizers from several groups make steps in turns
+    (for example, the discriminator and the generator of GAN).
+
+    Args:
+        index (int): index of the group of the optimizer.
+        n_groups (int): number of the groups.
+        period (int): number of successive iterations for each group.
+    """
+    def __init__(self, index, n_groups=2, period=1):
+        self.index = index
+        self.n_groups = n_groups
+        self.period = period
+
+    def __call__(self, trainer):
+        return ((trainer._iteration - 1) // self.period) % self.n_groups == self.index
@@ -2,6 +2,7 @@ import collections
 import numpy
 import pandas
 import datetime
+import torch
 
 from .CollectionOperator import CollectionOperator
 
@@ -123,9 +124,15 @@ class Trainer:
 
             self._epoch_iteration += 1
 
+        # the stage guard (e.g. set by setka.pipes.MemoryGuard) runs the stages of the batch itself
+        guard = getattr(self, '_stage_guard', None)
+
         res = []
         for stage in self._batch_flow:
-            res.extend(self._traverse_pipes(stage, action=action))
+            if action != 'view' and guard is not None:
+                guard(stage, lambda: self._traverse_pipes(stage, action=action))
+            else:
+                res.extend(self._traverse_pipes(stage, action=action))
 
         return res
 
@@ -138,6 +145,57 @@ class Trainer:
     def run_batch(self):
         self._traverse_batch(action='run')
 
+    def run_predict(self, subset='test', sink=None, batch_size=None, n_iterations=None):
+        """
+        Runs the inference over the subset in the 'test' mode. Only the pipes with the ```inference```
+        attribute set (DatasetHandler, ModelHandler, UseCuda, SaveResult, weight averaging pipes, etc.)
+        are used, each batch is processed under ```torch.inference_mode```.
+
+        :param subset: subset of the dataset to process.
+        :param sink: callable or object with the ```write``` method that receives ```(ids, output)``` of
+            each batch. If None, the generator of ```(ids, output)``` is returned.
+        :param batch_size: batch size to use instead of the batch size of the DatasetHandler (e.g. a larger one).
+        :param n_iterations: maximum number of batches to process.
+        :return: the sink or the generator (if sink is None).
+        """
+        batches = self._predict(subset=subset, batch_size=batch_size, n_iterations=n_iterations)
+        if sink is None:
+            return batches
+
+        write = sink.write if hasattr(sink, 'write') else sink
+        for ids, output in batches:
+            write(ids, output)
+        return sink
+
+    def _predict(self, subset, batch_size, n_iterations):
+        capture = _PredictionCapture()
+        capture.trainer = self
+
+        pipes = self._pipes
+        self._pipes = [pipe for pipe in pipes if getattr(pipe, 'inference', False)] + [capture]
+        self._batch_size = batch_size
+
+        self._epoch_iteration = 0
+        self._mode = 'test'
+        self._subset = subset
+        self._n_iterations = n_iterations
+
+        try:
+            with torch.inference_mode():
+                self._run_pipes('before_epoch')
+
+            while self._epoch_iteration < self._n_iterations:
+                with torch.inference_mode():
+                    self.run_batch()
+                yield capture.ids, capture.output
+                capture.ids, capture.output = None, None
+
+            with torch.inference_mode():
+                self._run_pipes('after_epoch')
+        finally:
+            self._pipes = pipes
+            self._batch_size = None
+
     def view_train(self):
         res = pandas.DataFrame(self._traverse_train(action='view'))
         res.columns = ['priority', 'action', 'description']
@@ -169,3 +227,19 @@ class Trainer:
         pipe.trainer = self
         pipe.on_init()
         self._pipes.append(pipe)
+
+
+class _PredictionCapture:
+    """
+    Captures the ids and the outputs of the batches for Trainer.run_predict.
+    """
+    priority = 0
+
+    def __init__(self):
+        self.trainer = None
+        self.ids = None
+        self.output = None
+
+    def after_batch(self):
+        self.ids = self.trainer._ids
+        self.output = self.trainer._output
@@ -2,6 +2,11 @@ from .Dataset import Dataset
 from .Optimizer import Optimizer
 from .Trainer import Trainer
 from .CollectionOperator import CollectionOperator
+from .PerSample import PerSample
 from .Scheduler import Scheduler
+from .PredictionStore import PredictionStore
+from .StepPolicy import EveryN, Alternating
 
 from .environment_setup import environment_setup, collect_random_states, set_random_states
+from .memory_tracking import model_device, reset_peak_memory, peak_memory, rss_memory, is_out_of_memory
+from .compilation import compile_callable
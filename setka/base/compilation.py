@@ -0,0 +1,36 @@
+import warnings
+
+import torch
+
+from setka.base.memory_tracking import is_out_of_memory
+
+
+def compile_callable(fn, args, use_compile=True, name='model'):
+    """
+    Compiles the callable (the model or the criterion) with torch.compile (if ```use_compile``` and it is
+    available), falls back to torch.jit.trace on the example ```args``` and to the eager callable with a
+    warning. The result is run on ```args```.
+
+    Only RuntimeError (the errors of dynamo, inductor and tracing derive from it) and TypeError (the
+    arguments that can not be traced) lead to the fallback, the out-of-memory errors are raised.
+
+    Returns:
+        tuple: the compiled (or eager) callable, its output and the last error (None if it is compiled).
+    """
+    builders = []
+    if use_compile and hasattr(torch, 'compile'):
+        builders.append(lambda: torch.compile(fn))
+    builders.append(lambda: torch.jit.trace(fn, args, check_trace=False))
+
+    error = None
+    for builder in builders:
+        try:
+            compiled = builder()
+            return compiled, compiled(*args), None
+        except (RuntimeError, TypeError) as e:
+            if is_out_of_memory(e):
+                raise
+            error = e
+
+    warnings.warn(f'Compilation of the {name} failed, the eager {name} is used: ' + repr(error))
+    return fn, fn(*args), error
@@ -0,0 +1,72 @@
+import os
+import torch
+
+
+# peaks (in MB) of the CUDA devices before the nested resets, see reset_peak_memory
+_outer_peaks = {}
+
+
+def model_device(model):
+    """
+    Returns the device of the first parameter of the model (CPU if the model has no parameters).
+    """
+    for par in model.parameters():
+        return par.device
+    return torch.device('cpu')
+
+
+def reset_peak_memory(device, nested=False):
+    """
+    Resets the peak memory statistics of the CUDA device. Does nothing for the other devices.
+
+    A nested reset (e.g. the per-stage one of setka.pipes.MemoryGuard) keeps the peak measured so far,
+    so ```peak_memory(device)``` still returns the peak since the last normal reset, while
+    ```peak_memory(device, nested=True)``` returns the peak since the last nested reset.
+    """
+    device = torch.device(device)
+    if device.type == 'cuda' and torch.cuda.is_available():
+        if nested:
+            _outer_peaks[device] = max(_outer_peaks.get(device, 0.0), torch.cuda.max_memory_allocated(device) / 2 ** 20)
+        else:
+            _outer_peaks[device] = 0.0
+        torch.cuda.reset_peak_memory_stats(device)
+
+
+def peak_memory(device, nested=False):
+    """
+    Returns the peak memory (in MB) allocated by the tensors on the CUDA device since the last reset
+    or None for the other devices.
+    """
+    device = torch.device(device)
+    if device.type == 'cuda' and torch.cuda.is_available():
+        peak = torch.cuda.max_memory_allocated(device) / 2 ** 20
+        return peak if nested else max(peak, _outer_peaks.get(device, 0.0))
+    return None
+
+
+def rss_memory():
+    """
+    Returns the resident set size of the process (in MB). Falls back to the peak resident set size
+    if the current one is not available (non-Linux systems).
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+
+def is_out_of_memory(error):
+    """
+    Checks whether the exception is the out-of-memory error of the device.
+    """
+    oom_type = getattr(torch.cuda, 'OutOfMemoryError', None)
+    if oom_type is not None and isinstance(error, oom_type):
+        return True
+    return isinstance(error, RuntimeError) and 'out of memory' in str(error)
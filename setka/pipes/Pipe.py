@@ -29,7 +29,10 @@ class Pipe:
         ```validate_one_epoch```, ```predict```)
 
     * set_trainer(self, trainer) -- method that links the trainer to the pipe.
+
+    The class attribute ```inference``` marks the pipes that are used by ```Trainer.run_predict```.
     """
+    inference = False
 
     def __init__(self):
         self.trainer = None
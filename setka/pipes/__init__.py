@@ -5,6 +5,9 @@ from setka.pipes.basic.ComputeMetrics import ComputeMetrics
 from setka.pipes.basic.DatasetHandler import DatasetHandler
 from setka.pipes.basic.ModelHandler import ModelHandler
 from setka.pipes.basic.UseCuda import UseCuda
+from setka.pipes.basic.MemoryGuard import MemoryGuard
+from setka.pipes.basic.FeatureCache import FeatureCache
+from setka.pipes.basic.TestTimeAugmentation import TestTimeAugmentation
 
 from setka.pipes.logging.Logger import Logger
 from setka.pipes.logging.Checkpointer import Checkpointer
@@ -14,5 +17,9 @@ from setka.pipes.logging.ProgressBar import ProgressBar
 import setka.pipes.logging.progressbar
 
 from setka.pipes.optimization.LossHandler import LossHandler
+from setka.pipes.optimization.LossWeighting import UncertaintyWeighting, DynamicWeightAverage
 from setka.pipes.optimization.OneStepOptimizers import OneStepOptimizers
 from setka.pipes.optimization.WeightAveraging import WeightAveraging
+from setka.pipes.optimization.StochasticWeightAveraging import StochasticWeightAveraging
+from setka.pipes.optimization.EarlyStopping import EarlyStopping
+from setka.pipes.optimization.LRFinder import LRFinder
@@ -1,4 +1,5 @@
 import copy
+import statistics
 import torch
 import torch.utils
 import collections
@@ -34,15 +35,42 @@ class ComputeMetrics(Pipe):
         each of the enumerators by its denominator and then average
         (case of ```divide_first``` for the metric is set to True).
 
+    Note: metrics may declare which parts of the input and output they read
+        by setting ```input_paths``` and ```output_paths``` attributes (lists of
+        paths in terms of ```CollectionOperator.select```). For example:
+        ```
+        def acc(output, input):
+            return (output.argmax(dim=1) == input[1]).float().mean()
+        acc.input_paths = [(1,)]
+        acc.output_paths = [()]
+        ```
+        If all the metrics declare their paths, only the declared leaves are
+        retained between the metric evaluations. Leaves that are not
+        selected are passed to the metrics as None. If any of the metrics
+        does not declare its paths, the whole collection is retained.
+
+    Note: together with the metric values the pipe reports the number of
+        samples the metrics were computed on and an approximate half-width of the
+        confidence interval of each metric. The interval is estimated from the
+        spread of the metric values computed on the separate chunks of
+        ```steps_to_compute``` batches, so at least two chunks are needed
+        (infinity is reported otherwise). The values are stored in
+        ```trainer._avg_metrics_ci``` and ```trainer._avg_metrics_samples``` during the
+        epoch and in ```trainer._metrics_ci[subset]``` and
+        ```trainer._metrics_samples[subset]``` when the validation epoch ends.
+
     Args:
         metrics (list of callable, required): list of metric functions to compute.
         divide_first (list of bool, not required): list of flags indicating that the
             division should be performed before the reduce.
         steps_to_compute (int): indicates how often the metrics values should be updated
+        confidence (float): confidence level of the reported confidence intervals
     """
-    def __init__(self, metrics, divide_first=None, reduce=None, steps_to_compute=1):
+    def __init__(self, metrics, divide_first=None, reduce=None, steps_to_compute=1, confidence=0.95):
         super(ComputeMetrics, self).__init__()
         self.steps_to_compute = steps_to_compute
+        self.confidence = confidence
+        self.z = statistics.NormalDist().inv_cdf(0.5 + 0.5 * confidence)
         self.metrics = metrics
         self.names = []
         self.eps = 1e-12
@@ -50,6 +78,9 @@ class ComputeMetrics(Pipe):
         for index in range(len(self.metrics)):
             self.names.append(self.metrics[index].__name__)
 
+        self.input_paths = self.collect_paths('input_paths')
+        self.output_paths = self.collect_paths('output_paths')
+
         if divide_first is None:
             self.divide_first = [True] * len(self.metrics)
         else:
@@ -68,14 +99,31 @@ class ComputeMetrics(Pipe):
             
         self.steps = 0
         self.avg_values = {}
+        self.ci_values = {}
         self.enumerators = None
         self.denominators = None
+        self.chunk_stats = None
+        self.n_samples = 0
         self.inputs = None
         self.outputs = None
 
+    def collect_paths(self, attribute):
+        """
+        Returns union of the paths declared by the metrics or None if
+        any of the metrics does not declare them.
+        """
+        paths = []
+        for metric in self.metrics:
+            if not hasattr(metric, attribute):
+                return None
+            paths.extend(getattr(metric, attribute))
+        return paths
+
     def reset(self):
         self.enumerators = [None] * len(self.metrics)
         self.denominators = [None] * len(self.metrics)
+        self.chunk_stats = [None] * len(self.metrics)
+        self.n_samples = 0
 
     def before_epoch(self):
         """
@@ -94,8 +142,55 @@ class ComputeMetrics(Pipe):
 
         self.steps = 0
         self.trainer._avg_metrics = {}
+        self.trainer._avg_metrics_ci = {}
+        self.trainer._avg_metrics_samples = 0
+
+    def average(self, index, enum, denom):
+        """
+        Computes the value of the metric with the specified index from its enumerator(s) and denominator(s).
+        """
+        if self.reduce[index]:
+            if self.divide_first[index]:
+                return float((enum / (denom + self.eps)).mean())
+            return float(enum.sum() / (denom.sum() + self.eps))
+
+        res = []
+        for inner_index in range(len(enum)):
+            res.append(enum[inner_index] / (denom[inner_index] + self.eps))
+        return res
+
+    def update_chunk_stats(self, index, value, weight):
+        """
+        Accumulates weighted sums of the metric values computed on separate chunks.
+        """
+        value = numpy.asarray(value, dtype='float64')
+        if self.chunk_stats[index] is None:
+            self.chunk_stats[index] = [0.0, numpy.zeros_like(value), numpy.zeros_like(value), 0]
+
+        stats = self.chunk_stats[index]
+        stats[0] += weight
+        stats[1] = stats[1] + weight * value
+        stats[2] = stats[2] + weight * value ** 2
+        stats[3] += 1
+
+    def half_width(self, index):
+        """
+        Returns half-width of the confidence interval for the metric with the specified index.
+        """
+        weight, weighted_sum, weighted_sq_sum, n_chunks = self.chunk_stats[index]
+        if n_chunks < 2 or weight <= 0:
+            res = numpy.full_like(weighted_sum, numpy.inf)
+        else:
+            mean = weighted_sum / weight
+            var = numpy.maximum(weighted_sq_sum / weight - mean ** 2, 0.0)
+            res = self.z * numpy.sqrt(var / (n_chunks - 1))
+
+        if self.reduce[index]:
+            return float(res)
+        return res.tolist()
 
     def evaluate(self):
+        chunk_size = len(self.inputs)
         self.inputs = self.trainer.collection_op.collate_fn(self.inputs)
         self.outputs = self.trainer.collection_op.collate_fn(self.outputs)
         
@@ -119,6 +214,8 @@ class ComputeMetrics(Pipe):
                 enum *= batch_size
                 denom *= batch_size
 
+            self.update_chunk_stats(index, self.average(index, enum, denom), chunk_size)
+
             if self.enumerators[index] is None:
                 self.enumerators[index] = enum
                 self.denominators[index] = denom
@@ -127,17 +224,12 @@ class ComputeMetrics(Pipe):
                 self.denominators[index] += denom
 
         self.avg_values.clear()
+        self.ci_values.clear()
 
         for index in range(len(self.enumerators)):
-            if self.reduce[index]:
-                if self.divide_first[index]:
-                    self.avg_values[self.names[index]] = float((self.enumerators[index] / (self.denominators[index] + self.eps)).mean())
-                else:
-                    self.avg_values[self.names[index]] = float(self.enumerators[index].sum() / (self.denominators[index].sum() + self.eps))
-            else:
-                self.avg_values[self.names[index]] = []
-                for inner_index in range(len(self.enumerators[index])):
-                    self.avg_values[self.names[index]].append(self.enumerators[index][inner_index] / (self.denominators[index][inner_index] + self.eps))
+            self.avg_values[self.names[index]] = self.average(
+                index, self.enumerators[index], self.denominators[index])
+            self.ci_values[self.names[index]] = self.half_width(index)
 
         del self.inputs
         del self.outputs
@@ -149,9 +241,17 @@ class ComputeMetrics(Pipe):
         if not 'Metrics' in self.trainer.status:
             self.trainer.status['Metrics'] = collections.OrderedDict()
 
+        if not 'Metrics CI' in self.trainer.status:
+            self.trainer.status['Metrics CI'] = collections.OrderedDict()
+
         for x in self.avg_values:
             self.trainer.status['Metrics'][x] = self.avg_values[x]
+            self.trainer.status['Metrics CI'][x] = self.ci_values[x]
             self.trainer._avg_metrics[x] = self.avg_values[x]
+            self.trainer._avg_metrics_ci[x] = self.ci_values[x]
+
+        self.trainer.status['Metrics CI']['Samples'] = self.n_samples
+        self.trainer._avg_metrics_samples = self.n_samples
 
     def after_batch(self):
         """
@@ -159,12 +259,20 @@ class ComputeMetrics(Pipe):
         """
         if self.trainer._mode in ('train', 'valid'):
             self.steps += 1
-            self.outputs.extend(
-                self.trainer.collection_op.split(
-                    self.trainer.collection_op.detach(self.trainer._output)))
-            self.inputs.extend(
-                self.trainer.collection_op.split(
-                    self.trainer.collection_op.detach(self.trainer._input)))
+            collection_op = self.trainer.collection_op
+            batch_size = len(self.trainer._ids)
+            self.n_samples += batch_size
+
+            output = self.trainer._output
+            if self.output_paths is not None:
+                output = collection_op.select(output, self.output_paths)
+
+            input = self.trainer._input
+            if self.input_paths is not None:
+                input = collection_op.select(input, self.input_paths)
+
+            self.outputs.extend(collection_op.split(collection_op.detach(output), batch_size))
+            self.inputs.extend(collection_op.split(collection_op.detach(input), batch_size))
         
             if self.steps >= self.steps_to_compute:
                 self.evaluate()
@@ -181,6 +289,17 @@ class ComputeMetrics(Pipe):
             if not hasattr(self.trainer, '_metrics'):
                 self.trainer._metrics = {}
             self.trainer._metrics[self.trainer._subset] = copy.deepcopy(self.avg_values)
+
+            if not hasattr(self.trainer, '_metrics_ci'):
+                self.trainer._metrics_ci = {}
+            self.trainer._metrics_ci[self.trainer._subset] = copy.deepcopy(self.ci_values)
+
+            if not hasattr(self.trainer, '_metrics_samples'):
+                self.trainer._metrics_samples = {}
+            self.trainer._metrics_samples[self.trainer._subset] = self.n_samples
         self.avg_values.clear()
+        self.ci_values.clear()
         self.reset()
         self.trainer._avg_metrics = {}
+        self.trainer._avg_metrics_ci = {}
+        self.trainer._avg_metrics_samples = 0
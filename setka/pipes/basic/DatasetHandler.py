@@ -31,24 +31,55 @@ def fractal_order(size):
     return order
 
 
+def subsample_indices(size, subsample, seed=0):
+    """
+    Returns sorted indices of a fixed random subsample of the dataset of the given size.
+    The subsample is specified either by a fraction (float) or by a number of samples (int).
+    The same indices are returned for the same arguments.
+    """
+    if isinstance(subsample, float):
+        count = int(math.ceil(subsample * size))
+    else:
+        count = int(subsample)
+    count = min(max(count, 1), size)
+
+    return numpy.sort(numpy.random.RandomState(seed).permutation(size)[:count])
+
+
 class DatasetWrapper:
-    def __init__(self, dataset, name):
+    def __init__(self, dataset, name, indices=None, cached=False):
         self.dataset = dataset
         self.name = name
+        self.indices = indices
+        self.cached = cached
 
-        self.order = fractal_order(len(self.dataset))
+        self.order = fractal_order(len(self))
 
     def __len__(self):
+        if self.indices is not None:
+            return len(self.indices)
         return len(self.dataset)
 
     def __getitem__(self, index):
         real_index = self.order[index]
-        dataset_res = self.dataset[real_index]
+        if self.indices is not None:
+            real_index = self.indices[real_index]
+        if self.cached:
+            dataset_res = self.dataset.getitem_cached(self.name, real_index)
+        else:
+            dataset_res = self.dataset[real_index]
+
+        return dataset_res, self.sample_id(real_index)
 
-        return dataset_res, str(self.name) + '_' + str(real_index)
+    def sample_id(self, index):
+        return str(self.name) + '_' + str(index)
+
+    def ids(self):
+        indices = self.indices if self.indices is not None else range(len(self.dataset))
+        return [self.sample_id(index) for index in indices]
 
     def shuffle(self):
-        self.order = numpy.random.permutation(len(self.dataset))
+        self.order = numpy.random.permutation(len(self))
         # print('Shuffled order:', self.order[:16])
 
 
@@ -129,9 +160,23 @@ class DatasetHandler(Pipe):
                 * firstly the Trainer is switched to the `train` mode and `train` subset of the dataset is used.
                 * secondly, the Trainer is switched to the `valid` mode and `train` subset of the dataset is used.
                 * thirdly, the Trainer is switched to the `valid` mode and `valid` subset of the dataset is used.
+
+            Each entry may also contain the `subsample` key: a fraction (float) or a number of samples (int)
+            of a fixed random subsample of the subset that is used instead of the whole subset, e.g.
+            {'mode': 'valid', 'subset': 'train', 'subsample': 0.1}. The subsample is the same in every epoch.
+
+        subsample_seed: (int, default 0)
+            seed used to select the subsamples requested in the `epoch_schedule`.
+
+    If the dataset defines ```getitem_cached(subset, index)``` (the sample without the parts that are
+    consumed by the cached submodule only, e.g. without the decoded image) and setka.pipes.FeatureCache
+    has the features of all the samples of the subset, the samples are loaded with it (the heavy decoding
+    is skipped) and self.trainer._cached_input is set for the epoch.
     """
+    inference = True
+
     def __init__(self, dataset, batch_size, workers=0, timeit=True, limits={}, shuffle={'train': True},
-                 epoch_schedule=DEFAULT_SCHEDULE):
+                 epoch_schedule=DEFAULT_SCHEDULE, subsample_seed=0):
 
         super(DatasetHandler, self).__init__()
         self.dataset = dataset
@@ -148,13 +193,53 @@ class DatasetHandler(Pipe):
         self.shuffle = shuffle
         self.collate_fn = None
         self.epoch_schedule = epoch_schedule
+        self.subsample_seed = subsample_seed
+        self.subsample = None
+        self.subsample_cache = {}
         self.time_est = TimeEstimator()
 
+    def get_indices(self, dataset):
+        """
+        Returns indices of the subsample requested for the current epoch (None if the whole subset is used).
+        """
+        if self.subsample is None:
+            return None
+
+        key = (self.trainer._subset, self.subsample)
+        if key not in self.subsample_cache:
+            self.subsample_cache[key] = subsample_indices(len(dataset), self.subsample, self.subsample_seed)
+        return self.subsample_cache[key]
+
+    def make_loader(self, ds_wrapper, batch_size, drop_last=False):
+        """
+        Returns the sequential loader of the wrapped dataset with the settings of the handler.
+        """
+        if self.collate_fn is None:
+            self.collate_fn = self.trainer.collection_op.collate_fn
+
+        return torch.utils.data.DataLoader(
+            ds_wrapper,
+            batch_size=batch_size,
+            shuffle=False,
+            num_workers=self.workers,
+            drop_last=drop_last,
+            pin_memory=True,
+            collate_fn=self.collate_fn,
+            sampler=torch.utils.data.sampler.SequentialSampler(ds_wrapper))
+
     def before_epoch(self):
         """
-        Initializes new epoch: shuffles dataset, prepares dataloader, counts number of iterations in dataloader.
+        Initializes new epoch: shuffles dataset, prepares dataloader, counts number of iterations in dataloader,
+        resets the stop signal of the epoch.
         """
-        ds_wrapper = DatasetWrapper(self.dataset[self.trainer._subset], self.trainer._subset)
+        dataset = self.dataset[self.trainer._subset]
+        ds_wrapper = DatasetWrapper(dataset, self.trainer._subset, indices=self.get_indices(dataset))
+
+        cache = getattr(self.trainer, '_feature_cache', None)
+        ds_wrapper.cached = (cache is not None and hasattr(dataset, 'getitem_cached') and
+                             cache.covers(ds_wrapper.ids()))
+        self.trainer._cached_input = ds_wrapper.cached
+        self.trainer._stop_epoch_signal = False
         drop_last = True if self.trainer._mode == 'train' else False
 
         shuffle = False
@@ -167,19 +252,11 @@ class DatasetHandler(Pipe):
         if shuffle:
             ds_wrapper.shuffle()
 
-        if self.collate_fn is None:
-            self.collate_fn = self.trainer.collection_op.collate_fn
-
-        self.loader = torch.utils.data.DataLoader(
-            ds_wrapper,
-            batch_size=self.batch_size[self.trainer._mode],
-            shuffle=False,
-            num_workers=self.workers,
-            drop_last=drop_last,
-            pin_memory=True,
-            collate_fn=self.collate_fn,
-            sampler=torch.utils.data.sampler.SequentialSampler(ds_wrapper))
+        batch_size = getattr(self.trainer, '_batch_size', None)
+        if batch_size is None:
+            batch_size = self.batch_size[self.trainer._mode]
 
+        self.loader = self.make_loader(ds_wrapper, batch_size, drop_last=drop_last)
         self.iterator = iter(self.loader)
 
         if self.trainer._n_iterations is not None:
@@ -265,7 +342,10 @@ class DatasetHandler(Pipe):
                     break
 
             for regime in self.epoch_schedule:
+                regime = dict(regime)
+                self.subsample = regime.pop('subsample', None)
                 self.trainer.run_epoch(**regime)
+                self.subsample = None
 
             if hasattr(self.trainer, '_stop_train_signal'):
                 if self.trainer._stop_train_signal:
@@ -0,0 +1,191 @@
+import os
+import hashlib
+import functools
+
+import torch
+
+from setka.pipes.Pipe import Pipe
+from setka.base.PredictionStore import PredictionStore
+from setka.base.memory_tracking import model_device
+
+
+def cached_forward(module, *args, **kwargs):
+    """
+    Forward of the submodule cached with setka.pipes.FeatureCache.
+    """
+    return module._setka_feature_cache.forward(module, *args, **kwargs)
+
+
+class FeatureCache(Pipe):
+    """
+    Caches the outputs of the frozen submodule of the model (e.g. the backbone when only the head is
+    fine-tuned). The forward of the submodule is patched: the outputs are stored per sample, keyed by
+    self.trainer._ids, and when all the samples of the batch are cached, the submodule is not run
+    and the cached outputs are returned (collated and moved to the device of the submodule).
+    The outputs are kept in memory (on the CPU) or, if ```path``` is specified, in the memory-mapped
+    setka.base.PredictionStore in the subdirectory named by the digest of the weights.
+
+    The cache is invalidated when the weights of the submodule change: the versions of its parameters and
+    buffers are checked at each batch, and if they changed, the digest of the weights is recomputed.
+    The submodule is kept in the evaluation mode (so the BatchNorm statistics are frozen too). The cached
+    outputs do not reflect the random augmentations of the later epochs.
+
+    If the dataset defines ```getitem_cached``` and all the samples of the subset are cached,
+    setka.pipes.DatasetHandler loads the samples with it, skipping the heavy decoding.
+
+    The submodule should be called once per batch on the samples of the batch.
+
+    Args:
+        module (str or torch.nn.Module): the submodule or its name in the model of the trainer (e.g. 'backbone'),
+            the name does not include the prefix of the DataParallel (DistributedDataParallel) wrapper.
+        path (str): directory of the memory-mapped cache (None to keep the cache in memory).
+        shard_size (int): number of samples in a shard of the memory-mapped cache.
+    """
+    inference = True
+
+    def __init__(self, module, path=None, shard_size=65536):
+        super(FeatureCache, self).__init__()
+        self.module = module
+        self.path = path
+        self.shard_size = shard_size
+
+        self.cache = {}
+        self.store = None
+        self.versions = None
+        self.digest = None
+
+        self.n_hits = 0
+        self.n_misses = 0
+        self.n_invalidations = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['cache'] = {}
+        state['store'] = None
+        state['versions'] = None
+        state['digest'] = None
+        return state
+
+    def __deepcopy__(self, memo):
+        # the copies of the model (e.g. the averaged one of WeightAveraging) share the cache
+        return self
+
+    def on_init(self):
+        self.trainer._feature_cache = self
+
+    def submodule(self):
+        if isinstance(self.module, torch.nn.Module):
+            return self.module
+
+        # the name is resolved in the wrapped model of DataParallel and DistributedDataParallel
+        model = self.trainer._model
+        while isinstance(model, (torch.nn.DataParallel, torch.nn.parallel.DistributedDataParallel)):
+            model = model.module
+        return model.get_submodule(self.module)
+
+    def patch(self, module):
+        if getattr(module, '_setka_feature_cache', None) is self:
+            return
+        module._setka_uncached_forward = module.forward
+        module._setka_feature_cache = self
+        module.forward = functools.partial(cached_forward, module)
+
+    @staticmethod
+    def weights_digest(tensors):
+        digest = hashlib.sha1()
+        for tensor in tensors:
+            tensor = tensor.detach().cpu()
+            if tensor.dtype == torch.bfloat16:
+                tensor = tensor.float()
+            digest.update(str((tuple(tensor.shape), tensor.dtype)).encode())
+            digest.update(tensor.contiguous().numpy().tobytes())
+        return digest.hexdigest()
+
+    def validate(self, module):
+        """
+        Invalidates the cache if the weights of the submodule changed.
+        """
+        tensors = list(module.parameters()) + list(module.buffers())
+        versions = tuple((id(tensor), tensor._version) for tensor in tensors)
+        if versions == self.versions:
+            return
+        self.versions = versions
+
+        digest = self.weights_digest(tensors)
+        if digest == self.digest:
+            return
+        if self.digest is not None:
+            self.n_invalidations += 1
+        self.digest = digest
+
+        self.cache = {}
+        if self.path is not None:
+            if self.store is not None:
+                self.store.close()
+            self.store = PredictionStore(os.path.join(self.path, digest), shard_size=self.shard_size)
+
+    def contains(self, id):
+        if self.store is not None:
+            return id in self.store.index
+        return id in self.cache
+
+    def covers(self, ids):
+        """
+        Checks whether the outputs of all the samples are cached.
+        """
+        self.validate(self.submodule())
+        return all(self.contains(id) for id in ids)
+
+    def get(self, id):
+        if self.store is not None:
+            return self.store[id]
+        return self.cache[id]
+
+    def put(self, ids, output):
+        op = self.trainer.collection_op
+        with torch.inference_mode(False):
+            output = op.apply(output, lambda tensor: tensor.detach().to('cpu', copy=True))
+
+        if self.store is not None:
+            self.store.write(ids, output)
+        else:
+            for id, sample in zip(ids, op.split(output, batch_size=len(ids))):
+                self.cache[id] = sample
+
+    def forward(self, module, *args, **kwargs):
+        if module.training:
+            module.eval()
+        self.validate(module)
+
+        op = self.trainer.collection_op
+        ids = self.trainer._ids
+        if all(self.contains(id) for id in ids):
+            self.n_hits += len(ids)
+            samples = op.collate_fn([self.get(id) for id in ids])
+            return op.to(samples, device=model_device(module), non_blocking=True)
+
+        if getattr(self.trainer, '_cached_input', False):
+            raise RuntimeError('Features of the batch are not cached, but the input was loaded with getitem_cached')
+
+        output = module._setka_uncached_forward(*args, **kwargs)
+        if op.batch_size(output) == len(ids):
+            self.put(ids, output)
+        self.n_misses += len(ids)
+        return output
+
+    def before_epoch(self):
+        """
+        Patches the forward of the submodule, resets the statistics.
+        """
+        self.patch(self.submodule())
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def after_epoch(self):
+        """
+        Reports the statistics of the cache.
+        """
+        if self.store is not None:
+            self.store.flush()
+        self.trainer.status['FeatureCache'] = {
+            'Hits': self.n_hits, 'Misses': self.n_misses, 'Invalidations': self.n_invalidations}
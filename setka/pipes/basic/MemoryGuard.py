@@ -0,0 +1,159 @@
+import math
+import time
+
+import torch
+
+from setka.pipes.Pipe import Pipe
+from setka.base.memory_tracking import model_device, reset_peak_memory, peak_memory, rss_memory, is_out_of_memory
+
+
+class MemoryGuard(Pipe):
+    """
+    Tracks the memory usage of the batch stages and makes the training resilient to the out-of-memory
+    errors. During the training epochs the pipe runs the stages of the batch (before_batch, on_batch,
+    after_batch) itself (self.trainer._stage_guard is set in before_epoch and removed in after_epoch, so the
+    other epochs, e.g. the ones of Trainer.run_predict, are not affected) and records the peak memory allocated on the device (CUDA only)
+    and the resident set size of the process after each stage.
+
+    When the on_batch stage fails with the out-of-memory error, the output and the loss are released, the
+    gradients are zeroed, and the batch is split into micro-batches of half the size (with
+    CollectionOperator.split_index and the index masks). The on_batch stage is run for the micro-batches
+    sequentially: the loss of each micro-batch is scaled by its fraction of the batch
+    (self.trainer._loss_scale), so the gradients are accumulated as for the whole batch. The outputs are
+    concatenated, so the after_batch stage (optimizers, metrics, etc.) sees the whole batch. The reduced
+    micro-batch size is kept for the following batches and is halved again on the next error.
+
+    Stores:
+        self.trainer._memory_stats[mode] -- peaks of the stages of the last epoch: {'<stage> MB': allocator
+            peak, '<stage> RSS MB': resident set size}, 'Micro-batch' and 'OOM retries'.
+        self.events -- list of the out-of-memory events.
+
+    Args:
+        min_micro_batch (int): the error is raised if the micro-batch can not be made smaller than this size.
+        empty_cache (bool): release the cached blocks of the CUDA allocator after the error.
+    """
+    def __init__(self, min_micro_batch=1, empty_cache=True):
+        super(MemoryGuard, self).__init__()
+        self.min_micro_batch = min_micro_batch
+        self.empty_cache = empty_cache
+        self.micro_batch = None
+        self.events = []
+        self.n_retries = 0
+        self.stats = {}
+        self.device = torch.device('cpu')
+
+    def before_epoch(self):
+        """
+        Installs the stage guard for the training epoch, resets the statistics of the stages.
+        """
+        if self.trainer._mode == 'train':
+            self.trainer._stage_guard = self.run_stage
+        self.stats = {}
+        self.n_retries = 0
+        if hasattr(self.trainer, '_model'):
+            self.device = model_device(self.trainer._model)
+
+    def run_stage(self, stage, run):
+        reset_peak_memory(self.device, nested=True)
+        try:
+            if stage == 'on_batch':
+                self.run_on_batch(run)
+            else:
+                run()
+        finally:
+            self.record(stage)
+
+    def record(self, stage):
+        memory = peak_memory(self.device, nested=True)
+        if memory is not None:
+            self.stats[stage + ' MB'] = max(self.stats.get(stage + ' MB', 0.0), memory)
+        rss = rss_memory()
+        if rss is not None:
+            self.stats[stage + ' RSS MB'] = max(self.stats.get(stage + ' RSS MB', 0.0), rss)
+
+    def release(self):
+        """
+        Releases the tensors of the failed batch and zeros the gradients.
+        """
+        for name in ['_output', '_loss']:
+            if hasattr(self.trainer, name):
+                delattr(self.trainer, name)
+
+        if hasattr(self.trainer, '_model'):
+            for par in self.trainer._model.parameters():
+                if par.grad is not None:
+                    par.grad.zero_()
+
+        if self.empty_cache and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def run_micro_batches(self, run):
+        op = self.trainer.collection_op
+        input, ids = self.trainer._input, self.trainer._ids
+        batch_size = len(ids)
+
+        outputs, loss = [], None
+        try:
+            for start in range(0, batch_size, self.micro_batch):
+                index = torch.arange(start, min(start + self.micro_batch, batch_size))
+                self.trainer._input = op.split_index(input, index)[0]
+                self.trainer._ids = op.split_index(ids, index)[0]
+                self.trainer._loss_scale = len(index) / batch_size
+
+                run()
+
+                outputs.append(op.detach(self.trainer._output))
+                if hasattr(self.trainer, '_loss'):
+                    part = self.trainer._loss.detach() * self.trainer._loss_scale
+                    loss = part if loss is None else loss + part
+        finally:
+            self.trainer._input, self.trainer._ids = input, ids
+            self.trainer._loss_scale = None
+
+        self.trainer._output = op.concat(outputs)
+        if loss is not None:
+            self.trainer._loss = loss
+
+    def run_on_batch(self, run):
+        while True:
+            batch_size = len(self.trainer._ids)
+            failed = False
+            try:
+                if self.micro_batch is None or self.micro_batch >= batch_size:
+                    run()
+                else:
+                    self.run_micro_batches(run)
+                return
+            except RuntimeError as e:
+                if not is_out_of_memory(e):
+                    raise
+                current = min(batch_size, self.micro_batch or batch_size)
+                if current <= self.min_micro_batch:
+                    raise
+                failed = True
+
+            # the tensors are released out of the except clause, so the traceback does not hold them
+            if failed:
+                self.release()
+                self.micro_batch = max(self.min_micro_batch, int(math.ceil(current / 2)))
+                self.n_retries += 1
+                self.events.append({'time': time.time(), 'epoch': self.trainer._epoch, 'mode': self.trainer._mode,
+                                    'iteration': self.trainer._iteration, 'batch_size': batch_size,
+                                    'micro_batch': self.micro_batch})
+                self.trainer.status['Memory'] = {'OOM retries': len(self.events), 'Micro-batch': self.micro_batch}
+
+    def after_epoch(self):
+        """
+        Removes the stage guard, reports the memory statistics of the epoch.
+        """
+        if getattr(self.trainer, '_stage_guard', None) == self.run_stage:
+            del self.trainer._stage_guard
+
+        stats = dict(self.stats)
+        stats['Micro-batch'] = self.micro_batch
+        stats['OOM retries'] = self.n_retries
+
+        if not hasattr(self.trainer, '_memory_stats'):
+            self.trainer._memory_stats = {}
+        self.trainer._memory_stats[self.trainer._mode] = stats
+        self.trainer.status['Memory'] = stats
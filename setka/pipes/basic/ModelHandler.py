@@ -1,12 +1,68 @@
+import math
+import time
+import fnmatch
+import functools
+
 import torch
+import torch.utils.checkpoint
 
 from setka.pipes.Pipe import Pipe
+from setka.base.memory_tracking import model_device, reset_peak_memory, peak_memory
+from setka.base.compilation import compile_callable
+
+
+def checkpointed_forward(module, *args, **kwargs):
+    """
+    Forward of the module with the activation checkpointing (used only when the checkpointing
+    is enabled for the module and gradients are computed).
+    """
+    if module._setka_checkpoint and torch.is_grad_enabled():
+        return torch.utils.checkpoint.checkpoint(type(module).forward, module, *args, use_reentrant=False, **kwargs)
+    return type(module).forward(module, *args, **kwargs)
 
 
 class ModelHandler(Pipe):
     """
     One of the core pipes. Knows how to handle simple models correctly.
 
+    The activation checkpointing may be applied to the submodules of the model: their activations are
+    not stored during the forward pass and are recomputed during the backward pass, so larger batches fit
+    into the memory at the cost of the additional computations. The checkpointing is enabled only
+    when the trainer is in the 'train' mode. The submodules are selected with ```checkpoint_every```,
+    ```checkpoint_types``` and ```checkpoint_names``` (the union of the selections is used, nested
+    submodules of the selected ones are not wrapped).
+
+    The throughput (samples per second) and the peak memory of the device (for CUDA only) of the
+    epoch are reported in self.trainer.status['Model'] and self.trainer._model_stats[mode].
+
+    With ```compile``` the model is compiled with torch.compile (or traced with torch.jit.trace if
+    torch.compile is not available or fails, the eager model is used if tracing fails too). Compilation is
+    performed lazily on the first batch for each model (e.g. the averaged one of WeightAveraging), mode
+    ('train' or evaluation) and shape bucket of the input, the compiled models are cached, so switching
+    between training and validation does not trigger recompilation. The time of the compilation (including
+    the first forward pass) is reported in self.trainer.status['Compile'] and is excluded from the throughput.
+    If the compilation falls back to the eager model, a warning is issued and the last error is reported in
+    self.trainer.status['Compile'] as well.
+
+    With ```pipeline_stages``` the model is split into the stages placed on the different devices (a simple
+    form of the pipeline parallelism: the forward pass only, no separate worker per stage and no 1F1B
+    schedule of the backward pass). The model should be ```nn.Sequential```-like (its forward is the
+    sequential application of its children, the first child receives the input of the batch). The children
+    are split into the stages at the given boundaries, the stages are placed on ```pipeline_devices```, and
+    the batch is split into ```micro_batches``` with the CollectionOperator. The micro-batches are issued
+    to the stages from a single thread in the order of the GPipe forward schedule: at each clock the stage s
+    processes the micro-batch (clock - s). The stages overlap only when the device calls are asynchronous
+    (CUDA kernels); on the CPU devices the stages run one after another, so the mode only splits the memory
+    of the model between the devices there. The outputs of the micro-batches are concatenated on the last
+    device and the input is moved there as well, so LossHandler computes the loss of the whole batch and
+    its single backward pass runs through all the stages, i.e. LossHandler and OneStepOptimizers work
+    unchanged. The placement of the stages
+    is checked at the first batch of each epoch, so the model should not be moved by UseCuda (it only moves
+    the input in this case).
+
+    If ```self.trainer._forward_chunk_size``` is set (e.g. by setka.pipes.TestTimeAugmentation), the
+    input is processed in chunks of at most this number of samples, the outputs are concatenated.
+
     Stores:
         model's output in 'self.trainer._output'.
 
@@ -14,21 +70,193 @@ class ModelHandler(Pipe):
         model (torch.nn.Module): model to handle.
         data_parallel (bool): If true, DataParallel wrapper is used for model
         device_ids (list): Device ids to use for model training
+        checkpoint_every (int): checkpoint every N-th child module of the model.
+        checkpoint_types (type or tuple of types): checkpoint the submodules of these types.
+        checkpoint_names (str or list of str): checkpoint the submodules which names match these
+            (fnmatch-style) patterns, e.g. 'encoder.layers.*'.
+        compile (bool or str): compile the model: True or 'compile' to use torch.compile (with fallback
+            to torch.jit.trace), 'trace' to use torch.jit.trace.
+        shape_bucket (callable): function of the input that returns the hashable shape bucket of the input.
+            By default, the structure, shapes and data types of the input are used.
+        pipeline_stages (list of int or str): boundaries of the pipeline stages: indices (or names) of the
+            children of the model that start the stages (except the first one).
+        pipeline_devices (list of str): devices of the stages (CUDA devices by default, if there are
+            enough of them, CPU otherwise).
+        micro_batches (int): number of micro-batches in the pipeline mode.
     """
-    def __init__(self, model, data_parallel=False, device_ids=None):
+    inference = True
+
+    def __init__(self, model, data_parallel=False, device_ids=None, checkpoint_every=None, checkpoint_types=None,
+                 checkpoint_names=None, compile=False, shape_bucket=None, pipeline_stages=None,
+                 pipeline_devices=None, micro_batches=4):
         super(ModelHandler, self).__init__()
         self.model = model
         self.data_parallel = data_parallel
         self.device_ids = device_ids
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_types = checkpoint_types
+        self.checkpoint_names = [checkpoint_names] if isinstance(checkpoint_names, str) else checkpoint_names
+        self.checkpointed = []
+        self.checkpoint_enabled = False
+        self.n_samples = 0
+        self.start_time = time.time()
+        self.device = torch.device('cpu')
+
+        self.compile = 'compile' if compile is True else compile
+        self.shape_bucket = shape_bucket
+        self.compiled = {}
+        self.compile_time = 0.0
+        self.epoch_compile_time = 0.0
+        self.compile_error = None
+
+        self.pipeline_stages = pipeline_stages
+        self.pipeline_devices = pipeline_devices
+        self.micro_batches = micro_batches
+        self.pipelines = {}
+        self.pipeline_placed = False
+
+        if self.pipeline_stages is not None:
+            if self.compile or self.data_parallel:
+                raise ValueError('Pipeline mode can not be combined with compile or data_parallel')
+            n_stages = len(self.pipeline_stages) + 1
+            if self.pipeline_devices is None:
+                if torch.cuda.is_available() and torch.cuda.device_count() >= n_stages:
+                    self.pipeline_devices = [f'cuda:{index}' for index in range(n_stages)]
+                else:
+                    self.pipeline_devices = ['cpu'] * n_stages
+            if len(self.pipeline_devices) != n_stages:
+                raise ValueError('Number of pipeline devices should be equal to the number of stages')
 
         self.set_priority({'after_batch': -10, 'on_batch': 10})
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['compiled'] = {}
+        state['pipelines'] = {}
+        state['pipeline_placed'] = False
+        return state
+
+    def select_checkpointed(self):
+        selected = set()
+        if self.checkpoint_every is not None:
+            for index, (name, _) in enumerate(self.model.named_children()):
+                if (index + 1) % self.checkpoint_every == 0:
+                    selected.add(name)
+
+        for name, module in self.model.named_modules():
+            if name == '':
+                continue
+            if self.checkpoint_types is not None and isinstance(module, self.checkpoint_types):
+                selected.add(name)
+            if self.checkpoint_names is not None and any(
+                    fnmatch.fnmatchcase(name, pattern) for pattern in self.checkpoint_names):
+                selected.add(name)
+
+        res = []
+        for name, module in self.model.named_modules():
+            if name in selected and not any(name.startswith(parent + '.') for parent, _ in res):
+                res.append((name, module))
+        return [module for _, module in res]
+
+    def set_checkpointing(self, flag):
+        if self.checkpoint_enabled != flag:
+            for module in self.checkpointed:
+                module._setka_checkpoint = flag
+            self.checkpoint_enabled = flag
+
+    def compile_model(self, model, input):
+        """
+        Compiles the model and runs it on the input. Falls back to tracing and to the eager model.
+        Returns the compiled model and the output.
+        """
+        compiled, output, error = compile_callable(model, (input,), use_compile=self.compile == 'compile')
+        if error is not None:
+            self.compile_error = error
+        return compiled, output
+
+    def pipeline(self, model):
+        """
+        Returns the stages of the model (nn.Sequential modules of its children) placed on the devices.
+        """
+        if id(model) not in self.pipelines:
+            names = [name for name, _ in model.named_children()]
+            children = [child for _, child in model.named_children()]
+            bounds = [names.index(bound) if isinstance(bound, str) else bound for bound in self.pipeline_stages]
+            bounds = [0] + bounds + [len(children)]
+            if any(start >= end for start, end in zip(bounds[:-1], bounds[1:])):
+                raise ValueError('Pipeline stage boundaries should be increasing: ' + str(self.pipeline_stages))
+
+            self.pipelines[id(model)] = [torch.nn.Sequential(*children[start:end])
+                                         for start, end in zip(bounds[:-1], bounds[1:])]
+            self.pipeline_placed = False
+
+        stages = self.pipelines[id(model)]
+        if not self.pipeline_placed:
+            for stage, device in zip(stages, self.pipeline_devices):
+                stage.to(device)
+            self.pipeline_placed = True
+        return stages
+
+    def pipeline_forward(self, input):
+        """
+        Issues the micro-batches of the input to the stages in the order of the GPipe forward schedule
+        (from the current thread, so the stages overlap only for the asynchronous devices).
+        """
+        op = self.trainer.collection_op
+        stages = self.pipeline(self.trainer._model)
+
+        batch_size = op.batch_size(input)
+        activations = op.chunk(input, int(math.ceil(batch_size / self.micro_batches)))
+
+        for clock in range(len(activations) + len(stages) - 1):
+            for index in reversed(range(len(stages))):
+                micro_batch = clock - index
+                if 0 <= micro_batch < len(activations):
+                    activations[micro_batch] = stages[index](
+                        op.to(activations[micro_batch], device=self.pipeline_devices[index], non_blocking=True))
+
+        return op.concat(activations)
+
+    def forward(self, input):
+        if self.pipeline_stages is not None:
+            return self.pipeline_forward(input)
+
+        if not self.compile:
+            return self.trainer._model(input)
+
+        mode = 'train' if self.trainer._mode == 'train' else 'eval'
+        bucket = self.shape_bucket(input) if self.shape_bucket is not None else \
+            self.trainer.collection_op.signature(input)
+        key = (id(self.trainer._model), mode, bucket)
+
+        if key in self.compiled:
+            return self.compiled[key](input)
+
+        start = time.time()
+        self.compiled[key], output = self.compile_model(self.trainer._model, input)
+
+        elapsed = time.time() - start
+        self.compile_time += elapsed
+        self.epoch_compile_time += elapsed
+        self.trainer.status['Compile'] = {'Time': self.compile_time, 'Variants': len(self.compiled)}
+        if self.compile_error is not None:
+            self.trainer.status['Compile']['Error'] = repr(self.compile_error)
+        return output
+
     def on_init(self):
+        self.checkpointed = self.select_checkpointed()
+        for module in self.checkpointed:
+            module._setka_checkpoint = False
+            module.forward = functools.partial(checkpointed_forward, module)
+
         if self.data_parallel:
             self.trainer._model = torch.nn.DataParallel(self.model, device_ids=self.device_ids)
         else:
             self.trainer._model = self.model
 
+        if self.pipeline_stages is not None:
+            self.trainer._pipeline_devices = self.pipeline_devices
+
         self.trainer._model.eval()
         self.trainer._model.requires_grad = False
 
@@ -37,19 +265,60 @@ class ModelHandler(Pipe):
         Switches all the model's modules to the evaluation mode.
         """
         self.trainer._model.eval()
-        
+
+        self.n_samples = 0
+        self.device = model_device(self.model)
+        reset_peak_memory(self.device)
+        self.start_time = time.time()
+        self.epoch_compile_time = 0.0
+        self.pipeline_placed = False
+
     def on_batch(self):
         """
-        Performs forward pass through the model. Also switches model to eval mode in case the
-        trainer's mode is not 'train'.
+        Performs forward pass through the model. Also switches model to eval mode and disables
+        gradients in case the trainer's mode is not 'train'.
         """
         if self.trainer._mode != 'train':
             self.trainer._model.eval()
 
-        self.trainer._output = self.trainer._model(self.trainer._input)
+        self.set_checkpointing(self.trainer._mode == 'train')
+
+        op = self.trainer.collection_op
+        chunk_size = getattr(self.trainer, '_forward_chunk_size', None)
+
+        with torch.set_grad_enabled(torch.is_grad_enabled() and self.trainer._mode == 'train'):
+            if chunk_size is None or op.batch_size(self.trainer._input) <= chunk_size:
+                self.trainer._output = self.forward(self.trainer._input)
+            else:
+                self.trainer._output = op.concat([self.forward(chunk)
+                                                  for chunk in op.chunk(self.trainer._input, chunk_size)])
+
+        if self.pipeline_stages is not None:
+            self.trainer._input = op.to(self.trainer._input, device=self.pipeline_devices[-1], non_blocking=True)
+        self.n_samples += len(self.trainer._ids)
 
     def after_batch(self):
         """
         Releases self.trainer._output
         """
         del self.trainer._output
+
+    def after_epoch(self):
+        """
+        Reports the throughput and the peak memory of the epoch.
+        """
+        # the compilation of the criteria (setka.pipes.LossHandler) is excluded as well
+        elapsed = (time.time() - self.start_time - self.epoch_compile_time -
+                   getattr(self.trainer, '_loss_compile_time', 0.0))
+        stats = {'Samples/s': self.n_samples / elapsed if elapsed > 0 else 0.0}
+
+        memory = peak_memory(self.device)
+        if memory is not None:
+            stats['Peak MB'] = memory
+        if len(self.checkpointed) > 0:
+            stats['Checkpointed'] = len(self.checkpointed) if self.trainer._mode == 'train' else 0
+
+        if not hasattr(self.trainer, '_model_stats'):
+            self.trainer._model_stats = {}
+        self.trainer._model_stats[self.trainer._mode] = stats
+        self.trainer.status['Model'] = stats
@@ -0,0 +1,173 @@
+import torch
+
+from setka.pipes.Pipe import Pipe
+
+
+class Flip:
+    """
+    Flips the input tensors along ```dims```. With ```dense``` the outputs (e.g. segmentation maps) are
+    flipped back, otherwise (e.g. class scores) they are left as is.
+    """
+    def __init__(self, dims=(-1,), dense=False):
+        self.dims = tuple(dims)
+        self.dense = dense
+
+    def __call__(self, x):
+        return x.flip(self.dims)
+
+    def invert(self, output):
+        return output.flip(self.dims) if self.dense else output
+
+
+class Zoom:
+    """
+    Scales the spatial dimensions (the last two) of the input tensors by ```factor``` keeping their
+    size: the scaled image is center-cropped (```factor``` > 1) or padded with zeros (```factor``` < 1).
+    The transform is not inverted, so it should be used with the outputs that do not depend on
+    the position (e.g. class scores).
+    """
+    def __init__(self, factor, mode='bilinear'):
+        self.factor = factor
+        self.mode = mode
+
+    def __call__(self, x):
+        height, width = x.shape[-2:]
+        new_height, new_width = max(1, round(height * self.factor)), max(1, round(width * self.factor))
+        scaled = torch.nn.functional.interpolate(
+            x.reshape(-1, 1, height, width), size=(new_height, new_width), mode=self.mode, align_corners=False)
+        scaled = scaled.reshape(*x.shape[:-2], new_height, new_width)
+
+        top, left = (new_height - height) // 2, (new_width - width) // 2
+        if self.factor >= 1.0:
+            return scaled[..., top:top + height, left:left + width]
+
+        top, left = -top, -left
+        return torch.nn.functional.pad(
+            scaled, (left, width - new_width - left, top, height - new_height - top))
+
+
+class TestTimeAugmentation(Pipe):
+    """
+    Test-time augmentation in a single forward pass. In the specified modes, the input batch is expanded into
+    K augmented variants along the batch dimension (before_batch), the model is run once on the expanded
+    batch by setka.pipes.ModelHandler (in chunks of at most ```chunk_size``` samples, if specified), then the
+    outputs of the variants are inverted (for the transforms with the ```invert``` method) and reduced, and
+    the original input is restored (on_batch, right after ModelHandler), so the downstream pipes (losses,
+    metrics, SaveResult) see the output of the original batch size in self.trainer._output.
+
+    The transforms are applied to the tensors at ```paths``` of the input (see CollectionOperator.select) or,
+    if the paths are not specified, to the floating point tensors with at least 3 dimensions (images, volumes,
+    etc.), so the labels and the targets (including the floating point ones) are kept. The identity variant (the original input) is always the first one. The transforms should be picklable
+    (e.g. the Flip and Zoom classes of this module) to keep the trainer serializable by Checkpointer. All
+    the variants should have the same shapes.
+
+    Args:
+        transforms (list): transforms of the tensors. Each transform is a callable or a pair (transform,
+            inverse), the inverse is applied to the tensors of the output of the variant. Callables with
+            the ```invert``` method are inverted with it.
+        reduce (str or callable): reduction of the outputs: 'mean', 'max', 'vote' (fraction of the
+            variants that voted for each class along the dimension 1, so argmax gives the majority vote)
+            or a function of the stacked tensor of shape [K, batch size, ...].
+        chunk_size (int): maximum number of samples in a forward pass (None means the whole expanded batch).
+        modes (list of str): modes of the trainer to apply the augmentation in.
+        paths (list): paths of the tensors of the input to transform (e.g. [0] or [('image',)]).
+    """
+    inference = True
+
+    def __init__(self, transforms, reduce='mean', chunk_size=None, modes=('test',), paths=None):
+        super(TestTimeAugmentation, self).__init__()
+        self.transforms = [None] + list(transforms)
+        self.reduce = reduce
+        self.chunk_size = chunk_size
+        self.modes = modes
+        self.paths = paths
+        self.input = None
+
+        if not callable(reduce) and reduce not in ('mean', 'max', 'vote'):
+            raise ValueError('Unknown reduction: ' + str(reduce))
+
+        self.set_priority({'before_batch': -1, 'on_batch': 9.5})
+
+    @staticmethod
+    def _split_transform(transform):
+        if isinstance(transform, (tuple, list)):
+            return transform[0], transform[1]
+        return transform, getattr(transform, 'invert', None)
+
+    def active(self):
+        return self.trainer._mode in self.modes
+
+    def augmented(self, input):
+        """
+        Returns the ids of the tensors of the input that are transformed.
+        """
+        op = self.trainer.collection_op
+        if self.paths is not None:
+            selected = op.select(input, self.paths)
+            check = lambda x: True
+        else:
+            selected = input
+            check = lambda x: torch.is_floating_point(x) and x.dim() >= 3
+
+        ids = set()
+        op.apply(selected, lambda x: ids.add(id(x)) if check(x) else None)
+        return ids
+
+    def before_batch(self):
+        """
+        Expands the input into the augmented variants.
+        """
+        if not self.active():
+            return
+
+        op = self.trainer.collection_op
+        self.input = self.trainer._input
+        augmented = self.augmented(self.input)
+
+        variants = []
+        for transform in self.transforms:
+            if transform is None:
+                variants.append(self.input)
+                continue
+            f, _ = self._split_transform(transform)
+            variants.append(op.apply(self.input, lambda x: f(x) if id(x) in augmented else x))
+
+        signatures = set(op.signature(variant) for variant in variants)
+        if len(signatures) > 1:
+            raise ValueError('Test-time augmentation variants have different shapes: ' + str(signatures))
+
+        self.trainer._input = op.concat(variants)
+        self.trainer._forward_chunk_size = self.chunk_size
+
+    def reduce_tensor(self, output):
+        n_variants = len(self.transforms)
+        variants = list(output.reshape(n_variants, -1, *output.shape[1:]).unbind(0))
+        for index, transform in enumerate(self.transforms):
+            if transform is None:
+                continue
+            _, inverse = self._split_transform(transform)
+            if inverse is not None:
+                variants[index] = inverse(variants[index])
+        stacked = torch.stack(variants, dim=0)
+
+        if callable(self.reduce):
+            return self.reduce(stacked)
+        if self.reduce == 'max':
+            return stacked.max(dim=0)[0]
+        if self.reduce == 'vote':
+            votes = torch.nn.functional.one_hot(stacked.argmax(dim=2), stacked.shape[2])
+            dtype = stacked.dtype if torch.is_floating_point(stacked) else torch.float32
+            return votes.movedim(-1, 2).to(dtype).mean(dim=0)
+        return stacked.mean(dim=0)
+
+    def on_batch(self):
+        """
+        Inverts and reduces the outputs of the variants, restores the original input.
+        """
+        if self.input is None:
+            return
+
+        self.trainer._output = self.trainer.collection_op.apply(self.trainer._output, self.reduce_tensor)
+        self.trainer._input = self.input
+        self.trainer._forward_chunk_size = None
+        self.input = None
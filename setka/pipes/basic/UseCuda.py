@@ -1,22 +1,122 @@
+import torch
+
 from setka.pipes.Pipe import Pipe
 
 
 class UseCuda(Pipe):
     """
     This pipe moves the tensors and the model to cuda when it is needed.
+
+    The model is moved once (the placement of each model, e.g. the averaged one of WeightAveraging,
+    is cached). The tensors of the input are gathered from the nested batch and copied to the device
+    with one non-blocking copy per data type: they are packed into a reused pinned buffer, copied and
+    split back into the views of the device tensor. The tensors that are already pinned (e.g. by the
+    DataLoader of setka.pipes.DatasetHandler) are copied directly, without the staging. The conversion to the channels_last memory format
+    (for 4D tensors) and the cast of floating point tensors to ```dtype``` are performed in the same pass
+    on the device. The copies are asynchronous for CUDA devices only, 'cpu' (or any other device) may be
+    used as well (e.g. to test the pipeline on the CPU-only machines).
+
+    Args:
+        device (str or torch.device): device to use.
+        channels_last (bool): convert the model and the 4D input tensors to the channels_last memory format.
+        dtype (torch.dtype): data type to cast the floating point input tensors to (the model is not cast).
+        non_blocking (bool): use non-blocking copies from the pinned memory for CUDA devices.
     """
-    def __init__(self, device='cuda:0'):
+    inference = True
+
+    def __init__(self, device='cuda:0', channels_last=False, dtype=None, non_blocking=True):
         super(UseCuda, self).__init__()
-        self.device = device
+        self.device = torch.device(device)
+        self.channels_last = channels_last
+        self.dtype = dtype
+        self.non_blocking = non_blocking and self.device.type == 'cuda'
+
+        self.placed = set()
+        self.buffers = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['placed'] = set()
+        state['buffers'] = {}
+        return state
+
+    def place_model(self, model):
+        # the stages of the pipeline-parallel model are placed by ModelHandler
+        if id(model) in self.placed or getattr(self.trainer, '_pipeline_devices', None) is not None:
+            return
+        model.to(device=self.device)
+        if self.channels_last:
+            model.to(memory_format=torch.channels_last)
+        self.placed.add(id(model))
+
+    def staging_buffer(self, dtype, numel):
+        """
+        Returns the pinned buffer for the data type of at least ```numel``` elements. Waits for the
+        previous copy from the buffer to finish before reusing it. The buffer is a normal tensor (not an
+        inference one), so it may be reused by the training after Trainer.run_predict.
+        """
+        buffer, event = self.buffers.get(dtype, (None, None))
+        if event is not None:
+            event.synchronize()
+        if buffer is None or buffer.numel() < numel:
+            with torch.inference_mode(False):
+                buffer = torch.empty(numel, dtype=dtype, pin_memory=True)
+        self.buffers[dtype] = (buffer, None)
+        return buffer
+
+    def convert(self, tensor):
+        if self.dtype is not None and torch.is_floating_point(tensor):
+            tensor = tensor.to(dtype=self.dtype)
+        if self.channels_last and tensor.dim() == 4:
+            tensor = tensor.contiguous(memory_format=torch.channels_last)
+        return tensor
+
+    def transfer(self, elements):
+        """
+        Moves the tensors of the data collection to the device, returns the collection of the moved tensors.
+        """
+        apply = self.trainer.collection_op.apply
+
+        tensors = []
+        apply(elements, lambda tensor: tensors.append(tensor))
+
+        groups = {}
+        moved = [None] * len(tensors)
+        for index, tensor in enumerate(tensors):
+            if tensor.device == self.device:
+                moved[index] = tensor
+            elif not self.non_blocking or tensor.device.type != 'cpu':
+                moved[index] = tensor.to(device=self.device)
+            elif tensor.is_pinned():
+                moved[index] = tensor.to(device=self.device, non_blocking=True)
+            else:
+                groups.setdefault(tensor.dtype, []).append(index)
+
+        for dtype, indices in groups.items():
+            numels = [tensors[index].numel() for index in indices]
+            buffer = self.staging_buffer(dtype, sum(numels)).narrow(0, 0, sum(numels))
+            torch.cat([tensors[index].reshape(-1) for index in indices], out=buffer)
+
+            flat = buffer.to(device=self.device, non_blocking=True)
+            # the copy is enqueued on the current stream of the target device (not of the current device)
+            event = torch.cuda.Event()
+            event.record(torch.cuda.current_stream(self.device))
+            self.buffers[dtype] = (self.buffers[dtype][0], event)
+
+            for index, part in zip(indices, flat.split(numels)):
+                moved[index] = part.view(tensors[index].shape)
+
+        moved = iter([self.convert(tensor) for tensor in moved])
+        return apply(elements, lambda tensor: next(moved))
 
     def before_epoch(self):
         """
-        Moves model to GPU.
+        Moves model to GPU (once for each model).
         """
-        self.trainer._model.to(device=self.device)
-    
+        self.place_model(self.trainer._model)
+
     def before_batch(self):
         """
         Moves batch to GPU.
         """
-        self.trainer._input = self.trainer.collection_op.to(self.trainer._input, device=self.device)
+        self.trainer._input = self.transfer(self.trainer._input)
@@ -1,8 +1,9 @@
 import os
 import torch
+import torch.distributed as dist
 
 from setka.pipes.Pipe import Pipe
-from setka.base import collect_random_states
+from setka.base import collect_random_states, set_random_states, Optimizer
 
 
 class Checkpointer(Pipe):
@@ -19,6 +20,9 @@ class Checkpointer(Pipe):
     in a directory specified in ```trainer._checkpoints_dir```. If the
     ```checkpoints``` directory does not exist -- it will be created.
 
+    In the distributed runs the states of the sharded optimizers are consolidated
+    on all the ranks and the checkpoints are written by the rank 0 only.
+
     Args:
         metric (str): name of the metric to monitor
         subset (hashable): name of the subset on which the metric will be monitored
@@ -52,13 +56,57 @@ class Checkpointer(Pipe):
         if not os.path.exists(os.path.join(self.log_dir, 'checkpoints')):
             os.makedirs(os.path.join(self.log_dir, 'checkpoints'))
 
+    @staticmethod
+    def save_trainer(trainer, fname):
+        """
+        Saves the full trainer dump together with the random states.
+        """
+        torch.save({'trainer': trainer, 'random_states': collect_random_states()}, fname)
+
+    @staticmethod
+    def load_trainer(fname, restore_random_states=True):
+        """
+        Loads the trainer from the dump made by the ```save_trainer```. Random states are restored
+        if ```restore_random_states``` is True. The dump is the full pickled trainer (not the weights only),
+        so it should come from a trusted source.
+        """
+        checkpoint = torch.load(fname, map_location='cpu', weights_only=False)
+        if restore_random_states:
+            set_random_states(checkpoint['random_states'])
+        return checkpoint['trainer']
+
+    def trainer_path(self, postfix):
+        return os.path.join(self.log_dir, 'checkpoints', self.name + f'_{postfix}.pth.tar')
+
+    def weights_path(self, postfix):
+        return os.path.join(self.log_dir, 'checkpoints', self.name + f'_weights_{postfix}.pth.tar')
+
+    def optimizers(self):
+        for pipe in self.trainer._pipes:
+            for optimizer in getattr(pipe, 'optimizers', None) or []:
+                if isinstance(optimizer, Optimizer):
+                    yield optimizer
+
+    @staticmethod
+    def is_main_process():
+        return not (dist.is_available() and dist.is_initialized()) or dist.get_rank() == 0
+
     def dump(self, postfix):
         if self.dump_trainer:
-            torch.save({'trainer': self.trainer, 'random_states': collect_random_states()},
-                       os.path.join(self.log_dir, 'checkpoints', self.name + f'_{postfix}.pth.tar'))
-
-        torch.save(self.trainer._model.state_dict(),
-                   os.path.join(self.log_dir, 'checkpoints', self.name + f'_weights_{postfix}.pth.tar'))
+            for optimizer in self.optimizers():
+                optimizer.consolidate_state_dict()
+            try:
+                if self.is_main_process():
+                    self.save_trainer(self.trainer, self.trainer_path(postfix))
+            finally:
+                # the consolidated states are kept on the rank 0 until the dump is written only
+                for optimizer in self.optimizers():
+                    optimizer.release_state_dict()
+
+        if not self.is_main_process():
+            return
+
+        torch.save(self.trainer._model.state_dict(), self.weights_path(postfix))
 
     def checkpoint_epoch(self, epoch_n=None):
         is_best = False
@@ -11,6 +11,7 @@ import jsonlines
 
 import torch
 from setka.pipes.Pipe import Pipe
+from setka.base.PerSample import PerSample
 
 
 def get_process_output(command):
@@ -81,6 +82,8 @@ class Logger(Pipe):
 
     Args:
         f (callable): function for test samples visualization. If set to None, test will not be visualized.
+        batch_f (callable): batch-level function for test samples visualization (used instead of ```f```):
+            takes inputs, outputs and ids of the batch and returns the dict {id: result}.
         name (str): name of the experiment (will be used as a a name of the log folder)
         log_dir (str): path to the directory, where the logs are stored.
         ignore_list (list of str): folders to not to include to the snapshot.
@@ -112,11 +115,12 @@ class Logger(Pipe):
                      'logs/*',
                      'runs/*',
                      'core.*'],
-                 full_snapshot_path=False, collect_environment=True):
+                 full_snapshot_path=False, collect_environment=True, batch_f=None):
 
         super(Logger, self).__init__()
         self.root_path = None
         self.f = f
+        self.batch_f = batch_f if batch_f is not None or f is None else PerSample(f)
         self.name = name
         self.log_dir = log_dir
         self.make_snapshot = make_snapshot
@@ -251,13 +255,10 @@ class Logger(Pipe):
                 # fout.write(str(self.trainer._epoch) + '\t' +
                 #            str(self.trainer._loss.detach().cpu().item()) + '\n')
 
-        if self.trainer._mode == 'test' and (self.f is not None):
-            for index in range(len(self.trainer._ids)):
-                one_input = self.trainer.collection_op.split_index(self.trainer._input, index)[0]
-                one_output = self.trainer.collection_op.split_index(self.trainer._output, index)[0]
-                res = self.f(one_input, one_output)
-                id = self.trainer._ids[index]
-                self.show(res, id)
+        if self.trainer._mode == 'test' and (self.batch_f is not None):
+            res = self.batch_f(self.trainer._input, self.trainer._output, self.trainer._ids)
+            for id in res:
+                self.show(res[id], id)
 
     def after_epoch(self):
         """
@@ -1,4 +1,6 @@
 from setka.pipes.Pipe import Pipe
+from setka.base.PredictionStore import PredictionStore
+from setka.base.PerSample import PerSample
 
 import os
 import torch
@@ -9,19 +11,40 @@ class SaveResult(Pipe):
     pipe for saving predictions of the model. The results are
     stored in a directory ```predictions``` and in directory specified in
     ```trainer._predictions_dir```. Batches are processed with the
-    specified function ```f```. The directory is flushed during the
-    ```__init__``` and the result is saved when the batch is
+    specified function ```f``` (per sample) or ```batch_f``` (per batch:
+    takes inputs, outputs and ids of the batch and returns the dict {id: result}).
+    The directory is flushed during the ```__init__``` and the result is saved when the batch is
     finished (when after_batch is triggered).
 
+    Two formats are supported:
+        'torch' -- a dict {id: result} is saved with ```torch.save``` for each batch;
+        'store' -- the results are appended to setka.base.PredictionStore in the ```predictions```
+            directory (memory-mapped shards with the random access by id). The results of ```f```
+            or ```batch_f``` (if specified) should be tensors or collections of tensors, they are
+            collated into a batch.
+
     Args:
         f (callable): function to process the predictions.
         dir (string): location where the predictions will be saved
+        format (str): 'torch' or 'store'.
+        shard_size (int): number of samples in a shard of the store.
+        batch_f (callable): batch-level function to process the predictions (used instead of ```f```).
     """
-    def __init__(self, f=None, dir='runs', name='experiment'):
+    inference = True
+
+    def __init__(self, f=None, dir='runs', name='experiment', format='torch', shard_size=65536, batch_f=None):
         super(SaveResult, self).__init__()
         self.f = f
+        self.process = batch_f is not None or f is not None
+        self.batch_f = batch_f if batch_f is not None else PerSample(f)
         self.index = 0
         self.dir = os.path.join(dir, name)
+        self.format = format
+        self.shard_size = shard_size
+        self.store = None
+
+        if self.format not in ('torch', 'store'):
+            raise ValueError('Unknown format: ' + str(self.format))
 
 
     def on_init(self):
@@ -29,16 +52,29 @@ class SaveResult(Pipe):
         if not os.path.exists(self.root_dir):
             os.makedirs(self.root_dir)
 
+        if self.format == 'store':
+            self.store = PredictionStore(self.root_dir, shard_size=self.shard_size)
+
 
     def after_batch(self):
         if self.trainer._mode == 'test':
-            res = {}
-            for index in range(len(self.trainer._ids)):
-                one_input = self.trainer.collection_op.split_index(self.trainer._input, index)[0]
-                one_output = self.trainer.collection_op.split_index(self.trainer._output, index)[0]
-                res[self.trainer._ids[index]] = one_output
-                if self.f is not None:
-                    res[self.trainer._ids[index]] = self.f(one_input, one_output)
+            if self.format == 'store' and not self.process:
+                self.store.write(self.trainer._ids, self.trainer._output)
+                return
+
+            res = self.batch_f(self.trainer._input, self.trainer._output, self.trainer._ids)
+
+            if self.format == 'store':
+                ids = list(res.keys())
+                self.store.write(ids, self.trainer.collection_op.collate_fn([res[id] for id in ids]))
+                return
 
             torch.save(res, os.path.join(self.root_dir, str(self.index) + '.pth.tar'))
             self.index += 1
+
+    def after_epoch(self):
+        """
+        Flushes the store.
+        """
+        if self.trainer._mode == 'test' and self.store is not None:
+            self.store.flush()
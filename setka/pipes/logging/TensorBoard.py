@@ -3,13 +3,15 @@ import os
 
 import torch.utils.tensorboard as TB
 from setka.pipes.Pipe import Pipe
+from setka.base.PerSample import PerSample
 
 
 class TensorBoard(Pipe):
     """
     pipe to write the progress to the TensorBoard. When the epoch starts
     (before_epoch), it uploads computed metrics on previous epoch to the TensorBoard.
-    It also writes the predictions to the TensorBoard when the ```predict```
+    The gradient statistics collected by OneStepOptimizers (see ```grad_stats_freq```) are written
+    as 'grad/...' scalars. It also writes the predictions to the TensorBoard when the ```predict```
     method of the Trainer is called and visualization function is specified.
     Visualization function (passed as ```f``` to the constructor)
     takes as inputs: one input, target and output per sample and returns the
@@ -34,15 +36,20 @@ class TensorBoard(Pipe):
         }
     }
     ```
+    Instead of ```f``` the batch-level function ```batch_f``` may be specified: it takes inputs,
+    outputs and ids of the batch and returns the dict {id: dict for visualization}.
+
     Args:
         f (callable): function to visualize the network results.
         name (str): name of the experiment.
         log_dir (str): path to the directory for "tensorboard --logdir" command.
+        batch_f (callable): batch-level function to visualize the network results.
     """
 
-    def __init__(self, f=None, log_dir='runs', name='experiment_name'):
+    def __init__(self, f=None, log_dir='runs', name='experiment_name', batch_f=None):
         super(TensorBoard, self).__init__()
         self.f = f
+        self.batch_f = batch_f if batch_f is not None or f is None else PerSample(f)
         self.log_dir = log_dir
         self.name = name
         self.tb_writer = None
@@ -81,21 +88,21 @@ class TensorBoard(Pipe):
         """
         Writes the figures to the tensorboard when the trainer is in the test mode.
         """
-        if self.trainer._mode == 'test' and (self.f is not None):
-            for index in range(len(self.trainer._ids)):
-                one_input = self.trainer.collection_op.split_index(self.trainer._input, index)[0]
-                one_output = self.trainer.collection_op.split_index(self.trainer._output, index)[0]
-
-                res = self.f(one_input, one_output)
-                id = self.trainer._ids[index]
-
-                self.show(res, id)
+        if self.trainer._mode == 'test' and (self.batch_f is not None):
+            res = self.batch_f(self.trainer._input, self.trainer._output, self.trainer._ids)
+            for id in res:
+                self.show(res[id], id)
 
         if self.trainer._mode == 'train':
-            self.tb_writer.add_scalar('loss/summary', self.trainer._loss.detach().cpu(), self.trainer._iteration)
-            # if hasattr(self.trainer, '_loss_values') and len(self.trainer._loss_values) > 1:
-            #     for key in self.trainer._loss_values:
-            #         self.tb_writer.add_scalar(f'loss/{key}', self.trainer._loss_values[key], self.trainer._iteration)
+            if getattr(self.trainer, '_loss_values_step', None) == self.trainer._iteration:
+                self.tb_writer.add_scalar('loss/summary', self.trainer._loss_value, self.trainer._iteration)
+                if hasattr(self.trainer, '_loss_values') and len(self.trainer._loss_values) > 1:
+                    for key in self.trainer._loss_values:
+                        self.tb_writer.add_scalar(f'loss/{key}', self.trainer._loss_values[key], self.trainer._iteration)
+            if (hasattr(self.trainer, '_grad_stats') and
+                    getattr(self.trainer, '_grad_stats_iteration', None) == self.trainer._iteration):
+                for key in self.trainer._grad_stats:
+                    self.tb_writer.add_scalar(f'grad/{key}', self.trainer._grad_stats[key], self.trainer._iteration)
 
     def after_epoch(self):
         """
@@ -0,0 +1,157 @@
+import numpy
+import torch
+
+from setka.pipes.Pipe import Pipe
+
+
+class EarlyStopping(Pipe):
+    """
+    This pipe stops the training when the monitored metric stops improving. After
+    each validation epoch on the specified subset the metric from
+    ```trainer._metrics[subset][metric]``` is compared to the best value observed
+    so far. If it has not improved by more than ```min_delta``` for ```patience```
+    epochs in a row, ```trainer._stop_train_signal``` is raised.
+
+    The pipe may also stop a validation epoch before the whole subset is seen:
+    if ```ci_threshold``` is specified, the epoch is stopped (via
+    ```trainer._stop_epoch_signal```) as soon as the half-width of the confidence
+    interval of the metric reported by ComputeMetrics in
+    ```trainer._avg_metrics_ci``` falls below the threshold. For the non-reduced metrics
+    (e.g. per-class ones) the maximal half-width over the elements is used.
+
+    The non-reduced metrics are compared to the best value after the reduction with ```reduce```
+    (a ValueError is raised if it is not specified for such a metric). The pipe only raises the stop
+    signals, it never clears the signals raised by the other pipes.
+
+    If a Checkpointer is specified, the metric, the subset and the mode are taken
+    from it (unless specified explicitly) and, if ```restore_best``` is True,
+    the best weights saved by the Checkpointer are loaded to the model when the
+    training is stopped.
+
+    Args:
+        metric (str): name of the metric to monitor
+        subset (hashable): name of the subset on which the metric is monitored ('valid' by default)
+        max_mode (bool): if True, the higher the metric -- the better the model (False by default)
+        patience (int): number of epochs without improvement after which the training is stopped
+        min_delta (float): minimal change of the metric that is treated as an improvement
+        ci_threshold (float): half-width of the confidence interval at which the validation epoch is stopped.
+            If None, validation epochs are never stopped.
+        ci_subsets (list): subsets for which the validation epochs may be stopped. If None -- all subsets.
+        min_samples (int): minimal number of samples to process before the validation epoch may be stopped
+        checkpointer (setka.pipes.Checkpointer): checkpointer that tracks the best model
+        restore_best (bool): load the best weights saved by the checkpointer when the training is stopped
+        reduce (str or callable): reduction of the non-reduced metrics ('mean', 'min', 'max' or a function
+            of the numpy array)
+    """
+    def __init__(self, metric=None, subset=None, max_mode=None, patience=10, min_delta=0.0, ci_threshold=None,
+                 ci_subsets=None, min_samples=0, checkpointer=None, restore_best=False, reduce=None):
+        super(EarlyStopping, self).__init__()
+
+        if checkpointer is not None:
+            metric = checkpointer.metric if metric is None else metric
+            subset = checkpointer.subset if subset is None else subset
+            max_mode = checkpointer.max_mode if max_mode is None else max_mode
+
+        if metric is None:
+            raise ValueError('Metric to monitor should be specified either directly or via checkpointer')
+
+        self.metric = metric
+        self.subset = 'valid' if subset is None else subset
+        self.max_mode = bool(max_mode)
+        self.patience = patience
+        self.min_delta = min_delta
+        self.ci_threshold = ci_threshold
+        self.ci_subsets = ci_subsets
+        self.min_samples = min_samples
+        self.checkpointer = checkpointer
+        self.restore_best = restore_best
+        self.reduce = reduce
+
+        if reduce is not None and not callable(reduce) and reduce not in ('mean', 'min', 'max'):
+            raise ValueError('Unknown reduction: ' + str(reduce))
+
+        self.best_metric = None
+        self.wait = 0
+        self.stopped_epoch = None
+
+        self.set_priority({'after_batch': -1, 'after_epoch': -1})
+
+    def reduced(self, value):
+        """
+        Returns the scalar value of the metric (reduced with ```reduce``` for the non-reduced metrics).
+        """
+        if not isinstance(value, (list, tuple, numpy.ndarray, torch.Tensor)):
+            return value
+        value = numpy.asarray(value, dtype=float)
+        if value.size == 1:
+            return float(value.reshape(-1)[0])
+        if self.reduce is None:
+            raise ValueError('Metric ' + str(self.metric) + ' is not reduced, specify reduce of EarlyStopping')
+        if callable(self.reduce):
+            return float(self.reduce(value))
+        return float(getattr(value, self.reduce)())
+
+    def improved(self, value):
+        if self.best_metric is None:
+            return True
+        if self.max_mode:
+            return value > self.best_metric + self.min_delta
+        return value < self.best_metric - self.min_delta
+
+    @staticmethod
+    def ci_width(value):
+        """
+        Returns the half-width of the confidence interval, the maximal one for the non-reduced metrics.
+        """
+        if isinstance(value, (list, tuple, numpy.ndarray, torch.Tensor)):
+            value = numpy.asarray(value, dtype=float)
+            return float(value.max()) if value.size > 0 else float('inf')
+        return float(value)
+
+    def after_batch(self):
+        """
+        Stops the validation epoch if the confidence interval of the metric is tight enough.
+        """
+        if self.ci_threshold is None or self.trainer._mode != 'valid':
+            return
+        if self.ci_subsets is not None and self.trainer._subset not in self.ci_subsets:
+            return
+
+        ci = getattr(self.trainer, '_avg_metrics_ci', {})
+        if (self.metric in ci and
+                getattr(self.trainer, '_avg_metrics_samples', 0) >= self.min_samples and
+                self.ci_width(ci[self.metric]) <= self.ci_threshold):
+            self.trainer._stop_epoch_signal = True
+
+    def after_epoch(self):
+        """
+        Updates the best metric value and raises the stop signal if the metric has not improved
+        for ```patience``` epochs.
+        """
+        if self.trainer._mode != 'valid' or self.trainer._subset != self.subset:
+            return
+
+        if not (hasattr(self.trainer, '_metrics') and (self.subset in self.trainer._metrics)
+                and (self.metric in self.trainer._metrics[self.subset])):
+            return
+
+        value = self.reduced(self.trainer._metrics[self.subset][self.metric])
+        if self.improved(value):
+            self.best_metric = value
+            self.wait = 0
+        else:
+            self.wait += 1
+
+        self.trainer.status['EarlyStopping'] = f'{self.wait}/{self.patience}'
+
+        if self.wait >= self.patience:
+            self.trainer._stop_train_signal = True
+            self.stopped_epoch = self.trainer._epoch
+
+    def after_train(self):
+        """
+        Loads the best weights saved by the checkpointer if the training was stopped.
+        """
+        if self.stopped_epoch is not None and self.restore_best and self.checkpointer is not None:
+            state = torch.load(self.checkpointer.weights_path('best'), map_location='cpu')
+            self.trainer._model.load_state_dict(state)
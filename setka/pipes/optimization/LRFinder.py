@@ -0,0 +1,206 @@
+import copy
+import math
+
+import numpy
+import pandas
+
+from setka.pipes.Pipe import Pipe
+from setka.base.environment_setup import collect_random_states, set_random_states
+from setka.pipes.basic.DatasetHandler import DatasetHandler
+from setka.pipes.basic.ModelHandler import ModelHandler
+from setka.pipes.basic.UseCuda import UseCuda
+from setka.pipes.optimization.LossHandler import LossHandler
+from setka.pipes.optimization.OneStepOptimizers import OneStepOptimizers
+
+
+class LRFinder(Pipe):
+    """
+    This pipe performs learning rate range test. It trains the model for a bounded number of
+    batches while the learning rate grows exponentially from ```start_lr``` to ```end_lr``` and records
+    the smoothed loss from ```trainer._loss```. The sweep is stopped earlier if the loss diverges.
+    After the sweep the model, the optimizers (with their schedulers), the trainer counters and the random
+    states are restored from in-memory copies, so the sweep does not affect the training.
+
+    The learning rate with the steepest decrease of the smoothed loss is suggested (stored in
+    ```suggested_lr```). If ```apply``` is True, it is set to the optimizers.
+
+    During the sweep only the pipes of ```pipe_types``` (and the finder itself) are run,
+    so the sweep is not logged or checkpointed. Schedulers of the optimizers are suspended.
+
+    The sweep is performed when the training begins (if ```run_before_train``` is True) or
+    when ```find``` is called.
+
+    Args:
+        optimizers (list of setka.base.Optimizer): optimizers to tune. If None, all the optimizers
+            of the OneStepOptimizers pipes are used.
+        start_lr (float): learning rate to start the sweep from.
+        end_lr (float): learning rate to finish the sweep at.
+        n_iterations (int): number of training batches in the sweep.
+        subset (hashable): subset to use for the sweep.
+        smoothing (float): factor of the exponential moving average of the loss.
+        divergence (float): sweep is stopped when the smoothed loss exceeds the best smoothed loss
+            this number of times.
+        apply (bool): if True, the suggested learning rate is set to the optimizers.
+        run_before_train (bool): if True, the sweep is performed when the training begins.
+        pipe_types (tuple): types of the pipes that are run during the sweep.
+    """
+    def __init__(self, optimizers=None, start_lr=1.0e-7, end_lr=10.0, n_iterations=100, subset='train',
+                 smoothing=0.98, divergence=4.0, apply=False, run_before_train=True,
+                 pipe_types=(DatasetHandler, ModelHandler, UseCuda, LossHandler, OneStepOptimizers)):
+        super(LRFinder, self).__init__()
+        self.optimizers = optimizers
+        self.start_lr = start_lr
+        self.end_lr = end_lr
+        self.n_iterations = n_iterations
+        self.subset = subset
+        self.smoothing = smoothing
+        self.divergence = divergence
+        self.apply = apply
+        self.run_before_train = run_before_train
+        self.pipe_types = pipe_types
+
+        self.results = None
+        self.suggested_lr = None
+
+        self._sweep_optimizers = None
+        self._records = None
+        self._avg_loss = 0.0
+        self._best_loss = None
+
+    def get_optimizers(self):
+        if self.optimizers is not None:
+            return self.optimizers
+
+        res = []
+        for pipe in self.trainer._pipes:
+            if isinstance(pipe, OneStepOptimizers):
+                res.extend(pipe.optimizers)
+        return res
+
+    def get_lr(self, step):
+        if self.n_iterations <= 1:
+            return self.start_lr
+        return self.start_lr * (self.end_lr / self.start_lr) ** (float(step) / (self.n_iterations - 1))
+
+    def suggest(self):
+        """
+        Returns the learning rate with the steepest decrease of the smoothed loss.
+        """
+        if len(self.results) < 3:
+            return None
+
+        log_lrs = numpy.log(self.results['lr'].values)
+        losses = self.results['smoothed_loss'].values
+        finite = numpy.isfinite(losses)
+        if finite.sum() < 3:
+            return None
+
+        gradients = numpy.gradient(losses[finite], log_lrs[finite])
+        return float(self.results['lr'].values[finite][gradients.argmin()])
+
+    @staticmethod
+    def set_lr(optimizers, lr):
+        """
+        Sets the learning rate to the optimizers and to the base learning rates of their schedulers
+        (the schedulers are detached during the sweep, the groups are restored after it).
+        """
+        for optimizer in optimizers:
+            for group in optimizer.optimizer.param_groups:
+                group['lr'] = lr
+                if 'initial_lr' in group:
+                    group['initial_lr'] = lr
+
+            for scheduler in optimizer._iter_schedulers + optimizer._epoch_schedulers:
+                if scheduler.closed_form:
+                    scheduler.base_lrs = [lr] * len(scheduler.base_lrs)
+                    continue
+                torch_scheduler = getattr(scheduler, '_scheduler', None)
+                if hasattr(torch_scheduler, 'base_lrs'):
+                    torch_scheduler.base_lrs = [lr] * len(torch_scheduler.base_lrs)
+
+    def find(self):
+        """
+        Performs the learning rate sweep.
+
+        Returns:
+            pandas.DataFrame with learning rates, losses and smoothed losses.
+        """
+        optimizers = self.get_optimizers()
+
+        modules = [self.trainer._model] + [optimizer.module for optimizer in optimizers]
+        module_states = [copy.deepcopy(module.state_dict()) for module in modules]
+        optimizer_states = [copy.deepcopy(optimizer.optimizer.state_dict()) for optimizer in optimizers]
+        schedulers = [(optimizer._iter_schedulers, optimizer._epoch_schedulers) for optimizer in optimizers]
+        counters = (self.trainer._epoch, self.trainer._iteration)
+        status = copy.deepcopy(self.trainer.status)
+        random_states = collect_random_states()
+        pipes = self.trainer._pipes
+
+        for optimizer in optimizers:
+            optimizer._iter_schedulers = []
+            optimizer._epoch_schedulers = []
+
+        self.trainer._pipes = [pipe for pipe in pipes if isinstance(pipe, self.pipe_types) or pipe is self]
+        self._sweep_optimizers = optimizers
+        self._records = []
+        self._avg_loss = 0.0
+        self._best_loss = None
+        self.set_lr(optimizers, self.get_lr(0))
+
+        try:
+            self.trainer.run_epoch(mode='train', subset=self.subset, n_iterations=self.n_iterations)
+        finally:
+            self.trainer._pipes = pipes
+            self.trainer._stop_epoch_signal = False
+            self._sweep_optimizers = None
+
+            for module, state in zip(modules, module_states):
+                module.load_state_dict(state)
+            for optimizer, state, (iter_schedulers, epoch_schedulers) in zip(
+                    optimizers, optimizer_states, schedulers):
+                optimizer.optimizer.load_state_dict(state)
+                optimizer.sync_master()
+                optimizer._iter_schedulers = iter_schedulers
+                optimizer._epoch_schedulers = epoch_schedulers
+
+            self.trainer._epoch, self.trainer._iteration = counters
+            self.trainer.status = status
+            set_random_states(random_states)
+
+        self.results = pandas.DataFrame(self._records, columns=['lr', 'loss', 'smoothed_loss'])
+        self._records = None
+        self.suggested_lr = self.suggest()
+
+        if self.apply and self.suggested_lr is not None:
+            self.set_lr(optimizers, self.suggested_lr)
+
+        return self.results
+
+    def before_train(self):
+        """
+        Performs the learning rate sweep if it was not performed yet.
+        """
+        if self.run_before_train and self.results is None:
+            self.find()
+
+    def after_batch(self):
+        """
+        Records the loss and increases the learning rate during the sweep.
+        """
+        if self._sweep_optimizers is None or self.trainer._mode != 'train':
+            return
+
+        step = len(self._records)
+        loss = float(self.trainer._loss.detach().cpu().item())
+
+        self._avg_loss = self.smoothing * self._avg_loss + (1.0 - self.smoothing) * loss
+        smoothed_loss = self._avg_loss / (1.0 - self.smoothing ** (step + 1))
+        self._records.append({'lr': self.get_lr(step), 'loss': loss, 'smoothed_loss': smoothed_loss})
+
+        if self._best_loss is None or smoothed_loss < self._best_loss:
+            self._best_loss = smoothed_loss
+
+        if (not math.isfinite(smoothed_loss)) or (smoothed_loss > self.divergence * self._best_loss):
+            self.trainer._stop_epoch_signal = True
+        else:
+            self.set_lr(self._sweep_optimizers, self.get_lr(step + 1))
@@ -1,6 +1,9 @@
+import time
+
 import torch
 
 from setka.pipes.Pipe import Pipe
+from setka.base.compilation import compile_callable
 from copy import deepcopy
 
 
@@ -8,54 +11,185 @@ class LossHandler(Pipe):
     """
     Handles loss functions.
 
+    The values of the loss terms are accumulated on the device and are transferred to the host
+    every ```log_freq``` iterations (and at the end of the epoch), so no synchronization with the
+    device is performed at the other iterations.
+
+    If ```self.trainer._loss_scale``` is set (e.g. by setka.pipes.MemoryGuard for the micro-batches),
+    the loss is multiplied by it before the backward pass. The values of the micro-batches are accumulated
+    with the same weights (the fractions of the batch), so the batch is counted once for the averages and
+    for ```log_freq```.
+
+    With ```compile``` the criteria are compiled as the model of setka.pipes.ModelHandler: with torch.compile,
+    falling back to torch.jit.trace and to the eager criterion (with a warning). The criteria are compiled
+    lazily for each mode and signature of the output and the input. The time of the compilation is reported
+    in self.trainer.status['Loss compile'] (together with the last error of the fallback, if any) and in
+    self.trainer._loss_compile_time for the epoch, it is excluded from the throughput of ModelHandler.
+
     Stores:
         self.trainer._loss -- loss value for the model
+        self.trainer._loss_values -- dict with the values of the loss terms (averaged over the
+            last ```log_freq``` iterations), updated every ```log_freq``` iterations
+        self.trainer._loss_value -- the averaged value of the whole loss, updated together with
+            self.trainer._loss_values
+        self.trainer._loss_values_step -- the iteration when the values were updated
 
     Args:
         criterion (callable, list of callable): loss function or list of loss functions
         coefs (list): List of loss functions coefficients
         retain_graph (bool): Retain graph after criterion backward call
+        log_freq (int): interval (in iterations) between transfers of the loss values to the host.
+        weighting (torch.nn.Module): module that combines the loss terms (multiplied by the coefs)
+            into the loss, e.g. setka.pipes.UncertaintyWeighting or setka.pipes.DynamicWeightAverage.
+            If None, the terms are summed.
+        compile (bool or str): compile the criteria: True or 'compile' to use torch.compile (with fallback
+            to torch.jit.trace), 'trace' to use torch.jit.trace.
     """
-    def __init__(self, criterion, coefs=None, retain_graph=None):
+    def __init__(self, criterion, coefs=None, retain_graph=None, log_freq=1, weighting=None, compile=False):
         super(LossHandler, self).__init__()
         self.retain_graph = retain_graph
         self.criterion = criterion
         if not isinstance(self.criterion, (tuple, list)):
             self.criterion = [self.criterion]
         self.coefs = coefs if coefs is not None else [1.0] * len(self.criterion)
+        self.log_freq = log_freq
+        self.weighting = weighting
+        self.compile = 'compile' if compile is True else compile
+        self.compiled = {}
+        self.compile_time = 0.0
+        self.epoch_compile_time = 0.0
+        self.compile_error = None
 
         if len(self.coefs) != len(self.criterion):
             raise RuntimeError('Number of criterion and coefficients are not equal')
 
+        self.reset_values()
+        self.batch_fraction = 0.0
         self.set_priority({'on_batch': 9, 'after_batch': -9})
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['compiled'] = {}
+        return state
+
+    def evaluate(self, index, cur_criterion):
+        """
+        Computes the criterion on the output and the input of the batch (compiling it if needed).
+        """
+        args = (self.trainer._output, self.trainer._input)
+        if not self.compile:
+            return cur_criterion(*args)
+
+        key = (index, self.trainer._mode == 'train', self.trainer.collection_op.signature(args))
+        if key in self.compiled:
+            return self.compiled[key](*args)
+
+        start = time.time()
+        self.compiled[key], value, error = compile_callable(
+            cur_criterion, args, use_compile=self.compile == 'compile', name='criterion')
+        if error is not None:
+            self.compile_error = error
+
+        elapsed = time.time() - start
+        self.compile_time += elapsed
+        self.epoch_compile_time += elapsed
+        self.trainer._loss_compile_time = self.epoch_compile_time
+        self.trainer.status['Loss compile'] = {'Time': self.compile_time, 'Variants': len(self.compiled)}
+        if self.compile_error is not None:
+            self.trainer.status['Loss compile']['Error'] = repr(self.compile_error)
+        return value
+
     def formula(self):
+        if self.weighting is not None:
+            terms = ', '.join([f'{coef} * {str(loss)}' for loss, coef in zip(self.criterion, self.coefs)])
+            return f'Loss = {self.weighting.__class__.__name__}({terms})'
         return 'Loss = ' + ' + '.join([f'{coef} * {str(loss)}' for loss, coef in zip(self.criterion, self.coefs)])
 
+    def reset_values(self):
+        self.values_sum = None
+        self.loss_sum = None
+        self.n_values = 0
+
+    def flush_values(self):
+        """
+        Transfers the accumulated values of the loss terms to the host.
+        """
+        if self.n_values == 0:
+            return
+
+        values = (torch.cat([self.values_sum, self.loss_sum.reshape(1)]) / self.n_values).cpu().tolist()
+        self.trainer._loss_values = {
+            cur_criterion.__name__: value for cur_criterion, value in zip(self.criterion, values[:-1])}
+        self.trainer._loss_value = values[-1]
+        self.trainer._loss_values_step = self.trainer._iteration
+
+        self.trainer.status['Loss'] = values[-1]
+        self.reset_values()
+
+    def before_epoch(self):
+        """
+        Resets the accumulated loss values and the compilation time of the epoch.
+        """
+        self.reset_values()
+        self.batch_fraction = 0.0
+        self.epoch_compile_time = 0.0
+        self.trainer._loss_compile_time = 0.0
+        if self.weighting is not None and self.weighting.training != (self.trainer._mode == 'train'):
+            self.weighting.train(self.trainer._mode == 'train')
+
     def on_batch(self):
         """
-        Computes loss in case self.trainer is in mode 'train' or 'valid'.
+        Computes loss in case self.trainer is in mode 'train' or 'valid'. Backward pass is skipped
+        if the loss does not require gradients (e.g. all the optimizers skip the iteration).
         """
         if self.trainer._mode in ["train", "valid"]:
-            self.trainer._loss = 0
-            self.trainer._loss_values = {}
             with torch.set_grad_enabled(self.trainer._mode == 'train'):
-                for cur_coef, cur_criterion in zip(self.coefs, self.criterion):
-                    cur_loss = cur_criterion(self.trainer._output, self.trainer._input)
-                    self.trainer._loss = self.trainer._loss + cur_coef * cur_loss
-                    self.trainer._loss_values[cur_criterion.__name__] = cur_loss.item()
+                terms = torch.stack([
+                    torch.as_tensor(self.evaluate(index, cur_criterion)).reshape(())
+                    for index, cur_criterion in enumerate(self.criterion)])
+                weighted = terms * torch.tensor(self.coefs, dtype=terms.dtype, device=terms.device)
+
+                if self.weighting is not None:
+                    self.trainer._loss = self.weighting(weighted)
+                else:
+                    self.trainer._loss = weighted.sum()
+
+            loss_scale = getattr(self.trainer, '_loss_scale', None)
+            if self.trainer._mode == "train" and self.trainer._loss.requires_grad:
+                loss = self.trainer._loss if loss_scale is None else self.trainer._loss * loss_scale
+                loss.backward(retain_graph=self.retain_graph)
 
-            if self.trainer._mode == "train":
-                self.trainer._loss.backward(retain_graph=self.retain_graph)
+            # the micro-batches are weighted by their fractions of the batch
+            scale = 1.0 if loss_scale is None else loss_scale
+            terms = terms.detach() * scale
+            loss = self.trainer._loss.detach() * scale
+            if self.values_sum is None:
+                self.values_sum = terms.clone()
+                self.loss_sum = loss.clone()
+            else:
+                self.values_sum += terms
+                self.loss_sum += loss
+            self.n_values += scale
+
+            self.batch_fraction += scale
+            if self.batch_fraction > 1.0 - 1.0e-6:
+                self.batch_fraction = 0.0
+                if self.trainer._epoch_iteration % self.log_freq == 0:
+                    self.flush_values()
 
-            self.trainer.status['Loss'] = self.trainer._loss.detach().cpu().item()
             self.trainer.status['Formula'] = self.formula()
 
     def after_epoch(self):
         """
-        Releases loss value in case it is present.
+        Transfers the rest of the accumulated values to the host, releases loss value in case it is present.
+        Updates the weighting after the training epoch.
         """
         if self.trainer._mode in ["train", "valid"]:
+            self.flush_values()
+
+            if self.trainer._mode == 'train' and hasattr(self.weighting, 'end_epoch'):
+                self.weighting.end_epoch()
+
             if hasattr(self.trainer, '_loss'):
                 del self.trainer._loss
             if hasattr(self.trainer, '_loss_values'):
@@ -0,0 +1,68 @@
+import torch
+
+
+class UncertaintyWeighting(torch.nn.Module):
+    r"""
+    Weights the loss terms with the learned homoscedastic uncertainty (Kendall et al.):
+    $$L = \sum_i e^{-s_i} L_i + s_i,$$
+    where $s_i$ is the learned log-variance of the i-th term. The parameters of the module
+    should be optimized together with the model (e.g. with a separate setka.base.Optimizer).
+
+    Args:
+        n_terms (int): number of the loss terms.
+    """
+    def __init__(self, n_terms):
+        super(UncertaintyWeighting, self).__init__()
+        self.log_vars = torch.nn.Parameter(torch.zeros(n_terms))
+
+    def weights(self):
+        return torch.exp(-self.log_vars.detach())
+
+    def forward(self, losses):
+        log_vars = self.log_vars.to(losses.device)
+        return (torch.exp(-log_vars) * losses + log_vars).sum()
+
+
+class DynamicWeightAverage(torch.nn.Module):
+    r"""
+    Dynamic Weight Average (Liu et al.): the weights of the loss terms are computed from the rates
+    of the decrease of the terms during the two previous training epochs:
+    $$w_i = N \, \mathrm{softmax}_i(r_i / T), \quad r_i = \bar{L}_i(t - 1) / \bar{L}_i(t - 2).$$
+    The weights are constant during the epoch, so a single backward pass is performed and no
+    gradients with respect to the weights are computed. Epoch averages are accumulated on the device.
+
+    Args:
+        n_terms (int): number of the loss terms.
+        temperature (float): temperature of the softmax.
+    """
+    def __init__(self, n_terms, temperature=2.0):
+        super(DynamicWeightAverage, self).__init__()
+        self.n_terms = n_terms
+        self.temperature = temperature
+        self.register_buffer('history', torch.zeros(2, n_terms))
+        self.register_buffer('epoch_sum', torch.zeros(n_terms))
+        self.register_buffer('epoch_count', torch.zeros(()))
+        self.n_epochs = 0
+
+    def weights(self):
+        if self.n_epochs < 2:
+            return torch.ones_like(self.epoch_sum)
+        rates = self.history[1] / self.history[0].clamp_min(1.0e-12)
+        return self.n_terms * torch.softmax(rates / self.temperature, dim=0)
+
+    def forward(self, losses):
+        if self.training:
+            self.epoch_sum = self.epoch_sum.to(losses.device) + losses.detach()
+            self.epoch_count = self.epoch_count.to(losses.device) + 1
+        return (self.weights().to(losses.device) * losses).sum()
+
+    def end_epoch(self):
+        """
+        Stores the average values of the terms of the finished training epoch.
+        """
+        if self.epoch_count > 0:
+            self.history = torch.stack([self.history[1].to(self.epoch_sum.device),
+                                        self.epoch_sum / self.epoch_count])
+            self.n_epochs += 1
+        self.epoch_sum = torch.zeros_like(self.epoch_sum)
+        self.epoch_count = torch.zeros_like(self.epoch_count)
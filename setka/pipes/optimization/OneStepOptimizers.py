@@ -1,3 +1,6 @@
+import collections
+import torch
+
 from setka.pipes.Pipe import Pipe
 from setka.base.Optimizer import Optimizer
 
@@ -6,15 +9,36 @@ class OneStepOptimizers(Pipe):
     """
     This pipe takes care of the optimization process.
 
+    At each training iteration only the optimizers that are active (see setka.base.Optimizer
+    ```is_active``` and ```step_policy```) zero gradients and make steps. Gradients of the parameters of
+    the skipped optimizers are disabled for the iteration, so the backward pass is not computed for them.
+    Gradients are clipped before the step if the optimizer specifies clipping.
+
+    Every ```grad_stats_freq``` iterations the gradient statistics are collected: the global norm of the
+    gradients of each optimizer and the norms for the children of the optimized modules. They are stored
+    in self.trainer._grad_stats (with keys like 'norm/0' and 'norm/0/fc', where 0 is the index of the
+    optimizer) and shown in self.trainer.status['Grad'].
+
     Attributes:
         self.trainer._optimizers: list of optimizers for a model.
 
     Args:
         optimizers (list of setka.base.Optimizer): list of optimizers.
+
+        grad_stats_freq (int): interval (in iterations) between the gradient statistics collections.
+            None means that the statistics are not collected.
+
+        skip_nonfinite (bool): if True, the step is skipped in case the gradients contain NaN or Inf values.
+            Note that the check requires the synchronization with the device at each iteration.
     """
-    def __init__(self, optimizers):
+    def __init__(self, optimizers, grad_stats_freq=None, skip_nonfinite=False):
         super(OneStepOptimizers, self).__init__()
         self.optimizers = optimizers
+        self.grad_stats_freq = grad_stats_freq
+        self.skip_nonfinite = skip_nonfinite
+        self.n_skipped = [0] * len(optimizers)
+        self.stepping = []
+        self.set_priority({'after_batch': 5})
 
     def on_init(self):
         # self.trainer._optimizers = self.optimizers
@@ -24,33 +48,92 @@ class OneStepOptimizers(Pipe):
 
     def before_batch(self):
         """
-        Zeros grad for the active optimizers, turns modules with active optimizers to the training mode.
+        Zeros grad for the optimizers that make step at the current iteration, turns modules with active
+        optimizers to the training mode (the mode is switched only if it differs from the current one).
+        Disables gradients for the parameters of the optimizers that skip the iteration. Sets the learning
+        rates of the closed-form schedules for the current iteration.
         """
         if self.trainer._mode == 'train':
             for optimizer in self.optimizers:
-                if optimizer.active:
-                    optimizer.optimizer.zero_grad()
-                    optimizer.module.train()
-                    optimizer.module.requires_grad = True
+                optimizer.set_schedules_step(self.trainer)
 
-    def before_batch(self):
+            self.stepping = [optimizer.is_active(self.trainer) for optimizer in self.optimizers]
+
+            for optimizer, stepping in zip(self.optimizers, self.stepping):
+                if not stepping:
+                    optimizer.set_requires_grad(False)
+
+            for optimizer, stepping in zip(self.optimizers, self.stepping):
+                if stepping:
+                    optimizer.set_requires_grad(True)
+                    optimizer.zero_grad()
+                    if not optimizer.module.training:
+                        optimizer.module.train()
+
+    def collect_stats(self):
+        return (self.grad_stats_freq is not None and
+                self.trainer._iteration % self.grad_stats_freq == 0)
+
+    def after_batch(self):
         """
-        Active optimizers make step.
+        Active optimizers clip gradients and make step (the step is skipped for the non-finite gradients if
+        skip_nonfinite is set). Collects the gradient statistics.
         """
         if self.trainer._mode == 'train':
-            for optimizer in self.optimizers:
-                if optimizer.active:
-                    optimizer.optimizer.step()
+            collect = self.collect_stats()
+            stats = collections.OrderedDict()
 
-        self.trainer._model.eval()
-        self.trainer._model.requires_grad = False
+            for index, (optimizer, stepping) in enumerate(zip(self.optimizers, self.stepping)):
+                if not stepping:
+                    continue
 
-        if self.trainer._mode == 'train' and self.trainer._iteration > 0:
-            for optimizer in self.optimizers:
-                optimizer.step_iter_schedulers()
+                if collect:
+                    for name, value in optimizer.module_grad_norms().items():
+                        stats[f'norm/{index}/{name}'] = value
 
+                norm = optimizer.clip_grads()
+                if norm is None and (collect or self.skip_nonfinite):
+                    norm = optimizer.grad_norm()
+
+                if collect:
+                    stats[f'norm/{index}'] = norm
+
+                if self.skip_nonfinite and not torch.isfinite(norm).item():
+                    self.n_skipped[index] += 1
+                    continue
+
+                optimizer.step()
+
+            if collect:
+                self.trainer._grad_stats = collections.OrderedDict(
+                    (key, float(value)) for key, value in stats.items())
+                for index, n_skipped in enumerate(self.n_skipped):
+                    self.trainer._grad_stats[f'skipped/{index}'] = n_skipped
+                self.trainer._grad_stats_iteration = self.trainer._iteration
+
+                self.trainer.status['Grad'] = collections.OrderedDict()
+                for index in range(len(self.optimizers)):
+                    if f'norm/{index}' in self.trainer._grad_stats:
+                        self.trainer.status['Grad'][f'Norm {index}'] = self.trainer._grad_stats[f'norm/{index}']
+                if self.skip_nonfinite:
+                    self.trainer.status['Grad']['Skipped'] = sum(self.n_skipped)
+
+            if self.trainer._iteration > 0:
+                for optimizer in self.optimizers:
+                    optimizer.step_iter_schedulers()
 
     def before_epoch(self):
         if self.trainer._mode == 'train' and self.trainer._epoch > 1:
             for optimizer in self.optimizers:
                 optimizer.step_epoch_schedulers()
+
+    def after_epoch(self):
+        """
+        Switches the model to the evaluation mode after the training epoch, enables gradients
+        disabled by the step policies.
+        """
+        if self.trainer._mode == 'train':
+            self.trainer._model.eval()
+            for optimizer in self.optimizers:
+                optimizer.set_requires_grad(True)
+            self.stepping = []
@@ -0,0 +1,148 @@
+import copy
+import torch
+
+from setka.pipes.Pipe import Pipe
+from setka.pipes.basic.DatasetHandler import DatasetHandler, DatasetWrapper
+from setka.pipes.optimization.WeightAveraging import model_tensors, model_device
+
+
+class StochasticWeightAveraging(Pipe):
+    r"""
+    This pipe performs Stochastic Weight Averaging: the weights of the model are averaged
+    with equal weights over the snapshots taken at the end of the training epochs:
+    $$\tilde{w} = \frac{n \tilde{w} + w}{n + 1},$$
+    where $\tilde{w}$ is a weight of the averaged model, $n$ is a number of snapshots averaged so far and
+    $w$ is a weight of the optimized model. The model is duplicated only once, the following snapshots
+    are accumulated in-place.
+
+    Since the running statistics of BatchNorm layers of the averaged model do not correspond to its
+    weights, they are recomputed before the averaged model is used for the first time after the
+    update: the averaged model is passed over ```bn_batches``` batches of the ```subset```.
+
+    During validation and testing, the averaged model is used.
+
+    Args:
+        epoch_start (int): epoch when the averaging starts.
+        interval (int): interval between the epochs when the snapshots are taken.
+        bn_batches (int): number of batches to recompute BatchNorm statistics on. If None -- the whole subset
+            is used, if 0 -- the statistics are not recomputed.
+        subset (hashable): subset used to recompute BatchNorm statistics. It is loaded with the settings of
+            setka.pipes.DatasetHandler (the batch size of the mode with the same name, 'train' if there is none).
+        offload (bool): if True, the averaged model is kept on CPU. It is moved to the device of the
+            trained model for validation and testing only.
+    """
+    inference = True
+
+    def __init__(self, epoch_start=10, interval=1, bn_batches=100, subset='train', offload=False):
+        super(StochasticWeightAveraging, self).__init__()
+        self.epoch_start = epoch_start
+        self.interval = interval
+        self.bn_batches = bn_batches
+        self.subset = subset
+        self.offload = offload
+        self.n_averaged = 0
+        self.bn_updated = True
+
+    def update_bn(self):
+        """
+        Recomputes running statistics of BatchNorm layers of the averaged model.
+        """
+        bn_modules = [module for module in self.averaged_model.modules()
+                      if isinstance(module, torch.nn.modules.batchnorm._BatchNorm)]
+        if len(bn_modules) == 0 or self.bn_batches == 0:
+            return
+
+        handler = None
+        for pipe in self.trainer._pipes:
+            if isinstance(pipe, DatasetHandler):
+                handler = pipe
+                break
+        if handler is None:
+            raise RuntimeError('StochasticWeightAveraging needs setka.pipes.DatasetHandler to recompute '
+                               'BatchNorm statistics (use bn_batches=0 to keep them as is)')
+
+        batch_size = handler.batch_size.get(self.subset, handler.batch_size['train'])
+        loader = handler.make_loader(DatasetWrapper(handler.dataset[self.subset], self.subset), batch_size)
+
+        momenta = []
+        for module in bn_modules:
+            module.reset_running_stats()
+            momenta.append(module.momentum)
+            module.momentum = None
+
+        was_training = self.averaged_model.training
+        self.averaged_model.train()
+        device = model_device(self.averaged_model)
+
+        with torch.no_grad():
+            for index, (input, _) in enumerate(loader):
+                if self.bn_batches is not None and index >= self.bn_batches:
+                    break
+                self.averaged_model(self.trainer.collection_op.to(input, device=device))
+
+        self.averaged_model.train(was_training)
+        for module, momentum in zip(bn_modules, momenta):
+            module.momentum = momentum
+
+    def before_epoch(self):
+        """
+        Changes the model to the averaged model in case the Trainer is in 'valid' or 'test' modes,
+        recomputes BatchNorm statistics if needed.
+        """
+        if (hasattr(self, 'averaged_model') and (
+                self.trainer._mode == 'valid' or
+                self.trainer._mode == 'test')):
+            self.trainable_model = self.trainer._model
+            if self.offload:
+                self.averaged_model.to(model_device(self.trainable_model))
+            self.trainer._model = self.averaged_model
+
+            if not self.bn_updated:
+                self.update_bn()
+                self.bn_updated = True
+
+    def after_epoch(self):
+        """
+        Takes the snapshot of the model after the training epoch. Sets the model from averaged to trained
+        if the trainer is in 'valid' or 'test' modes.
+        """
+        if (hasattr(self, 'averaged_model') and (
+                self.trainer._mode == 'valid' or
+                self.trainer._mode == 'test')):
+            self.trainer._model = self.trainable_model
+            if self.offload:
+                self.averaged_model.to('cpu')
+
+        if (self.trainer._mode == 'train' and
+                self.trainer._epoch >= self.epoch_start and
+                (self.trainer._epoch - self.epoch_start) % self.interval == 0):
+            self.update()
+
+    def update(self):
+        """
+        Adds the current state of the trained model to the average.
+        """
+        if not hasattr(self, 'averaged_model'):
+            self.averaged_model = copy.deepcopy(self.trainer._model)
+            if self.offload:
+                self.averaged_model.to('cpu')
+            self.n_averaged = 1
+            self.bn_updated = False
+            return
+
+        avg_tensors, avg_copied = model_tensors(self.averaged_model)
+        trn_tensors, trn_copied = model_tensors(self.trainer._model)
+
+        if self.offload:
+            trn_tensors = [tensor.detach().to('cpu') for tensor in trn_tensors]
+            trn_copied = [buf.to('cpu') for buf in trn_copied]
+
+        with torch.no_grad():
+            torch._foreach_mul_(avg_tensors, self.n_averaged / (self.n_averaged + 1.0))
+            torch._foreach_add_(avg_tensors, trn_tensors, alpha=1.0 / (self.n_averaged + 1.0))
+
+            for avg_buf, trn_buf in zip(avg_copied, trn_copied):
+                avg_buf.copy_(trn_buf)
+
+        self.n_averaged += 1
+        self.bn_updated = False
@@ -1,5 +1,23 @@
-from setka.pipes.Pipe import Pipe
 import copy
+import torch
+
+from setka.pipes.Pipe import Pipe
+from setka.base.memory_tracking import model_device
+
+
+def model_tensors(model):
+    """
+    Returns the floating point tensors of the model (parameters and buffers) that are averaged
+    and the rest of the buffers (e.g. BatchNorm batch counters) that are copied.
+    """
+    averaged = list(model.parameters())
+    copied = []
+    for buf in model.buffers():
+        if torch.is_floating_point(buf):
+            averaged.append(buf)
+        else:
+            copied.append(buf)
+    return averaged, copied
 
 
 class WeightAveraging(Pipe):
@@ -9,6 +27,9 @@ class WeightAveraging(Pipe):
     $$\tilde{w}_i = \gamma \tilde{w}_i + (1.0 - \gamma) w_i,$$
     where $\tilde{w}$ is a weight of an averaged model, $\gamma$ is a parameter
     of an exponential moving average, $w_i$ is a weight of an optimized model.
+    Floating point buffers (e.g. BatchNorm running statistics) are averaged in the
+    same way, the rest of the buffers are copied. The update is performed in-place
+    with multi-tensor operations over all the tensors of the model at once.
 
     This pipes does nothing until specified epoch. After this epoch it
     begins tracking of the averaged model. During validation and testing, the
@@ -21,13 +42,27 @@ class WeightAveraging(Pipe):
 
         interval (int): interval between the iterations when the model is averaged.
 
+        warmup (bool): if True, the factor is reduced in the beginning of the averaging:
+            $\gamma_n = \min(\gamma, (1 + n) / (10 + n))$, where $n$ is a number of updates made.
+
+        offload (bool): if True, the averaged model is kept on CPU. It is moved to the device of the
+            trained model for validation and testing only.
     """
+    inference = True
 
-    def __init__(self, gamma=0.99, epoch_start=10, interval=10):
+    def __init__(self, gamma=0.99, epoch_start=10, interval=10, warmup=False, offload=False):
         super(WeightAveraging, self).__init__()
         self.gamma = gamma
         self.epoch_start = epoch_start
         self.interval = interval
+        self.warmup = warmup
+        self.offload = offload
+        self.n_updates = 0
+
+    def decay(self):
+        if self.warmup:
+            return min(self.gamma, (1.0 + self.n_updates) / (10.0 + self.n_updates))
+        return self.gamma
 
     def before_epoch(self):
         """
@@ -39,11 +74,16 @@ class WeightAveraging(Pipe):
             self.trainer._mode == 'train'):
 
             self.averaged_model = copy.deepcopy(self.trainer._model)
+            if self.offload:
+                self.averaged_model.to('cpu')
+            self.n_updates = 0
 
         if (hasattr(self, 'averaged_model') and (
                 self.trainer._mode == 'valid' or
                 self.trainer._mode == 'test')):
             self.trainable_model = self.trainer._model
+            if self.offload:
+                self.averaged_model.to(model_device(self.trainable_model))
             self.trainer._model = self.averaged_model
 
     def after_epoch(self):
@@ -55,17 +95,30 @@ class WeightAveraging(Pipe):
                 self.trainer._mode == 'test')):
 
             self.trainer._model = self.trainable_model
+            if self.offload:
+                self.averaged_model.to('cpu')
 
     def after_batch(self):
         """
         If trainer is in 'train' mode, the averaging of the models is performed.
         """
         if (hasattr(self, 'averaged_model') and
-            self.trainer._mode == 'train'):
+            self.trainer._mode == 'train' and
+            self.trainer._iteration % self.interval == 0):
+
+            avg_tensors, avg_copied = model_tensors(self.averaged_model)
+            trn_tensors, trn_copied = model_tensors(self.trainer._model)
+
+            if self.offload:
+                trn_tensors = [tensor.detach().to('cpu') for tensor in trn_tensors]
+                trn_copied = [buf.to('cpu') for buf in trn_copied]
+
+            decay = self.decay()
+            with torch.no_grad():
+                torch._foreach_mul_(avg_tensors, decay)
+                torch._foreach_add_(avg_tensors, trn_tensors, alpha=1.0 - decay)
 
-            avg_pars = self.averaged_model.parameters()
-            trn_pars = self.trainer._model.parameters()
+                for avg_buf, trn_buf in zip(avg_copied, trn_copied):
+                    avg_buf.copy_(trn_buf)
 
-            if self.trainer._iteration % self.interval ==0:
-                for avg_par, trn_par in zip(avg_pars, trn_pars):
-                    avg_par = avg_par * (1.0 - self.gamma) + trn_par * self.gamma
+            self.n_updates += 1
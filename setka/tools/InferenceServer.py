@@ -0,0 +1,254 @@
+import json
+import time
+import asyncio
+import collections
+
+import numpy
+import torch
+
+from setka.base.Trainer import Trainer
+from setka.base.CollectionOperator import CollectionOperator
+from setka.pipes.basic.ModelHandler import ModelHandler
+
+
+def json_to_tensors(obj):
+    """
+    Converts the decoded JSON request to the sample: dicts are converted recursively, lists of numbers
+    (possibly nested) are converted to tensors.
+    """
+    if isinstance(obj, dict):
+        return {key: json_to_tensors(obj[key]) for key in obj}
+    if isinstance(obj, (list, int, float, bool)):
+        try:
+            return torch.as_tensor(obj)
+        except (TypeError, ValueError):
+            return [json_to_tensors(element) for element in obj]
+    return obj
+
+
+def tensors_to_json(obj):
+    """
+    Converts the output of the sample to JSON-serializable objects.
+    """
+    if isinstance(obj, (tuple, list)):
+        return [tensors_to_json(element) for element in obj]
+    if isinstance(obj, dict):
+        return {str(key): tensors_to_json(obj[key]) for key in obj}
+    if isinstance(obj, (torch.Tensor, numpy.ndarray)):
+        return obj.tolist()
+    return obj
+
+
+def load_weights(model, fname):
+    """
+    Loads the weights dump of setka.pipes.Checkpointer to the model (the prefixes of DataParallel are removed).
+    """
+    state = torch.load(fname, map_location='cpu')
+    state = {(key[len('module.'):] if key.startswith('module.') else key): value for key, value in state.items()}
+    model.load_state_dict(state)
+    return model
+
+
+class InferenceServer:
+    """
+    Serves the model with dynamic request batching. Concurrent requests are collected into micro-batches:
+    a batch is processed when it contains ```max_batch_size``` samples or when ```max_latency``` seconds
+    passed since the first request of the batch arrived. The samples are collated with the ```collate_fn```
+    of the CollectionOperator, the batch is processed by setka.pipes.ModelHandler (in the 'test' mode, under
+    ```torch.inference_mode```, in a worker thread, so the requests are collected during the forward pass)
+    and the outputs are scattered back with ```split```.
+
+    The server may be used from the asyncio code directly (```await server.infer(sample)``` inside
+    ```server.serve()``` or after ```await server.start()```) or through the HTTP front-end on the TCP port
+    or the Unix socket:
+        POST /predict with the JSON body -- returns the JSON output of the sample;
+        GET /stats -- returns the latency percentiles (p50, p99) and the histogram of batch fill.
+
+    Args:
+        model (torch.nn.Module): model to serve.
+        weights (str): path to the weights dump made by setka.pipes.Checkpointer.
+        device (str): device to run the model on.
+        max_batch_size (int): maximum number of samples in a batch.
+        max_latency (float): maximum time (in seconds) the first request of the batch waits for the others.
+        collection_op (setka.base.CollectionOperator): collection operator to collate and split the batches.
+        preprocess (callable): converts decoded JSON request to the sample (json_to_tensors by default).
+        postprocess (callable): converts the output of the sample to JSON (tensors_to_json by default).
+        host (str): host of the HTTP front-end.
+        port (int): port of the HTTP front-end (0 selects a free port).
+        unix_socket (str): path to the Unix socket to listen on instead of the TCP port.
+        **kwargs: arguments of setka.pipes.ModelHandler (e.g. compile).
+    """
+    def __init__(self, model, weights=None, device='cpu', max_batch_size=32, max_latency=0.005, collection_op=None,
+                 preprocess=json_to_tensors, postprocess=tensors_to_json, host='127.0.0.1', port=8000,
+                 unix_socket=None, **kwargs):
+        if weights is not None:
+            load_weights(model, weights)
+
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.preprocess = preprocess
+        self.postprocess = postprocess
+        self.host = host
+        self.port = port
+        self.unix_socket = unix_socket
+
+        model.to(self.device)
+        self.model_handler = ModelHandler(model, **kwargs)
+        self.trainer = Trainer(pipes=[self.model_handler], collection_op=collection_op or CollectionOperator())
+        self.trainer._mode = 'test'
+
+        self.latencies = collections.deque(maxlen=100000)
+        self.batch_fill = collections.Counter()
+        self.n_requests = 0
+
+        self.queue = None
+        self.server = None
+        self.batcher = None
+
+    def process(self, samples):
+        """
+        Processes the list of samples as a batch, returns the list of the outputs.
+        """
+        op = self.trainer.collection_op
+        with torch.inference_mode():
+            self.trainer._input = op.to(op.collate_fn(samples), device=self.device)
+            self.trainer._ids = list(range(len(samples)))
+            self.model_handler.on_batch()
+            outputs = op.split(op.to(self.trainer._output, device='cpu'), batch_size=len(samples))
+            del self.trainer._input, self.trainer._ids, self.trainer._output
+        return outputs
+
+    async def infer(self, sample):
+        """
+        Enqueues the sample and waits for its output.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((sample, future, time.perf_counter()))
+        return await future
+
+    async def collect(self):
+        requests = [await self.queue.get()]
+        deadline = requests[0][2] + self.max_latency
+        while len(requests) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                requests.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        while len(requests) < self.max_batch_size and not self.queue.empty():
+            requests.append(self.queue.get_nowait())
+        return requests
+
+    async def run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            requests = await self.collect()
+            try:
+                outputs = await loop.run_in_executor(None, self.process, [sample for sample, _, _ in requests])
+            except Exception as e:
+                for _, future, _ in requests:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            now = time.perf_counter()
+            for (_, future, start), output in zip(requests, outputs):
+                self.latencies.append(now - start)
+                if not future.done():
+                    future.set_result(output)
+
+            self.batch_fill[len(requests)] += 1
+            self.n_requests += len(requests)
+
+    def stats(self):
+        """
+        Returns the number of processed requests, latency percentiles (in milliseconds) and the histogram
+        of the batch fill {batch size: number of batches}.
+        """
+        res = {'requests': self.n_requests, 'p50_ms': None, 'p99_ms': None,
+               'batch_fill': dict(sorted(self.batch_fill.items()))}
+        if len(self.latencies) > 0:
+            latencies = numpy.array(self.latencies) * 1000.0
+            res['p50_ms'] = float(numpy.percentile(latencies, 50))
+            res['p99_ms'] = float(numpy.percentile(latencies, 99))
+        return res
+
+    @staticmethod
+    def response(writer, status, body):
+        data = json.dumps(body).encode()
+        writer.write(f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\n'
+                     f'Content-Length: {len(data)}\r\nConnection: close\r\n\r\n'.encode() + data)
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode().split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode().strip()
+                if line == '':
+                    break
+                key, _, value = line.partition(':')
+                headers[key.strip().lower()] = value.strip()
+
+            if len(request_line) < 2:
+                self.response(writer, '400 Bad Request', {'error': 'bad request'})
+            elif request_line[0] == 'GET' and request_line[1] == '/stats':
+                self.response(writer, '200 OK', self.stats())
+            elif request_line[0] == 'POST' and request_line[1] == '/predict':
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                output = await self.infer(self.preprocess(json.loads(body.decode())))
+                self.response(writer, '200 OK', self.postprocess(output))
+            else:
+                self.response(writer, '404 Not Found', {'error': 'not found'})
+        except Exception as e:
+            self.response(writer, '500 Internal Server Error', {'error': str(e)})
+
+        await writer.drain()
+        writer.close()
+
+    async def start(self, front_end=True):
+        """
+        Starts the batching loop and (if ```front_end```) the HTTP front-end.
+        """
+        self.queue = asyncio.Queue()
+        self.batcher = asyncio.ensure_future(self.run_batches())
+
+        if front_end:
+            if self.unix_socket is not None:
+                self.server = await asyncio.start_unix_server(self.handle, path=self.unix_socket)
+            else:
+                self.server = await asyncio.start_server(self.handle, host=self.host, port=self.port)
+                self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if self.batcher is not None:
+            self.batcher.cancel()
+            try:
+                await self.batcher
+            except asyncio.CancelledError:
+                pass
+            self.batcher = None
+
+    async def serve(self):
+        """
+        Serves the requests until cancelled.
+        """
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.stop()
+
+    def run(self):
+        """
+        Runs the server in the asyncio event loop (blocking).
+        """
+        asyncio.run(self.serve())
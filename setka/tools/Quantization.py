@@ -0,0 +1,187 @@
+import os
+import copy
+import time
+
+import pandas
+import torch
+
+from setka.base.Trainer import Trainer
+from setka.base.CollectionOperator import CollectionOperator
+from setka.pipes.Lambda import Lambda
+from setka.pipes.basic.DatasetHandler import DatasetHandler
+from setka.pipes.basic.ModelHandler import ModelHandler
+from setka.pipes.basic.ComputeMetrics import ComputeMetrics
+from setka.tools.InferenceServer import load_weights
+
+
+def quantize_dynamic(model, module_types=(torch.nn.Linear, torch.nn.LSTM, torch.nn.GRU), dtype=torch.qint8):
+    """
+    Returns the copy of the model with the dynamically quantized modules of the given types
+    (weights are stored in int8, activations are quantized on the fly).
+    """
+    return torch.ao.quantization.quantize_dynamic(copy.deepcopy(model).eval(), set(module_types), dtype=dtype)
+
+
+def quantize_static(model, calibrate, example_input, backend='fbgemm'):
+    """
+    Returns the copy of the model quantized statically with FX graph mode quantization. The model should be
+    symbolically traceable. ```calibrate(prepared_model)``` should run the prepared model on the
+    calibration data.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    torch.backends.quantized.engine = backend
+    prepared = prepare_fx(copy.deepcopy(model).eval(), get_default_qconfig_mapping(backend), (example_input,))
+    calibrate(prepared)
+    return convert_fx(prepared)
+
+
+class PostTrainingQuantization:
+    """
+    Post-training quantization of the model for CPU inference. The fp32 model is built (```model``` may be
+    the module or the class, ```weights``` is the weights dump of setka.pipes.Checkpointer, e.g.
+    ```<name>_weights_best.pth.tar```), the following variants are made:
+        'dynamic' -- dynamic int8 quantization of Linear/LSTM/GRU modules;
+        'static' -- static int8 quantization (FX graph mode) calibrated on ```n_calibration``` batches of the
+            ```calibration_subset``` loaded with setka.pipes.DatasetHandler.
+
+    Each variant is validated on the ```subset``` with setka.pipes.ComputeMetrics and benchmarked on a batch of
+    the subset. ```run``` returns the table with the latency (ms per batch), throughput (samples per second),
+    metrics and their deltas with respect to the fp32 model. Variants that failed (e.g. the model is not
+    traceable for the static quantization) have the error in the 'error' column.
+
+    The quantized models (```self.models```) may be used with setka.pipes.ModelHandler or
+    setka.tools.InferenceServer directly, ```export``` saves them with TorchScript.
+
+    Args:
+        model (torch.nn.Module or callable): model or a callable (e.g. class) that returns the model.
+        dataset (setka.base.Dataset): dataset for the calibration and validation.
+        metrics (list of callable): metrics for setka.pipes.ComputeMetrics.
+        weights (str): path to the weights dump.
+        subset (hashable): subset for the validation and the benchmark.
+        calibration_subset (hashable): subset for the calibration of the static quantization.
+        variants (list of str): variants to make ('dynamic', 'static').
+        batch_size (int): batch size.
+        n_calibration (int): number of batches for the calibration.
+        n_iterations (int): number of batches for the validation (None means the whole subset).
+        n_runs (int): number of runs for the latency measurement.
+        backend (str): quantization backend ('fbgemm' for x86, 'qnnpack' for ARM).
+        model_kwargs (dict): arguments of the model class.
+    """
+    def __init__(self, model, dataset, metrics, weights=None, subset='valid', calibration_subset='train',
+                 variants=('dynamic', 'static'), batch_size=32, n_calibration=10, n_iterations=None, n_runs=20,
+                 backend='fbgemm', model_kwargs={}):
+        if not isinstance(model, torch.nn.Module):
+            model = model(**model_kwargs)
+        if weights is not None:
+            load_weights(model, weights)
+
+        self.model = model.to('cpu').eval()
+        self.dataset = dataset
+        self.metrics = metrics
+        self.subset = subset
+        self.calibration_subset = calibration_subset
+        self.variants = variants
+        self.batch_size = batch_size
+        self.n_calibration = n_calibration
+        self.n_iterations = n_iterations
+        self.n_runs = n_runs
+        self.backend = backend
+
+        self.models = {'fp32': self.model}
+        self.results = None
+
+    def make_trainer(self, model, pipes=[]):
+        return Trainer(pipes=[DatasetHandler(self.dataset, batch_size=self.batch_size, shuffle=False,
+                                             limits={}, timeit=False),
+                              ModelHandler(model)] + list(pipes))
+
+    def sample_input(self, subset=None):
+        """
+        Returns the first batch of the subset (the calibration subset by default).
+        """
+        captured = []
+        trainer = self.make_trainer(self.model)
+        trainer.add_pipe(Lambda(after_batch=lambda: captured.append(trainer._input) if len(captured) == 0 else None))
+        trainer.run_epoch('test', self.calibration_subset if subset is None else subset, n_iterations=1)
+        return captured[0]
+
+    def calibrate(self, model):
+        trainer = self.make_trainer(model)
+        trainer.run_epoch('test', self.calibration_subset, n_iterations=self.n_calibration)
+
+    def quantize(self, variant):
+        if variant == 'dynamic':
+            return quantize_dynamic(self.model)
+        if variant == 'static':
+            return quantize_static(self.model, self.calibrate, self.sample_input(), backend=self.backend)
+        raise ValueError('Unknown quantization variant: ' + str(variant))
+
+    def validate(self, model):
+        trainer = self.make_trainer(model, [ComputeMetrics(self.metrics)])
+        trainer.run_epoch('valid', self.subset, n_iterations=self.n_iterations)
+        return dict(trainer._metrics[self.subset])
+
+    def benchmark(self, model, input):
+        with torch.inference_mode():
+            model(input)
+            start = time.perf_counter()
+            for _ in range(self.n_runs):
+                model(input)
+            latency = (time.perf_counter() - start) / self.n_runs
+        return latency
+
+    def run(self):
+        """
+        Makes, validates and benchmarks the variants.
+
+        Returns:
+            pandas.DataFrame with the results.
+        """
+        input = self.sample_input(self.subset)
+        batch_size = CollectionOperator.batch_size(input)
+
+        rows = []
+        reference = None
+        for variant in ['fp32'] + list(self.variants):
+            row = {'variant': variant}
+            try:
+                if variant not in self.models:
+                    self.models[variant] = self.quantize(variant)
+                model = self.models[variant]
+
+                latency = self.benchmark(model, input)
+                row['latency_ms'] = latency * 1000.0
+                row['samples_per_s'] = batch_size / latency
+
+                metrics = self.validate(model)
+                if reference is None:
+                    reference = metrics
+                for name in metrics:
+                    row[name] = metrics[name]
+                    row[name + '_delta'] = metrics[name] - reference[name]
+                row['error'] = None
+            except Exception as e:
+                self.models.pop(variant, None)
+                row['error'] = repr(e)
+            rows.append(row)
+
+        self.results = pandas.DataFrame(rows)
+        return self.results
+
+    def export(self, variant, fname):
+        """
+        Saves the variant with TorchScript (scripting, falls back to tracing on a batch of the subset).
+        """
+        model = self.models[variant]
+        try:
+            scripted = torch.jit.script(model)
+        except Exception:
+            scripted = torch.jit.trace(model, (self.sample_input(),), check_trace=False)
+
+        dirname = os.path.dirname(fname)
+        if dirname != '' and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        torch.jit.save(scripted, fname)
+        return fname
@@ -0,0 +1,160 @@
+import os
+import math
+import time
+import datetime
+import concurrent.futures
+
+import pandas
+
+from setka.pipes.logging.Checkpointer import Checkpointer
+
+
+def run_trial(factory, config, n_epochs, fname, metric, subset):
+    """
+    Trains one trial up to ```n_epochs``` epochs. The trainer is resumed from the dump ```fname``` if it
+    exists, otherwise it is built with ```factory(config)```. After the training the trainer is dumped back.
+
+    Returns:
+        tuple: value of the monitored metric (None if it was not computed) and the time spent.
+    """
+    start_time = time.time()
+    if os.path.exists(fname):
+        trainer = Checkpointer.load_trainer(fname)
+    else:
+        trainer = factory(config)
+
+    trainer.run_train(n_epochs=n_epochs)
+    Checkpointer.save_trainer(trainer, fname)
+
+    value = None
+    if hasattr(trainer, '_metrics') and (subset in trainer._metrics) and (metric in trainer._metrics[subset]):
+        value = trainer._metrics[subset][metric]
+
+    return value, time.time() - start_time
+
+
+class SuccessiveHalving:
+    """
+    Hyperparameter search driver that uses successive halving. All the configs are trained for
+    ```min_epochs``` epochs, then the best ```1 / eta``` fraction of them is promoted to the next rung and trained
+    up to ```min_epochs * eta``` epochs and so on until ```max_epochs``` is reached.
+
+    Trainers are built with ```factory(config)```. The trials are trained in a pool of processes and are
+    resumed between the rungs from the dumps made in the same format as ```setka.pipes.Checkpointer``` does.
+    The dumps are stored in ```<log_dir>/<name>/<search_id>/trial_<index>/checkpoints```, each search gets a
+    new ```search_id``` (the time of its creation), so the dumps of the earlier searches are never mixed in.
+    To resume the interrupted search, pass its ```search_id``` (```self.search_id```): the trials are resumed
+    from its dumps.
+
+    The factory should not include pipes that are costly to initialize and not needed for the search
+    (e.g. Logger). When ```workers``` is positive, the factory and the configs should be picklable.
+
+    Args:
+        factory (callable): function that takes config and returns setka.base.Trainer.
+        configs (list): list of configs to try.
+        metric (str): name of the metric to compare the trials.
+        subset (hashable): name of the subset on which the metric is computed.
+        max_mode (bool): if True, the higher the metric -- the better the trial.
+        min_epochs (int): number of epochs in the first rung.
+        max_epochs (int): number of epochs in the last rung.
+        eta (int): reduction factor of the number of trials between the rungs.
+        workers (int): number of processes to use. If 0, trials are trained in the current process.
+        log_dir (str): path to the directory where the dumps are stored.
+        name (str): name of the search.
+        search_id (str): id of the search to resume (None starts a new search).
+    """
+    def __init__(self, factory, configs, metric, subset='valid', max_mode=False, min_epochs=1, max_epochs=27,
+                 eta=3, workers=0, log_dir='runs', name='search', search_id=None):
+        self.factory = factory
+        self.configs = configs
+        self.metric = metric
+        self.subset = subset
+        self.max_mode = max_mode
+        self.min_epochs = min_epochs
+        self.max_epochs = max_epochs
+        self.eta = eta
+        self.workers = workers
+        if search_id is None:
+            search_id = str(datetime.datetime.now()).replace(' ', '_').replace(':', '-')
+        self.search_id = search_id
+        self.root_dir = os.path.join(log_dir, name, search_id)
+        self.results = None
+
+    def rungs(self):
+        """
+        Returns the list of numbers of epochs for each rung.
+        """
+        res = []
+        n_epochs = self.min_epochs
+        while n_epochs < self.max_epochs:
+            res.append(n_epochs)
+            n_epochs *= self.eta
+        res.append(self.max_epochs)
+        return res
+
+    def trial_path(self, index):
+        checkpoints_dir = os.path.join(self.root_dir, f'trial_{index}', 'checkpoints')
+        if not os.path.exists(checkpoints_dir):
+            os.makedirs(checkpoints_dir)
+        return os.path.join(checkpoints_dir, f'trial_{index}_latest.pth.tar')
+
+    def run_rung(self, trials, n_epochs):
+        args = [(self.factory, self.configs[index], n_epochs, self.trial_path(index), self.metric, self.subset)
+                for index in trials]
+
+        if self.workers == 0:
+            return [run_trial(*arg) for arg in args]
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(run_trial, *arg) for arg in args]
+            return [future.result() for future in futures]
+
+    def sort_key(self, value):
+        if value is None or value != value:
+            return math.inf
+        return -value if self.max_mode else value
+
+    def run(self):
+        """
+        Runs the search.
+
+        Returns:
+            pandas.DataFrame with one row per trial per rung.
+        """
+        rows = []
+        trials = list(range(len(self.configs)))
+        rungs = self.rungs()
+
+        for rung, n_epochs in enumerate(rungs):
+            results = self.run_rung(trials, n_epochs)
+            values = {index: value for index, (value, _) in zip(trials, results)}
+
+            ordered = sorted(trials, key=lambda index: self.sort_key(values[index]))
+            promoted = ordered[:max(1, len(trials) // self.eta)] if rung + 1 < len(rungs) else []
+
+            for index, (value, elapsed) in zip(trials, results):
+                row = {'trial': index, 'rung': rung, 'epochs': n_epochs}
+                if isinstance(self.configs[index], dict):
+                    row.update(self.configs[index])
+                else:
+                    row['config'] = str(self.configs[index])
+                row[self.metric] = value
+                row['time'] = elapsed
+                row['promoted'] = index in promoted
+                rows.append(row)
+
+            trials = sorted(promoted)
+            if len(trials) == 0:
+                break
+
+        self.results = pandas.DataFrame(rows)
+        return self.results
+
+    def best(self):
+        """
+        Returns the config of the best trial of the last rung.
+        """
+        last = self.results[self.results['rung'] == self.results['rung'].max()]
+        index = min(last['trial'], key=lambda trial: self.sort_key(
+            last[last['trial'] == trial][self.metric].iloc[0]))
+        return self.configs[index]
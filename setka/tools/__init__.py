@@ -0,0 +1,3 @@
+from .SuccessiveHalving import SuccessiveHalving
+from .InferenceServer import InferenceServer
+from .Quantization import PostTrainingQuantization, quantize_dynamic, quantize_static
@@ -49,3 +49,37 @@ def test_base():
     print(trainer.view_pipeline())
 
 
+
+
+def test_run_predict():
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.TensorNet()
+
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(ds, batch_size=32, limits=2),
+                                     setka.pipes.ModelHandler(model),
+                                     setka.pipes.LossHandler(loss),
+                                     setka.pipes.OneStepOptimizers(
+                                        [
+                                            setka.base.Optimizer(
+                                                model,
+                                                torch.optim.SGD,
+                                                lr=0.1)
+                                        ]
+                                     )
+                                 ],
+                                 collection_op=setka.base.CollectionOperator(soft_collate_fn=True))
+
+    n_pipes = len(trainer._pipes)
+
+    batches = list(trainer.run_predict('valid', batch_size=64, n_iterations=3))
+    assert(len(batches) == 2)
+    ids, output = batches[0]
+    assert(len(ids) == 64)
+    assert(output.shape == (64, 10))
+    assert(not output.requires_grad)
+
+    collected = []
+    trainer.run_predict('valid', sink=lambda ids, output: collected.append(len(ids)), n_iterations=1)
+    assert(collected == [32])
+    assert(len(trainer._pipes) == n_pipes)
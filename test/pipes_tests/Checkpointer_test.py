@@ -83,3 +83,46 @@ def test_MakeCheckpoints():
 
     assert(latest_trainer._model.state_dict().__str__() == trainer._model.state_dict().__str__())
     assert(latest_weights.__str__() == trainer._model.state_dict().__str__())
+
+
+def test_Checkpointer_sharded_optimizer(tmp_path):
+    import torch.distributed as dist
+    from torch.distributed.optim import ZeroRedundancyOptimizer
+
+    dist.init_process_group('gloo', init_method='file://' + str(tmp_path / 'store'), rank=0, world_size=1)
+    try:
+        ds = test_dataset.CIFAR10()
+        model = tiny_model.TensorNet()
+        optimizer = setka.base.Optimizer(model, torch.optim.Adam, lr=1.0e-3, shard=True)
+        assert(isinstance(optimizer.optimizer, ZeroRedundancyOptimizer))
+
+        checkpointer = setka.pipes.Checkpointer('tensor_acc', max_mode=True, name='sharded',
+                                                log_dir=str(tmp_path / 'runs'))
+        trainer = setka.base.Trainer(pipes=[
+            setka.pipes.DatasetHandler(ds, batch_size=32, limits=2),
+            setka.pipes.ModelHandler(model),
+            setka.pipes.LossHandler(loss),
+            setka.pipes.OneStepOptimizers([optimizer]),
+            setka.pipes.ComputeMetrics([loss, acc]),
+            checkpointer
+        ])
+        trainer.run_train(1)
+
+        # the consolidated state is released once the dump is written
+        assert(optimizer._consolidated_state is None)
+
+        restored = setka.pipes.Checkpointer.load_trainer(checkpointer.trainer_path('latest'))
+        restored_optimizer = [pipe for pipe in restored._pipes
+                              if isinstance(pipe, setka.pipes.OneStepOptimizers)][0].optimizers[0]
+        assert(restored_optimizer.shard)
+        assert(isinstance(restored_optimizer.optimizer, ZeroRedundancyOptimizer))
+
+        optimizer.consolidate_state_dict()
+        restored_optimizer.consolidate_state_dict()
+        state, restored_state = optimizer.state_dict()['state'], restored_optimizer.state_dict()['state']
+        assert(len(state) > 0 and state.keys() == restored_state.keys())
+        for key in state:
+            assert(torch.equal(state[key]['exp_avg'], restored_state[key]['exp_avg']))
+            assert(torch.equal(state[key]['exp_avg_sq'], restored_state[key]['exp_avg_sq']))
+    finally:
+        dist.destroy_process_group()
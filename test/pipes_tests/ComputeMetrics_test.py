@@ -120,3 +120,78 @@ def test_ComputeMetrics3():
 
     trainer.run_train(20)
 
+
+def test_ComputeMetrics_projection():
+    setka.base.environment_setup()
+
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.TensorNet()
+
+    def projected_acc(output, input):
+        assert(input[0] is None)
+        assert(input[2] is None)
+        return (output.argmax(dim=1) == input[1]).float().mean()
+
+    projected_acc.input_paths = [(1,)]
+    projected_acc.output_paths = [()]
+
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(
+                                         ds, batch_size=32, limits=4, shuffle=False),
+                                     setka.pipes.ModelHandler(model),
+                                     setka.pipes.LossHandler(loss),
+                                     setka.pipes.OneStepOptimizers(
+                                        [
+                                            setka.base.Optimizer(
+                                                model,
+                                                torch.optim.SGD,
+                                                lr=0.1,
+                                                momentum=0.9,
+                                                weight_decay=5e-4)
+                                        ]
+                                     ),
+                                     setka.pipes.ComputeMetrics([projected_acc], steps_to_compute=2)
+                                 ])
+
+    trainer.run_train(1)
+
+    assert('projected_acc' in trainer._metrics['valid'])
+
+def test_ComputeMetrics_subsample():
+    setka.base.environment_setup()
+
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.TensorNet()
+
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(
+                                         ds, batch_size=32, limits={'train': 2}, shuffle=False,
+                                         epoch_schedule=[
+                                             {'mode': 'train', 'subset': 'train'},
+                                             {'mode': 'valid', 'subset': 'train', 'subsample': 100},
+                                             {'mode': 'valid', 'subset': 'valid', 'subsample': 0.01}]),
+                                     setka.pipes.ModelHandler(model),
+                                     setka.pipes.LossHandler(loss),
+                                     setka.pipes.OneStepOptimizers(
+                                        [
+                                            setka.base.Optimizer(
+                                                model,
+                                                torch.optim.SGD,
+                                                lr=0.1,
+                                                momentum=0.9,
+                                                weight_decay=5e-4)
+                                        ]
+                                     ),
+                                     setka.pipes.ComputeMetrics([loss, acc], divide_first=[True, False])
+                                 ])
+
+    trainer.run_train(2)
+
+    assert(trainer._metrics_samples['train'] == 100)
+    assert(trainer._metrics_samples['valid'] == 100)
+    assert(trainer._metrics_ci['train']['tensor_loss'] >= 0)
+    assert(numpy.isfinite(trainer._metrics_ci['valid']['tensor_loss']))
+
+    indices = setka.pipes.basic.DatasetHandler.subsample_indices(1000, 0.1, seed=0)
+    assert(len(indices) == 100)
+    assert((indices == setka.pipes.basic.DatasetHandler.subsample_indices(1000, 0.1, seed=0)).all())
@@ -0,0 +1,103 @@
+import setka
+import torch
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),  '..'))
+import tiny_model
+import test_dataset
+
+from test_metrics import tensor_loss as loss
+from test_metrics import tensor_acc as acc
+
+
+def test_EarlyStopping():
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.TensorNet()
+
+    checkpointer = setka.pipes.Checkpointer('tensor_acc', max_mode=True, name='early_stopping')
+
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(ds, batch_size=32, limits=2),
+                                     setka.pipes.ModelHandler(model),
+                                     setka.pipes.LossHandler(loss),
+                                     setka.pipes.OneStepOptimizers(
+                                        [
+                                            setka.base.Optimizer(
+                                                model,
+                                                torch.optim.SGD,
+                                                lr=0.0)
+                                        ]
+                                     ),
+                                     setka.pipes.ComputeMetrics([loss, acc]),
+                                     checkpointer,
+                                     setka.pipes.EarlyStopping(patience=2, checkpointer=checkpointer, restore_best=True)
+                                 ])
+
+    trainer.run_train(20)
+
+    assert(trainer._epoch == 3)
+
+
+def test_EarlyStopping_ci():
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.TensorNet()
+
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(ds, batch_size=32, limits={'train': 2}),
+                                     setka.pipes.ModelHandler(model),
+                                     setka.pipes.LossHandler(loss),
+                                     setka.pipes.OneStepOptimizers(
+                                        [
+                                            setka.base.Optimizer(
+                                                model,
+                                                torch.optim.SGD,
+                                                lr=0.1,
+                                                momentum=0.9)
+                                        ]
+                                     ),
+                                     setka.pipes.ComputeMetrics([loss]),
+                                     setka.pipes.EarlyStopping('tensor_loss', ci_threshold=float('inf'), min_samples=64)
+                                 ])
+
+    trainer.run_train(1)
+
+    assert(trainer._metrics_samples['valid'] == 64)
+
+
+def test_EarlyStopping_ci_non_reduced():
+    pipe = setka.pipes.EarlyStopping('per_class', ci_threshold=0.1)
+    trainer = setka.base.Trainer(pipes=[pipe])
+    trainer._mode, trainer._subset = 'valid', 'valid'
+
+    trainer._avg_metrics_ci = {'per_class': [0.05, 0.2, 0.01]}
+    pipe.after_batch()
+    assert(not getattr(trainer, '_stop_epoch_signal', False))
+
+    trainer._avg_metrics_ci = {'per_class': [0.05, 0.09, 0.01]}
+    pipe.after_batch()
+    assert(trainer._stop_epoch_signal)
+
+
+def test_EarlyStopping_non_reduced_metric():
+    pipe = setka.pipes.EarlyStopping('per_class', max_mode=True, patience=1)
+    trainer = setka.base.Trainer(pipes=[pipe])
+    trainer._mode, trainer._subset, trainer._epoch = 'valid', 'valid', 1
+    trainer._metrics = {'valid': {'per_class': [0.5, 0.7]}}
+
+    try:
+        pipe.after_epoch()
+        assert False, 'the non-reduced metric should require reduce'
+    except ValueError as e:
+        assert('reduce' in str(e))
+
+    pipe.reduce = 'mean'
+    pipe.after_epoch()
+    assert(abs(pipe.best_metric - 0.6) < 1.0e-6)
+
+    # the stop signals of the other pipes are kept
+    trainer._stop_epoch_signal = True
+    trainer._metrics = {'valid': {'per_class': [0.5, 0.6]}}
+    pipe.after_epoch()
+    assert(trainer._stop_epoch_signal)
+    assert(trainer._stop_train_signal)
@@ -0,0 +1,128 @@
+import setka
+import torch
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),  '..'))
+import test_dataset
+
+from test_metrics import tensor_loss as loss
+
+
+class SpatialMean(torch.nn.Module):
+    def forward(self, x):
+        return x.mean(dim=-1).mean(dim=-1)
+
+
+class BackboneNet(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.backbone = torch.nn.Sequential(torch.nn.Conv2d(3, 4, kernel_size=1), SpatialMean())
+        self.head = torch.nn.Linear(4, 10)
+        self.n_backbone_calls = 0
+        self.backbone[0].register_forward_hook(self.count)
+
+    def count(self, module, input, output):
+        self.n_backbone_calls += 1
+
+    def forward(self, input):
+        return self.head(self.backbone(input[0]))
+
+
+class SmallDataset(setka.base.Dataset):
+    def __init__(self):
+        super().__init__()
+        generator = torch.Generator().manual_seed(0)
+        self.data = {subset: torch.randn(40, 3, 8, 8, generator=generator) for subset in ['train', 'valid']}
+        self.n_decoded = 0
+
+    def getitem(self, subset, index):
+        self.n_decoded += 1
+        return self.data[subset][index], index % 10
+
+    def getitem_cached(self, subset, index):
+        return torch.zeros(()), index % 10
+
+    def getlen(self, subset):
+        return 40
+
+
+def make_trainer(ds, model, cache, **kwargs):
+    model.backbone.requires_grad_(False)
+    return setka.base.Trainer(pipes=[
+                                  setka.pipes.DatasetHandler(ds, batch_size=8, shuffle={}, **kwargs),
+                                  setka.pipes.ModelHandler(model),
+                                  setka.pipes.LossHandler(loss),
+                                  setka.pipes.OneStepOptimizers([setka.base.Optimizer(model.head, torch.optim.SGD, lr=0.1)]),
+                                  cache
+                              ])
+
+
+def test_FeatureCache():
+    ds = test_dataset.CIFAR10()
+    model = BackboneNet()
+    cache = setka.pipes.FeatureCache('backbone')
+    trainer = make_trainer(ds, model, cache, limits=2)
+
+    trainer.run_train(1)
+    # train/train and valid/valid batches are computed, valid/train ones are cached
+    assert(model.n_backbone_calls == 4)
+
+    batches = list(trainer.run_predict('valid', n_iterations=1))
+    assert(batches[0][1].shape == (8, 10))
+    assert(model.n_backbone_calls == 4)
+
+    trainer.run_train(2)
+    assert(model.n_backbone_calls == 4)
+    assert(cache.n_invalidations == 0)
+
+    with torch.no_grad():
+        model.backbone[0].weight.add_(1.0)
+    trainer.run_epoch('valid', 'valid', n_iterations=2)
+    assert(model.n_backbone_calls == 6)
+    assert(cache.n_invalidations == 1)
+
+
+def test_FeatureCache_store(tmp_path):
+    ds = SmallDataset()
+    model = BackboneNet()
+    path = str(tmp_path / 'feature_cache')
+    cache = setka.pipes.FeatureCache('backbone', path=path, shard_size=16)
+    trainer = make_trainer(ds, model, cache)
+
+    trainer.run_train(1)
+    assert(not trainer._cached_input)
+    assert(os.path.exists(os.path.join(path, cache.digest, 'index.jsonl')))
+    assert(model.n_backbone_calls == 10)
+
+    # the whole subsets are cached: the decoding is skipped
+    n_decoded = ds.n_decoded
+    trainer.run_train(2)
+    assert(trainer._cached_input)
+    assert(ds.n_decoded == n_decoded)
+    assert(model.n_backbone_calls == 10)
+
+    with torch.no_grad():
+        expected = model.backbone._setka_uncached_forward(ds.data['valid'][:1])
+    assert(torch.allclose(cache.get('valid_0'), expected[0], atol=1e-6))
+
+
+def test_FeatureCache_data_parallel():
+    ds = SmallDataset()
+    model = BackboneNet()
+    model.backbone.requires_grad_(False)
+    cache = setka.pipes.FeatureCache('backbone')
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(ds, batch_size=8, shuffle={}),
+                                     setka.pipes.ModelHandler(model, data_parallel=True),
+                                     setka.pipes.LossHandler(loss),
+                                     cache
+                                 ])
+
+    # the name is resolved without the 'module.' prefix of the wrapper
+    assert(isinstance(trainer._model, torch.nn.DataParallel))
+    assert(cache.submodule() is model.backbone)
+
+    trainer.run_epoch('valid', 'valid')
+    trainer.run_epoch('valid', 'valid')
+    assert(cache.n_hits == 40 and cache.n_misses == 0)
@@ -0,0 +1,40 @@
+import setka
+import torch
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),  '..'))
+import tiny_model
+import test_dataset
+
+from test_metrics import tensor_loss as loss
+
+
+def test_LRFinder():
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.TensorNet()
+
+    finder = setka.pipes.LRFinder(start_lr=1.0e-5, end_lr=1.0, n_iterations=10, apply=True)
+    optimizer = setka.base.Optimizer(model, torch.optim.SGD, lr=0.1, momentum=0.9)
+
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(ds, batch_size=32, limits={'train': 20}),
+                                     setka.pipes.ModelHandler(model),
+                                     setka.pipes.LossHandler(loss),
+                                     setka.pipes.OneStepOptimizers([optimizer]),
+                                     finder
+                                 ])
+
+    state = {key: value.clone() for key, value in model.state_dict().items()}
+    results = finder.find()
+
+    assert(len(results) > 0)
+    assert(list(results.columns) == ['lr', 'loss', 'smoothed_loss'])
+    assert(trainer._epoch == 0 and trainer._iteration == 0)
+    for key in state:
+        assert(torch.equal(state[key], model.state_dict()[key]))
+
+    if finder.suggested_lr is not None:
+        assert(optimizer.optimizer.param_groups[0]['lr'] == finder.suggested_lr)
+
+    trainer.run_train(1)
@@ -0,0 +1,89 @@
+import setka
+import torch
+
+import os
+import warnings
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),  '..'))
+import tiny_model
+import test_dataset
+
+from test_metrics import tensor_loss as loss
+
+
+def l2_loss(output, input):
+    return (output ** 2).mean()
+
+
+def test_LossHandler_log_freq():
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.TensorNet()
+
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(ds, batch_size=32, limits={'train': 3}),
+                                     setka.pipes.ModelHandler(model),
+                                     setka.pipes.LossHandler([loss, l2_loss], coefs=[1.0, 0.1], log_freq=2),
+                                     setka.pipes.OneStepOptimizers([setka.base.Optimizer(model, torch.optim.SGD, lr=0.1)])
+                                 ])
+
+    trainer.run_epoch('train', 'train')
+
+    # flushed after the second iteration and after the end of the epoch
+    assert(trainer._loss_values_step == 3)
+    assert(isinstance(trainer.status['Loss'], float))
+    assert(not hasattr(trainer, '_loss_values'))
+
+
+def test_LossHandler_weighting():
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.TensorNet()
+    uncertainty = setka.pipes.UncertaintyWeighting(2)
+    dwa = setka.pipes.DynamicWeightAverage(2)
+
+    for weighting in [uncertainty, dwa]:
+        optimizers = [setka.base.Optimizer(model, torch.optim.SGD, lr=0.1)]
+        if weighting is uncertainty:
+            optimizers.append(setka.base.Optimizer(weighting, torch.optim.SGD, lr=0.1))
+
+        trainer = setka.base.Trainer(pipes=[
+                                         setka.pipes.DatasetHandler(ds, batch_size=32, limits=2),
+                                         setka.pipes.ModelHandler(model),
+                                         setka.pipes.LossHandler([loss, l2_loss], weighting=weighting),
+                                         setka.pipes.OneStepOptimizers(optimizers)
+                                     ])
+
+        trainer.run_train(3)
+
+    assert((uncertainty.log_vars != 0).any())
+    assert(dwa.n_epochs == 3)
+    assert(torch.allclose(dwa.weights().sum(), torch.tensor(2.0)))
+
+
+def float_loss(output, input):
+    # returns the python number, so it can not be traced
+    return 1.0
+
+
+def test_LossHandler_compile():
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.TensorNet()
+    handler = setka.pipes.LossHandler([loss, l2_loss, float_loss], compile='trace')
+
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(ds, batch_size=32, limits={'train': 3}),
+                                     setka.pipes.ModelHandler(model),
+                                     handler,
+                                     setka.pipes.OneStepOptimizers([setka.base.Optimizer(model, torch.optim.SGD, lr=0.1)])
+                                 ])
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        trainer.run_epoch('train', 'train')
+
+    # one variant per criterion, the untraceable one falls back to the eager criterion
+    assert(len(handler.compiled) == 3)
+    compiled = [handler.compiled[key] for key in sorted(handler.compiled, key=lambda key: key[0])]
+    assert(compiled[0] is not loss and compiled[1] is not l2_loss and compiled[2] is float_loss)
+    assert(any('eager criterion is used' in str(warning.message) for warning in caught))
+    assert('Error' in trainer.status['Loss compile'])
+    assert(trainer._loss_compile_time > 0)
@@ -0,0 +1,87 @@
+import setka
+import torch
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),  '..'))
+import tiny_model
+import test_dataset
+
+from test_metrics import tensor_loss as loss
+from test_metrics import tensor_acc as acc
+
+
+class LimitedNet(tiny_model.TensorNet):
+    """
+    Fails with the out-of-memory error for the batches larger than the limit.
+    """
+    def __init__(self, limit):
+        super().__init__()
+        self.limit = limit
+
+    def __call__(self, input):
+        if len(input[0]) > self.limit:
+            raise RuntimeError('CUDA out of memory. Tried to allocate 2.00 GiB')
+        return super().__call__(input)
+
+
+def test_MemoryGuard():
+    ds = test_dataset.CIFAR10()
+    model = LimitedNet(limit=10)
+    guard = setka.pipes.MemoryGuard()
+
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(ds, batch_size=32, limits=2),
+                                     setka.pipes.ModelHandler(model),
+                                     setka.pipes.LossHandler(loss),
+                                     setka.pipes.ComputeMetrics([loss, acc]),
+                                     setka.pipes.OneStepOptimizers([setka.base.Optimizer(model, torch.optim.SGD, lr=0.1)]),
+                                     guard
+                                 ])
+    trainer.run_train(1)
+
+    # 32 -> 16 -> 8
+    assert(guard.micro_batch == 8)
+    assert(len(guard.events) == 2)
+    assert(trainer._memory_stats['train']['OOM retries'] == 2)
+    assert(trainer._memory_stats['valid']['OOM retries'] == 0)
+    assert('on_batch RSS MB' in trainer._memory_stats['train'])
+
+    # the guard is active during the training epochs only
+    assert(not hasattr(trainer, '_stage_guard'))
+    guards = []
+    probe = setka.pipes.Lambda(before_batch=lambda: guards.append(hasattr(trainer, '_stage_guard')))
+    probe.inference = True
+    trainer.add_pipe(probe)
+    next(iter(trainer.run_predict('valid', n_iterations=1)))
+    assert(guards == [False])
+
+
+def test_MemoryGuard_accumulation():
+    ds = test_dataset.CIFAR10()
+    op = setka.base.CollectionOperator()
+    batch = op.collate_fn([ds['train', index] for index in range(32)])
+
+    grads, losses = [], []
+    for limit in [32, 10]:
+        model = LimitedNet(limit=limit)
+        torch.manual_seed(0)
+        model.fc.reset_parameters()
+        trainer = setka.base.Trainer(pipes=[
+                                         setka.pipes.ModelHandler(model),
+                                         setka.pipes.LossHandler(loss),
+                                         setka.pipes.MemoryGuard()
+                                     ])
+        trainer._mode, trainer._epoch_iteration = 'train', 1
+        trainer._input, trainer._ids = batch, list(range(32))
+        trainer._traverse_pipes('before_epoch')
+        trainer._stage_guard('on_batch', lambda: trainer._traverse_pipes('on_batch'))
+
+        assert(trainer._output.shape == (32, 10))
+        grads.append(model.fc.weight.grad.clone())
+        # the micro-batches are counted as one batch
+        losses.append(trainer._loss_value)
+        assert(trainer._loss_values_step == 0)
+
+    assert(torch.allclose(grads[0], grads[1], atol=1e-6))
+    assert(abs(losses[0] - losses[1]) < 1e-5)
@@ -0,0 +1,155 @@
+import setka
+import torch
+import pytest
+
+import os
+import sys
+import warnings
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),  '..'))
+import tiny_model
+import test_dataset
+
+from test_metrics import tensor_loss as loss
+
+
+def test_ModelHandler_checkpointing():
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.TensorNet()
+
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(ds, batch_size=32, limits=2),
+                                     setka.pipes.ModelHandler(model, checkpoint_types=torch.nn.Linear),
+                                     setka.pipes.LossHandler(loss),
+                                     setka.pipes.OneStepOptimizers([setka.base.Optimizer(model, torch.optim.SGD, lr=0.1)])
+                                 ])
+
+    x = torch.randn(4, 3, 8, 8)
+    y = torch.tensor([0, 1, 2, 3])
+
+    grads = []
+    for flag in [False, True]:
+        model.fc._setka_checkpoint = flag
+        model.zero_grad()
+        loss(model([x]), [x, y]).backward()
+        grads.append(model.fc.weight.grad.clone())
+    model.fc._setka_checkpoint = False
+
+    assert(torch.allclose(grads[0], grads[1]))
+
+    trainer.run_train(1)
+
+    assert(trainer._model_stats['train']['Checkpointed'] == 1)
+    assert(trainer._model_stats['valid']['Checkpointed'] == 0)
+    assert(trainer._model_stats['train']['Samples/s'] > 0)
+    assert(not model.fc._setka_checkpoint)
+
+
+class First(torch.nn.Module):
+    def forward(self, input):
+        return input[0]
+
+
+class SpatialMean(torch.nn.Module):
+    def forward(self, x):
+        return x.mean(dim=-1).mean(dim=-1)
+
+
+def sequential_model():
+    return torch.nn.Sequential(First(), SpatialMean(), torch.nn.Linear(3, 16), torch.nn.ReLU(), torch.nn.Linear(16, 10))
+
+
+def test_ModelHandler_compile():
+    ds = test_dataset.CIFAR10()
+    model = sequential_model()
+    handler = setka.pipes.ModelHandler(model, compile='trace')
+
+    n_compiles = []
+    compile_model = handler.compile_model
+    def counted_compile_model(*args):
+        n_compiles.append(1)
+        return compile_model(*args)
+    handler.compile_model = counted_compile_model
+
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(ds, batch_size=32, limits=2),
+                                     handler,
+                                     setka.pipes.LossHandler(loss),
+                                     setka.pipes.OneStepOptimizers([setka.base.Optimizer(model, torch.optim.SGD, lr=0.1)])
+                                 ])
+
+    trainer.run_train(2)
+
+    # one variant for training and one for evaluation, no recompilation in the second epoch
+    assert(len(handler.compiled) == 2)
+    assert(len(n_compiles) == 2)
+    assert(all(compiled is not model for compiled in handler.compiled.values()))
+    assert(trainer.status['Compile']['Variants'] == 2)
+    assert('Error' not in trainer.status['Compile'])
+
+
+@pytest.mark.skipif(not hasattr(torch, 'compile'), reason='torch.compile is not available')
+def test_ModelHandler_torch_compile():
+    ds = test_dataset.CIFAR10()
+    model = sequential_model()
+    handler = setka.pipes.ModelHandler(model, compile=True)
+
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(ds, batch_size=32, limits=2),
+                                     handler,
+                                     setka.pipes.LossHandler(loss, compile=True),
+                                 ])
+
+    ids, output = next(iter(trainer.run_predict('test')))
+    assert(len(handler.compiled) == 1)
+    assert(all(compiled is not model for compiled in handler.compiled.values()))
+
+    input = setka.base.CollectionOperator().collate_fn([ds['test', int(id.split('_')[-1])] for id in ids])
+    with torch.no_grad():
+        assert(torch.allclose(output, model(input), atol=1e-5))
+
+    trainer.run_epoch('valid', 'valid', n_iterations=2)
+    assert(trainer.status['Loss compile']['Variants'] >= 1)
+    assert(trainer._model_stats['valid']['Samples/s'] > 0)
+
+
+def test_ModelHandler_compile_fallback():
+    ds = test_dataset.CIFAR10()
+    # TensorNet overrides __call__ instead of forward, so it can not be traced
+    model = tiny_model.TensorNet()
+    handler = setka.pipes.ModelHandler(model, compile='trace')
+
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(ds, batch_size=32, limits=2),
+                                     handler,
+                                     setka.pipes.LossHandler(loss)
+                                 ])
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        trainer.run_epoch('valid', 'valid')
+
+    assert(any('eager model is used' in str(warning.message) for warning in caught))
+    assert(handler.compiled[list(handler.compiled)[0]] is model)
+    assert('Error' in trainer.status['Compile'])
+
+
+def test_ModelHandler_pipeline():
+    ds = test_dataset.CIFAR10()
+    model = sequential_model()
+    handler = setka.pipes.ModelHandler(model, pipeline_stages=[2, '4'], pipeline_devices=['cpu'] * 3, micro_batches=3)
+
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(ds, batch_size=32, limits=2),
+                                     handler,
+                                     setka.pipes.LossHandler(loss),
+                                     setka.pipes.OneStepOptimizers([setka.base.Optimizer(model, torch.optim.SGD, lr=0.1)])
+                                 ])
+    trainer.run_train(1)
+
+    stages = handler.pipelines[id(model)]
+    assert([len(stage) for stage in stages] == [2, 2, 1])
+
+    ids, output = next(iter(trainer.run_predict('test')))
+    input = setka.base.CollectionOperator().collate_fn([ds['test', int(id.split('_')[-1])] for id in ids])
+    with torch.no_grad():
+        assert(torch.allclose(output, model(input), atol=1e-6))
@@ -0,0 +1,270 @@
+import setka
+import torch
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),  '..'))
+import tiny_model
+import test_dataset
+
+from test_metrics import tensor_loss as loss
+from test_metrics import tensor_acc as acc
+
+
+def test_OneStepOptimizers():
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.TensorNet()
+    weights = [par.detach().clone() for par in model.parameters()]
+
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(ds, batch_size=32, limits=2),
+                                     setka.pipes.ModelHandler(model),
+                                     setka.pipes.LossHandler(loss),
+                                     setka.pipes.OneStepOptimizers(
+                                        [
+                                            setka.base.Optimizer(
+                                                model,
+                                                torch.optim.SGD,
+                                                lr=0.1,
+                                                momentum=0.9)
+                                        ]
+                                     ),
+                                     setka.pipes.ComputeMetrics([loss, acc])
+                                 ])
+
+    trainer.run_train(2)
+
+    assert(not model.training)
+    assert(any((par != weight).any() for par, weight in zip(model.parameters(), weights)))
+
+
+def test_OneStepOptimizers_flat_buffers():
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.TensorNet()
+
+    optimizer = setka.base.Optimizer(model, torch.optim.Adam, lr=1.0e-3, flat_buffers=True)
+    flat_param = optimizer.optimizer.param_groups[0]['params'][0]
+    weights = flat_param.detach().clone()
+
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(ds, batch_size=32, limits=2),
+                                     setka.pipes.ModelHandler(model),
+                                     setka.pipes.LossHandler(loss),
+                                     setka.pipes.OneStepOptimizers([optimizer]),
+                                     setka.pipes.ComputeMetrics([loss, acc])
+                                 ])
+
+    trainer.run_train(2)
+
+    assert((flat_param != weights).any())
+    for par in model.parameters():
+        assert(par.data_ptr() >= flat_param.data_ptr())
+        assert(par.data_ptr() < flat_param.data_ptr() + flat_param.numel() * flat_param.element_size())
+
+
+def test_OneStepOptimizers_step_policy():
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.TensorNet()
+
+    steps = []
+    every_2 = setka.base.EveryN(2)
+
+    def policy(trainer):
+        if every_2(trainer):
+            steps.append(trainer._iteration)
+            return True
+        return False
+
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(ds, batch_size=32, limits=2),
+                                     setka.pipes.ModelHandler(model),
+                                     setka.pipes.LossHandler(loss),
+                                     setka.pipes.OneStepOptimizers(
+                                        [
+                                            setka.base.Optimizer(
+                                                model,
+                                                torch.optim.SGD,
+                                                lr=0.1,
+                                                step_policy=policy)
+                                        ]
+                                     ),
+                                     setka.pipes.ComputeMetrics([loss, acc])
+                                 ])
+
+    trainer.run_train(2)
+
+    assert(steps == [1, 3])
+    assert(all(par.requires_grad for par in model.parameters()))
+
+
+def test_Alternating():
+    class FakeTrainer:
+        pass
+
+    trainer = FakeTrainer()
+    first = setka.base.Alternating(0, n_groups=2, period=2)
+    second = setka.base.Alternating(1, n_groups=2, period=2)
+
+    res = []
+    for iteration in range(1, 9):
+        trainer._iteration = iteration
+        res.append((first(trainer), second(trainer)))
+
+    assert([r[0] for r in res] == [True, True, False, False, True, True, False, False])
+    assert(all(r[0] != r[1] for r in res))
+
+
+def test_OneStepOptimizers_grad_stats():
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.TensorNet()
+
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(ds, batch_size=32, limits=2),
+                                     setka.pipes.ModelHandler(model),
+                                     setka.pipes.LossHandler(loss),
+                                     setka.pipes.OneStepOptimizers(
+                                        [
+                                            setka.base.Optimizer(
+                                                model,
+                                                torch.optim.SGD,
+                                                lr=0.1,
+                                                clip_grad_norm=1.0e-3,
+                                                clip_grad_value=1.0)
+                                        ],
+                                        grad_stats_freq=2
+                                     ),
+                                     setka.pipes.ComputeMetrics([loss, acc])
+                                 ])
+
+    trainer.run_train(1)
+
+    assert(trainer._grad_stats_iteration == 2)
+    assert('norm/0' in trainer._grad_stats)
+    assert('norm/0/fc' in trainer._grad_stats)
+    assert('Norm 0' in trainer.status['Grad'])
+
+
+def nan_loss(output, input):
+    return loss(output, input) * float('nan')
+
+
+def test_OneStepOptimizers_skip_nonfinite():
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.TensorNet()
+    weights = [par.detach().clone() for par in model.parameters()]
+
+    pipe = setka.pipes.OneStepOptimizers([setka.base.Optimizer(model, torch.optim.SGD, lr=0.1)],
+                                         skip_nonfinite=True)
+
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(ds, batch_size=32, limits=2),
+                                     setka.pipes.ModelHandler(model),
+                                     setka.pipes.LossHandler(nan_loss),
+                                     pipe
+                                 ])
+
+    trainer.run_train(1)
+
+    assert(pipe.n_skipped == [2])
+    assert(all((par == weight).all() for par, weight in zip(model.parameters(), weights)))
+
+
+def test_OneStepOptimizers_offload():
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.TensorNet()
+    offloaded_model = tiny_model.TensorNet()
+    offloaded_model.load_state_dict(model.state_dict())
+
+    for cur_model, offload in [(model, False), (offloaded_model, True)]:
+        setka.base.environment_setup()
+        trainer = setka.base.Trainer(pipes=[
+                                         setka.pipes.DatasetHandler(ds, batch_size=32, limits=2, shuffle=False),
+                                         setka.pipes.ModelHandler(cur_model),
+                                         setka.pipes.LossHandler(loss),
+                                         setka.pipes.OneStepOptimizers(
+                                            [
+                                                setka.base.Optimizer(
+                                                    cur_model,
+                                                    torch.optim.Adam,
+                                                    lr=1.0e-2,
+                                                    offload=offload)
+                                            ]
+                                         )
+                                     ])
+        trainer.run_train(2)
+
+    for par, offloaded_par in zip(model.parameters(), offloaded_model.parameters()):
+        assert(torch.allclose(par, offloaded_par))
+
+
+def test_OneStepOptimizers_closed_form_schedule():
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.TensorNet()
+
+    scheduler = setka.base.Scheduler('cosine', warmup_steps=1, min_factor=0.1)
+    optimizer = setka.base.Optimizer(model, torch.optim.SGD, lr=0.1, iter_schedulers=[scheduler])
+
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(ds, batch_size=32, limits=2),
+                                     setka.pipes.ModelHandler(model),
+                                     setka.pipes.LossHandler(loss),
+                                     setka.pipes.OneStepOptimizers([optimizer])
+                                 ])
+
+    trainer.run_train(2)
+
+    assert(abs(optimizer.optimizer.param_groups[0]['lr'] - 0.1 * scheduler.factor(3, 4)) < 1.0e-12)
+
+    assert(scheduler.factor(0, 4) == 1.0)
+    assert(abs(scheduler.factor(4, 4) - 0.1) < 1.0e-12)
+
+    one_cycle = setka.base.Scheduler('one_cycle', pct_start=0.25, div_factor=10.0)
+    assert(abs(one_cycle.factor(0, 100) - 0.1) < 1.0e-12)
+    assert(abs(one_cycle.factor(25, 100) - 1.0) < 1.0e-12)
+    assert(abs(one_cycle.factor(100, 100)) < 1.0e-12)
+
+
+def test_OneStepOptimizers_closed_form_schedule_no_horizon():
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.TensorNet()
+
+    optimizer = setka.base.Optimizer(model, torch.optim.SGD, lr=0.1, iter_schedulers=[setka.base.Scheduler('cosine')])
+
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(ds, batch_size=32, limits=2),
+                                     setka.pipes.ModelHandler(model),
+                                     setka.pipes.LossHandler(loss),
+                                     setka.pipes.OneStepOptimizers([optimizer])
+                                 ])
+
+    try:
+        trainer.run_epoch('train', 'train', n_iterations=2)
+        assert False, 'the schedule without total_steps should fail outside of run_train'
+    except ValueError as e:
+        assert('total_steps' in str(e))
+
+
+def test_OneStepOptimizers_closed_form_horizon():
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.TensorNet()
+
+    default = setka.base.Scheduler('cosine')
+    explicit = setka.base.Scheduler('linear', total_steps=10)
+    optimizer = setka.base.Optimizer(model, torch.optim.SGD, lr=0.1, iter_schedulers=[default],
+                                     epoch_schedulers=[explicit])
+
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(ds, batch_size=32, limits=2),
+                                     setka.pipes.ModelHandler(model),
+                                     setka.pipes.LossHandler(loss),
+                                     setka.pipes.OneStepOptimizers([optimizer])
+                                 ])
+
+    trainer.run_train(2)
+    assert(default.horizon(trainer) == 4)
+    assert(explicit.horizon(trainer) == 10)
+
+    # the horizon is kept when the training is extended
+    trainer.run_train(4)
+    assert(default.horizon(trainer) == 4)
+    assert(explicit.horizon(trainer) == 10)
@@ -83,3 +83,57 @@ def test_SaveResult_tensor():
 
     trainer.run_train(1)
     trainer.run_epoch('test', 'test', n_iterations=2)
+
+
+def test_SaveResult_store():
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.DictNet()
+
+    saver = setka.pipes.SaveResult(format='store', shard_size=48, name='store_experiment')
+    trainer = setka.base.Trainer(pipes=[
+        setka.pipes.DatasetHandler(ds, batch_size=32, limits=2),
+        setka.pipes.ModelHandler(model),
+        saver
+    ])
+
+    outputs = {}
+    for ids, output in trainer.run_predict('test'):
+        for index, id in enumerate(ids):
+            outputs[id] = output['res'][index].clone()
+
+    reader = setka.base.PredictionStore(saver.root_dir)
+    assert(len(reader) == 64)
+    for id in outputs:
+        assert(torch.allclose(reader[id]['res'], outputs[id]))
+
+    saver.store.write(['extra'], {'res': torch.zeros(1, 10)})
+    assert('extra' in reader)
+    assert((reader['extra']['res'] == 0).all())
+
+
+def test_SaveResult_batch_f():
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.TensorNet()
+
+    def batch_f(inputs, outputs, ids):
+        labels = outputs.argmax(dim=1)
+        return {id: label for id, label in zip(ids, labels)}
+
+    def f(one_input, one_output):
+        return one_output.argmax(dim=0)
+
+    per_sample = setka.base.PerSample(f)
+    x = torch.randn(4, 10)
+    ids = ['a', 'b', 'c', 'd']
+    assert(per_sample([x], x, ids) == batch_f([x], x, ids))
+
+    saver = setka.pipes.SaveResult(batch_f=batch_f, format='store', name='batch_f_experiment')
+    trainer = setka.base.Trainer(pipes=[
+        setka.pipes.DatasetHandler(ds, batch_size=32, limits=2),
+        setka.pipes.ModelHandler(model),
+        saver
+    ])
+
+    trainer.run_predict('test', sink=lambda ids, output: None)
+
+    assert(len(saver.store) == 64)
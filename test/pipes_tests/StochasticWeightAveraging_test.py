@@ -0,0 +1,55 @@
+import setka
+import torch
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),  '..'))
+import tiny_model
+import test_dataset
+
+from test_metrics import tensor_loss as loss
+from test_metrics import tensor_acc as acc
+
+
+def test_StochasticWeightAveraging():
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.BatchNormNet()
+
+    averaging = setka.pipes.StochasticWeightAveraging(epoch_start=1, bn_batches=2, offload=True)
+
+    trainer = setka.base.Trainer(
+        pipes=[
+             setka.pipes.DatasetHandler(ds, batch_size=32, limits=3),
+             setka.pipes.ModelHandler(model),
+             setka.pipes.LossHandler(loss),
+             setka.pipes.OneStepOptimizers([
+                setka.base.Optimizer(
+                model,
+                torch.optim.SGD,
+                lr=0.1,
+                momentum=0.9)]),
+             setka.pipes.ComputeMetrics([loss, acc]),
+             averaging
+        ])
+
+    trainer.run_train(3)
+
+    assert(averaging.n_averaged == 3)
+    assert(averaging.bn_updated)
+    assert(trainer._model is model)
+    assert(averaging.averaged_model.bn.num_batches_tracked.item() == 2)
+    assert(not torch.equal(averaging.averaged_model.fc.weight, model.fc.weight.cpu()))
+
+
+def test_StochasticWeightAveraging_no_dataset_handler():
+    model = tiny_model.BatchNormNet()
+    averaging = setka.pipes.StochasticWeightAveraging(epoch_start=0)
+
+    trainer = setka.base.Trainer(pipes=[setka.pipes.ModelHandler(model), averaging])
+    averaging.update()
+
+    try:
+        averaging.update_bn()
+        assert False, 'update_bn should fail without DatasetHandler'
+    except RuntimeError as e:
+        assert 'DatasetHandler' in str(e)
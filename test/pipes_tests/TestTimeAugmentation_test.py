@@ -0,0 +1,76 @@
+import setka
+import torch
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),  '..'))
+import tiny_model
+import test_dataset
+
+from test_metrics import tensor_acc as acc
+from setka.pipes.basic.TestTimeAugmentation import Flip, Zoom
+
+
+def test_TestTimeAugmentation():
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.TensorNet()
+
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(ds, batch_size=32, limits=2),
+                                     setka.pipes.ModelHandler(model),
+                                     setka.pipes.TestTimeAugmentation([Flip(), Zoom(1.25), Zoom(0.8)], chunk_size=48),
+                                     setka.pipes.ComputeMetrics([acc])
+                                 ])
+
+    ids, output = next(iter(trainer.run_predict('test')))
+    assert(output.shape == (32, 10))
+
+    input = setka.base.CollectionOperator().collate_fn([ds['test', int(id.split('_')[-1])][0] for id in ids])
+    with torch.no_grad():
+        expected = torch.stack([model([input]), model([Flip()(input)]),
+                                model([Zoom(1.25)(input)]), model([Zoom(0.8)(input)])]).mean(dim=0)
+    assert(torch.allclose(output, expected, atol=1e-5))
+
+    # the augmentation is not applied in the other modes
+    trainer.run_epoch('valid', 'valid', n_iterations=2)
+    assert(trainer._metrics['valid']['tensor_acc'] >= 0)
+
+
+def test_TestTimeAugmentation_invert():
+    op = setka.base.CollectionOperator()
+    tta = setka.pipes.TestTimeAugmentation([Flip(dense=True), (Flip(dims=(-2,)), lambda x: x.flip(-2))],
+                                           reduce='max')
+    trainer = setka.base.Trainer(pipes=[tta])
+    trainer._mode = 'test'
+
+    x = torch.randn(4, 3, 8, 8)
+    trainer._input = [x, torch.arange(4)]
+    tta.before_batch()
+    assert(trainer._input[0].shape == (12, 3, 8, 8))
+    assert(trainer._input[1].tolist() == list(range(4)) * 3)
+
+    # the identity model: inverted outputs of all the variants coincide
+    trainer._output = {'map': trainer._input[0] * 2.0}
+    tta.on_batch()
+    assert(torch.allclose(trainer._output['map'], x * 2.0))
+    assert(trainer._input[0] is x)
+
+    chunks = op.chunk([x, torch.arange(4)], 3)
+    assert(len(chunks) == 2 and chunks[1][0].shape == (1, 3, 8, 8))
+    assert(torch.equal(op.concat(chunks)[0], x))
+
+
+def test_TestTimeAugmentation_float_target():
+    x = torch.randn(4, 3, 8, 8)
+    target = torch.arange(4, dtype=torch.float32)
+
+    for paths in [None, [0]]:
+        tta = setka.pipes.TestTimeAugmentation([Flip(), Zoom(0.5)], paths=paths)
+        trainer = setka.base.Trainer(pipes=[tta])
+        trainer._mode = 'test'
+
+        trainer._input = [x, target]
+        tta.before_batch()
+        assert(torch.equal(trainer._input[0][4:8], x.flip(-1)))
+        # the float target is neither flipped nor zoomed
+        assert(trainer._input[1].tolist() == target.tolist() * 3)
@@ -0,0 +1,88 @@
+import setka
+import torch
+import pytest
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),  '..'))
+import tiny_model
+import test_dataset
+
+from test_metrics import tensor_loss as loss
+
+
+def test_UseCuda_cpu():
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.TensorNet()
+
+    n_moves = []
+    to = model.to
+    def counted_to(*args, **kwargs):
+        n_moves.append(kwargs)
+        return to(*args, **kwargs)
+    model.to = counted_to
+
+    pipe = setka.pipes.UseCuda('cpu', channels_last=True)
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(ds, batch_size=32, limits=2),
+                                     setka.pipes.ModelHandler(model),
+                                     pipe,
+                                     setka.pipes.LossHandler(loss),
+                                     setka.pipes.OneStepOptimizers([setka.base.Optimizer(model, torch.optim.SGD, lr=0.1)])
+                                 ])
+    trainer.run_train(2)
+
+    # the model is placed (and converted to channels_last) once
+    assert(len(n_moves) == 2)
+
+    x = torch.randn(4, 3, 8, 8)
+    y = torch.tensor([0, 1, 2, 3])
+    pipe.dtype = torch.float64
+    res = pipe.transfer({'x': x, 'rest': [y, 'name']})
+
+    assert(res['x'].dtype == torch.float64)
+    assert(res['x'].is_contiguous(memory_format=torch.channels_last))
+    assert(torch.allclose(res['x'].float(), x))
+    assert(res['rest'][0] is y)
+    assert(res['rest'][1] == 'name')
+
+
+def check_pinned_buffer(device):
+    pipe = setka.pipes.UseCuda(device)
+    setka.base.Trainer(pipes=[pipe])
+
+    batches = [{'x': torch.randn(4, 3, 8, 8), 'rest': [torch.arange(4), torch.randn(5)],
+                'pinned': torch.randn(6).pin_memory()} for _ in range(2)]
+
+    moved = []
+    pointers = []
+    for batch in batches:
+        moved.append(pipe.transfer(batch))
+        buffer, event = pipe.buffers[torch.float32]
+        assert(event is not None)
+        pointers.append(buffer.data_ptr())
+    torch.cuda.synchronize()
+
+    # the second batch reuses the pinned buffer of the first one, the values of both survive
+    assert(pointers[0] == pointers[1])
+    for batch, res in zip(batches, moved):
+        assert(res['x'].device == torch.device(device))
+        assert(res['x'].shape == batch['x'].shape)
+        assert(torch.equal(res['x'].cpu(), batch['x']))
+        assert(torch.equal(res['rest'][0].cpu(), batch['rest'][0]))
+        assert(torch.equal(res['rest'][1].cpu(), batch['rest'][1]))
+        assert(torch.equal(res['pinned'].cpu(), batch['pinned']))
+
+    # the pinned tensors are not staged
+    assert(pipe.buffers[torch.float32][0].numel() == 4 * 3 * 8 * 8 + 5)
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason='CUDA is not available')
+def test_UseCuda_pinned_buffer():
+    check_pinned_buffer('cuda:0')
+
+
+@pytest.mark.skipif(torch.cuda.device_count() < 2, reason='Two CUDA devices are needed')
+def test_UseCuda_pinned_buffer_non_default_device():
+    # the copies go to the stream of cuda:1, while cuda:0 stays the current device
+    check_pinned_buffer('cuda:1')
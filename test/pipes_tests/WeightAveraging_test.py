@@ -42,4 +42,35 @@ def test_WeightAveraging():
                  interval=1)
         ])
 
-    trainer.run_train(3)
\ No newline at end of file
+    trainer.run_train(3)
+
+
+def test_WeightAveraging_moves():
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.TensorNet()
+    initial = [par.detach().clone() for par in model.parameters()]
+
+    averaging = setka.pipes.WeightAveraging(gamma=0.5, epoch_start=0, interval=2, warmup=True, offload=True)
+
+    trainer = setka.base.Trainer(
+        pipes=[
+             setka.pipes.DatasetHandler(ds, batch_size=32, limits=4),
+             setka.pipes.ModelHandler(model),
+             setka.pipes.LossHandler(loss),
+             setka.pipes.OneStepOptimizers([
+                setka.base.Optimizer(
+                model,
+                torch.optim.SGD,
+                lr=0.1,
+                momentum=0.9)]),
+             averaging
+        ])
+
+    trainer.run_train(2)
+
+    assert(averaging.n_updates == 4)
+    assert(trainer._model is model)
+    for avg_par, trn_par, init_par in zip(averaging.averaged_model.parameters(), model.parameters(), initial):
+        assert(avg_par.device == torch.device('cpu'))
+        assert(not torch.equal(avg_par, init_par))
+        assert(not torch.equal(avg_par, trn_par.cpu()))
@@ -42,4 +42,14 @@ class DictNet(torch.nn.Module):
 
     def __call__(self, input):
         x = self.net(input)
-        return {'res': x}
\ No newline at end of file
+        return {'res': x}
+
+class BatchNormNet(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.bn = torch.nn.BatchNorm1d(3)
+        self.fc = torch.nn.Linear(3, 10)
+
+    def __call__(self, input):
+        x = input[0].mean(dim=-1).mean(dim=-1)
+        return self.fc(self.bn(x))
@@ -0,0 +1,60 @@
+import setka
+import torch
+import json
+import asyncio
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),  '..'))
+import tiny_model
+
+
+def test_InferenceServer_batching():
+    model = tiny_model.TensorNet()
+    server = setka.tools.InferenceServer(model, max_batch_size=4, max_latency=0.05)
+
+    samples = [[torch.randn(3, 8, 8)] for _ in range(10)]
+
+    async def run():
+        await server.start(front_end=False)
+        outputs = await asyncio.gather(*[server.infer(sample) for sample in samples])
+        await server.stop()
+        return outputs
+
+    outputs = asyncio.run(run())
+
+    with torch.no_grad():
+        for sample, output in zip(samples, outputs):
+            assert(torch.allclose(model([sample[0][None]])[0], output, atol=1.0e-6))
+
+    stats = server.stats()
+    assert(stats['requests'] == 10)
+    assert(max(stats['batch_fill']) <= 4)
+    assert(sum(size * count for size, count in stats['batch_fill'].items()) == 10)
+    assert(stats['p99_ms'] >= stats['p50_ms'])
+
+
+def test_InferenceServer_http():
+    model = tiny_model.TensorNet()
+    server = setka.tools.InferenceServer(model, port=0, preprocess=lambda request: [torch.as_tensor(request)])
+
+    async def request(method, path, body=None):
+        reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+        data = b'' if body is None else json.dumps(body).encode()
+        writer.write(f'{method} {path} HTTP/1.1\r\nContent-Length: {len(data)}\r\n\r\n'.encode() + data)
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        return json.loads(response.split(b'\r\n\r\n', 1)[1].decode())
+
+    async def run():
+        await server.start()
+        output = await request('POST', '/predict', torch.randn(3, 8, 8).tolist())
+        stats = await request('GET', '/stats')
+        await server.stop()
+        return output, stats
+
+    output, stats = asyncio.run(run())
+
+    assert(len(output) == 10)
+    assert(stats['requests'] == 1)
@@ -0,0 +1,46 @@
+import setka
+import torch
+import pandas
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),  '..'))
+import test_dataset
+
+from test_metrics import tensor_acc as acc
+
+
+class ForwardNet(torch.nn.Module):
+    # TensorNet overrides __call__, so it can not be symbolically traced for the static quantization
+    def __init__(self):
+        super().__init__()
+        self.fc = torch.nn.Linear(3, 10)
+
+    def forward(self, input):
+        return self.fc(input[0].mean(dim=-1).mean(dim=-1))
+
+
+def test_PostTrainingQuantization():
+    ds = test_dataset.CIFAR10()
+
+    model = ForwardNet()
+    fname = os.path.join('runs', 'quantization', 'weights.pth.tar')
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    torch.save(model.state_dict(), fname)
+
+    ptq = setka.tools.PostTrainingQuantization(
+        ForwardNet, ds, [acc], weights=fname, batch_size=32, n_calibration=2, n_iterations=2, n_runs=2)
+    results = ptq.run()
+
+    assert(list(results['variant']) == ['fp32', 'dynamic', 'static'])
+    assert(all(pandas.isna(error) for error in results['error']))
+    assert(results['samples_per_s'][1] > 0 and results['samples_per_s'][2] > 0)
+    assert(abs(results['tensor_acc_delta'][1]) < 0.1)
+
+    # the quantized model is usable in the usual pipeline
+    trainer = setka.base.Trainer(pipes=[
+                                     setka.pipes.DatasetHandler(ds, batch_size=32, limits=2),
+                                     setka.pipes.ModelHandler(ptq.models['dynamic'])
+                                 ])
+    ids, output = next(iter(trainer.run_predict('valid')))
+    assert(output.shape == (32, 10))
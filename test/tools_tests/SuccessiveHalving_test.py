@@ -0,0 +1,77 @@
+import setka
+import torch
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),  '..'))
+import tiny_model
+import test_dataset
+
+from test_metrics import tensor_loss as loss
+from test_metrics import tensor_acc as acc
+
+
+def make_trainer(config):
+    ds = test_dataset.CIFAR10()
+    model = tiny_model.TensorNet()
+
+    return setka.base.Trainer(pipes=[
+                                  setka.pipes.DatasetHandler(ds, batch_size=32, limits=2),
+                                  setka.pipes.ModelHandler(model),
+                                  setka.pipes.LossHandler(loss),
+                                  setka.pipes.OneStepOptimizers(
+                                     [
+                                         setka.base.Optimizer(
+                                             model,
+                                             torch.optim.SGD,
+                                             lr=config['lr'])
+                                     ]
+                                  ),
+                                  setka.pipes.ComputeMetrics([loss, acc])
+                              ])
+
+
+def test_SuccessiveHalving(tmp_path):
+    search = setka.tools.SuccessiveHalving(
+        make_trainer,
+        [{'lr': 1.0e-1}, {'lr': 1.0e-2}, {'lr': 1.0e-3}, {'lr': 0.0}],
+        'tensor_loss',
+        min_epochs=1,
+        max_epochs=4,
+        eta=2,
+        log_dir=str(tmp_path),
+        name='successive_halving')
+
+    results = search.run()
+
+    assert(search.rungs() == [1, 2, 4])
+    assert(len(results) == 4 + 2 + 1)
+    assert(results[results['rung'] == 2]['epochs'].iloc[0] == 4)
+    assert(search.best() in search.configs)
+
+    # the dumps of the previous search with the same name are not resumed
+    second = setka.tools.SuccessiveHalving(
+        make_trainer, search.configs, 'tensor_loss', min_epochs=1, max_epochs=4, eta=2,
+        log_dir=str(tmp_path), name='successive_halving', search_id='second')
+    assert(second.root_dir != search.root_dir)
+    assert(not os.path.exists(second.root_dir))
+
+
+def test_SuccessiveHalving_workers(tmp_path):
+    search = setka.tools.SuccessiveHalving(
+        make_trainer,
+        [{'lr': 1.0e-1}, {'lr': 1.0e-2}],
+        'tensor_loss',
+        min_epochs=1,
+        max_epochs=2,
+        eta=2,
+        workers=2,
+        log_dir=str(tmp_path),
+        name='successive_halving_workers')
+
+    results = search.run()
+
+    assert(len(results) == 2 + 1)
+    assert(results['tensor_loss'].notna().all())
+    assert(os.path.exists(search.trial_path(list(results['trial'])[-1])))
+    assert(search.best() in search.configs)